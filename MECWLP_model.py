@@ -1,23 +1,61 @@
-import xpress as xp
+import time
 import numpy as np
 import postprocessing
 import pandas as pd
 import constants
+import matrix_builder
+import solvers
+import arc_sparsification
+import lazy_linking
+import rolling_horizon
+import results
+import warm_start
+import instrumentation
 
-def MECWLP_model(Candidates, Times, Suppliers, Products,Customers,
-                 Operating_df, Setup_df, CostSupplierCandidate,
-                 DemandPeriodsGrouped, CostCandidateCustomers,
-                 Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict):
-    # =============================================================================
-    # Build optimization model
-    # =============================================================================
+@instrumentation.timed()
+def build_MECWLP_problem(Candidates, Times, Suppliers, Products,Customers,
+                         Operating_df, Setup_df, CostSupplierCandidate,
+                         DemandPeriodsGrouped, CostCandidateCustomers,
+                         Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict,
+                         build_method=None):
+    """
+    Build (but don't solve) the MECWLP model.
+
+    build_method (default constants.model_build_method()) chooses between
+    'generator': one prob.addVariable/xp.Sum term at a time
+    'matrix': objective and constraint rows assembled as sparse arrays and loaded in one call,
+              see matrix_builder. Both give the same model.
+    The aggregated formulation (constants.model_formulation()) is only assembled as arrays.
+
+    Returns the problem and the build, open, supply, warehoused, delivered variable arrays.
+    """
+    if build_method is None:
+        build_method = constants.model_build_method()
+
+    xp = solvers.import_xpress()
     prob = xp.problem("MECWLP")
 
-    xp.setOutputEnabled(True)
-    #prob.controls.maxtime = -300
+    aggregated = constants.model_formulation() == "aggregated"
+    if build_method == "matrix" or aggregated:
+        matrices = matrix_builder.build_MECWLP_matrices(Candidates, Times, Suppliers, Products, Customers,
+                                                        Operating_df, Setup_df, CostSupplierCandidate,
+                                                        DemandPeriodsGrouped, CostCandidateCustomers,
+                                                        Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict,
+                                                        aggregated=aggregated)
+        variables = matrix_builder.load_into_xpress(prob, matrices)
+        return (prob, variables["build"], variables["open"], variables["supply"],
+                variables["warehoused"], variables["delivered"])
+    elif build_method != "generator":
+        raise ValueError(f"Unknown build method: {build_method}")
+
     # =============================================================================
     # Declarations
     # =============================================================================
+    # variables and transport costs are indexed by the candidate's position in Candidates
+    # (candidates may have been screened out, see candidate_screening)
+    pos = {c: i for i, c in enumerate(Candidates)}
+    instrumentation.start_stage("variables")
+
 
     build = np.array([prob.addVariable(name='build_{0}'.format(c), vartype=xp.binary)
                     for c in Candidates], dtype=xp.npvar).reshape(len(Candidates))
@@ -38,98 +76,224 @@ def MECWLP_model(Candidates, Times, Suppliers, Products,Customers,
                             len(Candidates), len(Customers), len(Products), len(Times)
                         )
 
+    instrumentation.end_stage()
+    instrumentation.start_stage("objective")
     #=========================================================================================================
     # Objective function
     # ========================================================================================================
     # Need to factor in the fixed costs related to the number of vans you have to send!!!!!
-    prob.setObjective(xp.Sum(open[c-1,t-1]*Operating_df["Operating cost"][c-1] for c in Candidates for t in Times) +
-                    xp.Sum(build[c-1]*Setup_df["Setup cost"][c-1] for c in Candidates) +
-                    xp.Sum(supply[c-1, s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)]*CostSupplierCandidate[(s, c)]
+    prob.setObjective(xp.Sum(open[pos[c],t-1]*Operating_df["Operating cost"][c-1] for c in Candidates for t in Times) +
+                    xp.Sum(build[pos[c]]*Setup_df["Setup cost"][c-1] for c in Candidates) +
+                    xp.Sum(supply[pos[c], s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)]*CostSupplierCandidate[s-1, pos[c]]
                             for c in Candidates for s in Suppliers for t in Times) +
-                    xp.Sum(delivered[c-1, k, p-1, t-1]*DemandPeriodsGrouped[Customers[k], p, t]*CostCandidateCustomers[(c, Customers[k], t)] 
+                    xp.Sum(delivered[pos[c], k, p-1, t-1]*DemandPeriodsGrouped[Customers[k], p, t]*CostCandidateCustomers[pos[c], k, t-1] 
                             for c in Candidates for k in range(len(Customers)) for p in Products for t in Times), 
                     sense = xp.minimize)
 
+    instrumentation.end_stage()
+    instrumentation.start_stage("constraints")
     # ========================================================================================================
     # Constraints
     # ========================================================================================================
     #Build & open constraints
     # if a warehouse is open, it must have been built
-    prob.addConstraint(xp.Sum(open[c-1, t-1] for t in Times) <= len(Times)*build[c-1] for c in Candidates)
+    prob.addConstraint(xp.Sum(open[pos[c], t-1] for t in Times) <= len(Times)*build[pos[c]] for c in Candidates)
     # a warehouse remains open
-    prob.addConstraint(open[c-1, t-1] >= open[c-1, t-2] for c in Candidates for t in Times if t != 1)
+    prob.addConstraint(open[pos[c], t-1] >= open[pos[c], t-2] for c in Candidates for t in Times if t != 1)
 
     # SUPPLIER CONSTRAINTS
     # Can't supply to a warehouse that is not open.
-    prob.addConstraint(supply[c-1, s-1, t-1] <= open[c-1, t-1]
+    prob.addConstraint(supply[pos[c], s-1, t-1] <= open[pos[c], t-1]
                                for c in Candidates for s in Suppliers for t in Times)   
     # will always supply enough in each time period to meet total demand but can add a specific constraint
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1]
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1]
                               for s in Suppliers if Suppliers_df["Product group"][s]==p
                                for c in Candidates )==1 
                        for p in Products for t in Times) 
     # can't supply more than total supplier capacity
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
                               for c in Candidates) <= Suppliers_df["Capacity"][s] for s in Suppliers for t in Times)
     # No point in supplying more than total product demand in any period
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
                         for c in Candidates) <= TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)]
                           for s in Suppliers for t in Times)
     # update warehouse stock
-    prob.addConstraint(warehoused[c-1, p-1, t-1] == xp.Sum(supply[c-1, s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
+    prob.addConstraint(warehoused[pos[c], p-1, t-1] == xp.Sum(supply[pos[c], s-1, t-1]*TotalDemandProductPeriod_dict[(Suppliers_df["Product group"][s], t)] 
                             for s in Suppliers if Suppliers_df["Product group"][s] == p)
                             for c in Candidates for p in Products for t in Times)
     #warehouse cannot hold more stock than its capacity
-    prob.addConstraint(xp.Sum(warehoused[c-1, p-1, t-1] for p in Products) <= Candidates_df["Capacity"][c]
+    prob.addConstraint(xp.Sum(warehoused[pos[c], p-1, t-1] for p in Products) <= Candidates_df["Capacity"][c]
                     for c in Candidates for t in Times)
     #DELIVERY CONSTRAINTS
 
     # Cannot deliver from a warehouse that is not open
-    prob.addConstraint(delivered[c-1, k, p-1, t-1] <= open[c-1, t-1]
+    prob.addConstraint(delivered[pos[c], k, p-1, t-1] <= open[pos[c], t-1]
                     for c in Candidates for k in range(len(Customers)) for p in Products for t in Times)
     #Ensure we meet customer demand    
-    prob.addConstraint(xp.Sum(delivered[c-1, k, p-1, t-1] for c in Candidates)==1
+    prob.addConstraint(xp.Sum(delivered[pos[c], k, p-1, t-1] for c in Candidates)==1
                     for k in range(len(Customers)) for p in Products for t in Times)
     #can't deliver more than the warehouses hold
-    prob.addConstraint(xp.Sum(delivered[c-1, k, p-1, t-1]*DemandPeriodsGrouped[Customers[k], p, t]
-                            for k in range(len(Customers))) <= warehoused[c-1, p-1, t-1]
+    prob.addConstraint(xp.Sum(delivered[pos[c], k, p-1, t-1]*DemandPeriodsGrouped[Customers[k], p, t]
+                            for k in range(len(Customers))) <= warehoused[pos[c], p-1, t-1]
                     for c in Candidates for p in Products for t in Times)
-    
 
-    prob.solve()
-    print(f'The objective function value is {prob.attributes.objval}')
+    instrumentation.end_stage()
+    return prob, build, open, supply, warehoused, delivered
+
+
+@instrumentation.timed()
+def MECWLP_model(Candidates, Times, Suppliers, Products,Customers,
+                 Operating_df, Setup_df, CostSupplierCandidate,
+                 DemandPeriodsGrouped, CostCandidateCustomers,
+                 Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict,
+                 mip_start=None):
+    """
+    Build and solve the MECWLP model, starting from mip_start, the build/open decisions of an
+    earlier run (a warm_start.FirstStageSolution), when given.
+    Returns the solver, status, objective, costs and times, and the build/open decisions as first_stage.
+    """
+    backend = constants.solver_backend()
+    if mip_start is not None:
+        mip_start = warm_start.get_mip_start(mip_start, Candidates, Times)
+    model_inputs = (Candidates, Times, Suppliers, Products, Customers,
+                    Operating_df, Setup_df, CostSupplierCandidate,
+                    DemandPeriodsGrouped, CostCandidateCustomers,
+                    Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict)
+    # =============================================================================
+    # Build optimization model
+    # =============================================================================
+    build_start = time.perf_counter()
+    # rolling horizon, sparse arcs and lazy linking build and solve the model together (one at a time, see main.validate)
+    solved = constants.rolling_horizon_window() is not None or arc_sparsification.enabled() or lazy_linking.enabled()
+    if constants.rolling_horizon_window() is not None:
+        # a window of periods at a time, see rolling_horizon
+        result, blocks, build_time = rolling_horizon.solve_rolling_horizon(
+            "MECWLP", model_inputs,
+            backend, threads=constants.solver_threads(), output=True, mip_start=mip_start)
+    elif arc_sparsification.enabled():
+        # delivery variables only from the candidates nearest each cluster, see arc_sparsification
+        result, matrices, build_time = arc_sparsification.solve_with_sparse_arcs(
+            "MECWLP", model_inputs,
+            backend, threads=constants.solver_threads(), output=True, mip_start=mip_start)
+        blocks = matrices.blocks
+    elif lazy_linking.enabled():
+        # open linking rows only where the LP relaxation violates them, see lazy_linking
+        result, matrices, build_time = lazy_linking.solve_with_lazy_linking(
+            "MECWLP", model_inputs,
+            backend, threads=constants.solver_threads(), output=True, mip_start=mip_start)
+        blocks = matrices.blocks
+    elif backend == "xpress":
+        prob, build, open, supply, warehoused, delivered = build_MECWLP_problem(
+            Candidates, Times, Suppliers, Products, Customers,
+            Operating_df, Setup_df, CostSupplierCandidate,
+            DemandPeriodsGrouped, CostCandidateCustomers,
+            Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict)
+    else:
+        # the other solver backends are handed the model as arrays, see solvers.py
+        matrices = matrix_builder.build_MECWLP_matrices(
+            Candidates, Times, Suppliers, Products, Customers,
+            Operating_df, Setup_df, CostSupplierCandidate,
+            DemandPeriodsGrouped, CostCandidateCustomers,
+            Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict, names=False,
+            aggregated=constants.model_formulation() == "aggregated")
+
+    if not solved:
+        build_time = time.perf_counter() - build_start
+
+        if backend == "xpress":
+            solvers.import_xpress().setOutputEnabled(True)
+            if constants.solver_threads() is not None:
+                prob.controls.threads = constants.solver_threads()
+            #prob.controls.maxtime = -300
+
+            if mip_start is not None:
+                prob.addMipSol(mip_start, list(build) + list(open.ravel()))
+            with instrumentation.stage("solve"):
+                instrumentation.record(backend=backend, columns=prob.attributes.cols, rows=prob.attributes.rows,
+                                       nonzeros=prob.attributes.elems)
+                prob.solve()
+            result = solvers.get_xpress_result(prob, with_solution=False)
+        else:
+            blocks = matrices.blocks
+            result = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads(), output=True,
+                                            mip_start=mip_start)
+
+    if not result.has_solution:
+        postprocessing.postprocessing(result)
+        return {"solver": backend, "formulation": constants.model_formulation(), "status": result.status,
+                "obj_val": result.objective, "best_bound": result.bound, "gap": result.gap, "operating_costs": np.nan,
+                "building_costs": np.nan, "supply_costs": np.nan, "delivery_costs": np.nan,
+                "build_time": build_time, "solve_time": result.solve_time,
+                "first_stage": None}
+
+    print(f'The objective function value is {result.objective}')
     
     #print and save some summary stats
     #the period when warehouses get built/opened is saved off into
     #the csv's build.csv and open.csv, respectively.
 
-    operating_costs = 0
-    building_costs = 0
-    supply_costs = 0
-    delivery_costs = 0
-    open = prob.getSolution(open)
-    build = prob.getSolution(build)
-    supply = prob.getSolution(supply)
-    delivery = prob.getSolution(delivered)
-    for c in Candidates:
-        building_costs = building_costs + build[c-1]*Setup_df["Setup cost"][c-1]
-        for t in Times:
-            operating_costs = operating_costs + open[c-1,t-1]*Operating_df["Operating cost"][c-1]
+    instrumentation.start_stage("extraction")
+    if backend == "xpress" and not solved:
+        open = prob.getSolution(open)
+        build = prob.getSolution(build)
+        supply = prob.getSolution(supply)
+        delivered = prob.getSolution(delivered)
+    elif "supply" in blocks:
+        open, build, supply, delivered = results.get_solution_values(result.x, blocks,
+                                                                     ["open", "build", "supply", "delivered"])
+    else:
+        # the rolling horizon (without polishing) only keeps the build/open plan
+        open, build = results.get_solution_values(result.x, blocks, ["open", "build"])
+        supply = delivered = None
+    arrays_list = matrix_builder.get_model_arrays_list("MECWLP", model_inputs)
+    costs = results.get_cost_breakdown(arrays_list, build, open, supply, delivered)
+    operating_costs, building_costs = costs["operating_costs"], costs["building_costs"]
+    supply_costs, delivery_costs = costs["supply_costs"], costs["delivery_costs"]
+
+    instrumentation.end_stage()
 
+    instrumentation.start_stage("save_results")
     build_df = pd.DataFrame(data = build, index = Candidates)
     build_df = build_df[build_df.sum(axis=1) > 0.1]
     open_df = pd.DataFrame(data = open, index = Candidates, columns = Times)
     open_df = open_df[open_df.sum(axis=1)>0.1]
 
-    build_df.to_csv(f"build_{constants.clustertype()}.csv")
-    open_df.to_csv(f"open_{constants.clustertype()}.csv")
-    vals = pd.DataFrame({"obj_val": [prob.attributes.objval],
+    build_df.to_csv(constants.get_output_path(f"build_{constants.clustertype()}.csv"))
+    open_df.to_csv(constants.get_output_path(f"open_{constants.clustertype()}.csv"))
+    vals = pd.DataFrame({"solver": [backend],
+                        "obj_val": [result.objective],
                         "operating_costs": [operating_costs],
                         "building_costs": [building_costs],
-                        "run_time": [prob.attributes.time]})
-    vals.to_csv(f"model_stats_{constants.clustertype()}.csv")
+                        "supply_costs": [supply_costs],
+                        "delivery_costs": [delivery_costs],
+                        "build_time": [build_time],
+                        "run_time": [result.solve_time]})
+    vals.to_csv(constants.get_output_path(f"model_stats_{constants.clustertype()}.csv"))
 
     print(f"operating costs: {operating_costs}")
     print(f"building costs: {building_costs}")
+    print(f"supply costs: {supply_costs}")
+    print(f"delivery costs: {delivery_costs}")
+
+    # the nonzero supply and delivery flows, with their quantities and costs
+    if supply is not None:
+        flows = results.get_flows(arrays_list, supply, delivered, Candidates, Suppliers, Customers, Products, Times)
+        results.save_flows(flows, constants.get_output_path(f"flows_{constants.clustertype()}"))
+
+    instrumentation.end_stage()
+
+    postprocessing.postprocessing(result)
 
-    postprocessing.postprocessing(prob)
+    return {"solver": backend,
+            "formulation": constants.model_formulation(),
+            "status": result.status,
+            "obj_val": result.objective,
+            "best_bound": result.bound,
+            "gap": result.gap,
+            "operating_costs": operating_costs,
+            "building_costs": building_costs,
+            "supply_costs": supply_costs,
+            "delivery_costs": delivery_costs,
+            "build_time": build_time,
+            "solve_time": result.solve_time,
+            "first_stage": warm_start.get_first_stage_solution(Candidates, Times, build, open)}
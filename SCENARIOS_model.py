@@ -1,23 +1,64 @@
-import xpress as xp
+import time
 import numpy as np
 import postprocessing
 import pandas as pd
 import constants
+import matrix_builder
+import solvers
+import arc_sparsification
+import lazy_linking
+import rolling_horizon
+import results
+import warm_start
+import instrumentation
 
-def SCENARIOS_model(Candidates, Times, Suppliers, Products,Customers, Scenarios,
-                 Operating_df, Setup_df, CostSupplierCandidate,
-                 DemandPeriodsGrouped, CostCandidateCustomers,
-                 Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict):
-    # =============================================================================
-    # Build optimization model
-    # =============================================================================
+@instrumentation.timed()
+def build_SCENARIOS_problem(Candidates, Times, Suppliers, Products,Customers, Scenarios,
+                            Operating_df, Setup_df, CostSupplierCandidate,
+                            DemandPeriodsGrouped, CostCandidateCustomers,
+                            Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict,
+                            build_method=None):
+    """
+    Build (but don't solve) the SCENARIOS model.
+
+    build_method (default constants.model_build_method()) chooses between
+    'generator': one prob.addVariable/xp.Sum term at a time
+    'matrix': one scenario's constraint block laid out as a sparse matrix and stacked for all scenarios,
+              see matrix_builder. Same model, with columns and rows ordered scenario by scenario.
+    The aggregated formulation (constants.model_formulation()) is only assembled as arrays.
+
+    Returns the problem and the build, open, supply, warehoused, delivered variable arrays.
+    """
+    if build_method is None:
+        build_method = constants.model_build_method()
+
+    xp = solvers.import_xpress()
     prob = xp.problem("SCENARIOS")
 
-    xp.setOutputEnabled(True)
-    prob.controls.maxtime = -3600
+    aggregated = constants.model_formulation() == "aggregated"
+    if build_method == "matrix" or aggregated:
+        matrices = matrix_builder.build_SCENARIOS_matrices(Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                                                           Operating_df, Setup_df, CostSupplierCandidate,
+                                                           DemandPeriodsGrouped, CostCandidateCustomers,
+                                                           Suppliers_df, Candidates_df,
+                                                           TotalDemandProductPeriodScenarios_dict,
+                                                           aggregated=aggregated)
+        variables = matrix_builder.load_into_xpress(prob, matrices)
+        return (prob, variables["build"], variables["open"], variables["supply"],
+                variables["warehoused"], variables["delivered"])
+    elif build_method != "generator":
+        raise ValueError(f"Unknown build method: {build_method}")
+
     # =============================================================================
     # Declarations
     # =============================================================================
+    # variables and transport costs are indexed by the candidate's position in Candidates
+    # (candidates may have been screened out, see candidate_screening), and by the scenario's position
+    # in Scenarios (scenarios kept by scenario_reduction keep their labels)
+    pos = {c: i for i, c in enumerate(Candidates)}
+    sc_pos = {sc: i for i, sc in enumerate(Scenarios)}
+    instrumentation.start_stage("variables")
+
 
     build = np.array([prob.addVariable(name='build_{0}'.format(c), vartype=xp.binary)
                     for c in Candidates], dtype=xp.npvar).reshape(len(Candidates))
@@ -39,103 +80,233 @@ def SCENARIOS_model(Candidates, Times, Suppliers, Products,Customers, Scenarios,
                             len(Candidates), len(Customers), len(Products), len(Times), len(Scenarios)
                         )
 
+    instrumentation.end_stage()
+    instrumentation.start_stage("objective")
     #=========================================================================================================
     # Objective function
     # ========================================================================================================
-    prob.setObjective(xp.Sum(open[c-1,t-1]*Operating_df["Operating cost"][c-1] for c in Candidates for t in Times) +
-                    xp.Sum(build[c-1]*Setup_df["Setup cost"][c-1] for c in Candidates) +
-                    (1/len(Scenarios))*xp.Sum(
-                    xp.Sum(supply[c-1, s-1, t-1, sc-1]*TotalDemandProductPeriodScenarios_dict[sc-1][(Suppliers_df["Product group"][s], t)]*CostSupplierCandidate[(s, c)]
+    # each scenario weighted by its probability, 1/len(Scenarios) unless Scenarios gives them
+    probability = matrix_builder.get_scenario_probabilities(Scenarios)
+    prob.setObjective(xp.Sum(open[pos[c],t-1]*Operating_df["Operating cost"][c-1] for c in Candidates for t in Times) +
+                    xp.Sum(build[pos[c]]*Setup_df["Setup cost"][c-1] for c in Candidates) +
+                    xp.Sum(
+                    xp.Sum(probability[sc_pos[sc]]*supply[pos[c], s-1, t-1, sc_pos[sc]]*TotalDemandProductPeriodScenarios_dict[sc_pos[sc]][(Suppliers_df["Product group"][s], t)]*CostSupplierCandidate[s-1, pos[c]]
                             for c in Candidates for s in Suppliers for t in Times for sc in Scenarios) +
-                    xp.Sum(delivered[c-1, k, p-1, t-1, sc-1]*DemandPeriodsGrouped[sc-1][Customers[k], p, t]*CostCandidateCustomers[sc-1][(c, Customers[k], t)] 
+                    xp.Sum(probability[sc_pos[sc]]*delivered[pos[c], k, p-1, t-1, sc_pos[sc]]*DemandPeriodsGrouped[sc_pos[sc]][Customers[k], p, t]*CostCandidateCustomers[sc_pos[sc]][pos[c], k, t-1] 
                             for c in Candidates for k in range(len(Customers)) for p in Products for t in Times for sc in Scenarios)), 
                     sense = xp.minimize)
 
+    instrumentation.end_stage()
+    instrumentation.start_stage("constraints")
     # ========================================================================================================
     # Constraints
     # ========================================================================================================
     # warehouses can only be built in one time period
     # Warehouse remains open from the year it's built onwards
-    prob.addConstraint(xp.Sum(open[c-1, t-1] for t in Times) <= len(Times)*build[c-1] for c in Candidates)
-    prob.addConstraint(open[c-1, t-1] >= open[c-1, t-2] for c in Candidates for t in Times if t != 1)
+    prob.addConstraint(xp.Sum(open[pos[c], t-1] for t in Times) <= len(Times)*build[pos[c]] for c in Candidates)
+    prob.addConstraint(open[pos[c], t-1] >= open[pos[c], t-2] for c in Candidates for t in Times if t != 1)
     # SUPPLIER CONSTRAINTS
     # Can't supply to a warehouse that is not open.
-    prob.addConstraint(supply[c-1, s-1, t-1, sc-1] <= open[c-1, t-1]
+    prob.addConstraint(supply[pos[c], s-1, t-1, sc_pos[sc]] <= open[pos[c], t-1]
                                for c in Candidates for s in Suppliers for t in Times for sc in Scenarios)   
     # will always supply enough in each time period to meet total demand but can add a specific constraint
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1, sc-1]
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1, sc_pos[sc]]
                               for s in Suppliers if Suppliers_df["Product group"][s]==p
                                for c in Candidates )==1 
                        for p in Products for t in Times for sc in Scenarios) 
     #  can't supply more than total capacity
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1, sc-1]*TotalDemandProductPeriodScenarios_dict[sc-1][(Suppliers_df["Product group"][s], t)]
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1, sc_pos[sc]]*TotalDemandProductPeriodScenarios_dict[sc_pos[sc]][(Suppliers_df["Product group"][s], t)]
                                for c in Candidates) <= Suppliers_df["Capacity"][s]
                         for s in Suppliers for t in Times for sc in Scenarios)
     # No point in supplying more than total product demand in any period
-    prob.addConstraint(xp.Sum(supply[c-1, s-1, t-1]*TotalDemandProductPeriodScenarios_dict[sc-1][(Suppliers_df["Product group"][s], t)] 
-                        for c in Candidates) <= TotalDemandProductPeriodScenarios_dict[sc-1][(Suppliers_df["Product group"][s], t)]
+    prob.addConstraint(xp.Sum(supply[pos[c], s-1, t-1, sc_pos[sc]]*TotalDemandProductPeriodScenarios_dict[sc_pos[sc]][(Suppliers_df["Product group"][s], t)] 
+                        for c in Candidates) <= TotalDemandProductPeriodScenarios_dict[sc_pos[sc]][(Suppliers_df["Product group"][s], t)]
                           for s in Suppliers for t in Times for sc in Scenarios)
     # update warehouse stock
-    prob.addConstraint(warehoused[c-1, p-1, t-1, sc-1] == xp.Sum(supply[c-1, s-1, t-1, sc-1]*TotalDemandProductPeriodScenarios_dict[sc-1][(Suppliers_df["Product group"][s], t)]
+    prob.addConstraint(warehoused[pos[c], p-1, t-1, sc_pos[sc]] == xp.Sum(supply[pos[c], s-1, t-1, sc_pos[sc]]*TotalDemandProductPeriodScenarios_dict[sc_pos[sc]][(Suppliers_df["Product group"][s], t)]
                             for s in Suppliers if Suppliers_df["Product group"][s] == p)
                             for c in Candidates for p in Products for t in Times for sc in Scenarios)
     # Can't carry more stock than max capacity
-    prob.addConstraint(xp.Sum(warehoused[c-1, p-1, t-1, sc-1] for p in Products) <= Candidates_df["Capacity"][c]
+    prob.addConstraint(xp.Sum(warehoused[pos[c], p-1, t-1, sc_pos[sc]] for p in Products) <= Candidates_df["Capacity"][c]
                         for c in Candidates for t in Times for sc in Scenarios)
     # Can't carry any stock in a warehouse that isn't open
-    #prob.addConstraint(xp.Sum(warehoused[c-1, p-1, t-1, sc-1] for p in Products) <= Candidates_df["Capacity"][c]*open[c-1, t-1]
+    #prob.addConstraint(xp.Sum(warehoused[pos[c], p-1, t-1, sc_pos[sc]] for p in Products) <= Candidates_df["Capacity"][c]*open[pos[c], t-1]
     #                for c in Candidates for t in Times for sc in Scenarios)
     #DELIVERY CONSTRAINTS
     # Cannot deliver from a warehouse that is not open
-    prob.addConstraint(delivered[c-1, k, p-1, t-1, sc-1] <= open[c-1, t-1]
+    prob.addConstraint(delivered[pos[c], k, p-1, t-1, sc_pos[sc]] <= open[pos[c], t-1]
                     for c in Candidates for k in range(len(Customers)) for p in Products for t in Times for sc in Scenarios)
     #ensure we meed customer demand
-    #prob.addConstraint(xp.Sum(delivered[c-1, k, p-1, t-1] for c in Candidates) >= DemandPeriodsGrouped[Customers[k], p, t]
+    #prob.addConstraint(xp.Sum(delivered[pos[c], k, p-1, t-1] for c in Candidates) >= DemandPeriodsGrouped[Customers[k], p, t]
     #                   for k in range(len(Customers)) for p in Products for t in Times)
-    prob.addConstraint(xp.Sum(delivered[c-1, k, p-1, t-1, sc-1] for c in Candidates)==1
+    prob.addConstraint(xp.Sum(delivered[pos[c], k, p-1, t-1, sc_pos[sc]] for c in Candidates)==1
                     for k in range(len(Customers)) for p in Products for t in Times for sc in Scenarios)
     #can't deliver more than the warehouses hold
-    prob.addConstraint(xp.Sum(delivered[c-1, k, p-1, t-1, sc-1]*DemandPeriodsGrouped[sc-1][Customers[k], p, t]
-                            for k in range(len(Customers))) <= warehoused[c-1, p-1, t-1, sc-1]
+    prob.addConstraint(xp.Sum(delivered[pos[c], k, p-1, t-1, sc_pos[sc]]*DemandPeriodsGrouped[sc_pos[sc]][Customers[k], p, t]
+                            for k in range(len(Customers))) <= warehoused[pos[c], p-1, t-1, sc_pos[sc]]
                     for c in Candidates for p in Products for t in Times for sc in Scenarios)
-    
 
-    prob.solve()
-    print(f'The objective function value for scenarios is {prob.attributes.objval}')
+    instrumentation.end_stage()
+    return prob, build, open, supply, warehoused, delivered
+
+
+@instrumentation.timed()
+def SCENARIOS_model(Candidates, Times, Suppliers, Products,Customers, Scenarios,
+                 Operating_df, Setup_df, CostSupplierCandidate,
+                 DemandPeriodsGrouped, CostCandidateCustomers,
+                 Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict,
+                 mip_start=None):
+    """
+    Build and solve the SCENARIOS model, starting from mip_start, the build/open decisions of an
+    earlier run (a warm_start.FirstStageSolution), when given.
+    Returns the solver, status, objective, costs and times, and the build/open decisions as first_stage.
+    """
+    backend = constants.solver_backend()
+    if mip_start is not None:
+        mip_start = warm_start.get_mip_start(mip_start, Candidates, Times)
+    model_inputs = (Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                    Operating_df, Setup_df, CostSupplierCandidate,
+                    DemandPeriodsGrouped, CostCandidateCustomers,
+                    Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict)
+    # =============================================================================
+    # Build optimization model
+    # =============================================================================
+    build_start = time.perf_counter()
+    # rolling horizon, sparse arcs and lazy linking build and solve the model together (one at a time, see main.validate)
+    solved = constants.rolling_horizon_window() is not None or arc_sparsification.enabled() or lazy_linking.enabled()
+    if constants.rolling_horizon_window() is not None:
+        # a window of periods at a time, see rolling_horizon
+        result, blocks, build_time = rolling_horizon.solve_rolling_horizon(
+            "SCENARIOS", model_inputs,
+            backend, threads=constants.solver_threads(), time_limit=3600, output=True, mip_start=mip_start)
+    elif arc_sparsification.enabled():
+        # delivery variables only from the candidates nearest each cluster, see arc_sparsification
+        result, matrices, build_time = arc_sparsification.solve_with_sparse_arcs(
+            "SCENARIOS", model_inputs,
+            backend, threads=constants.solver_threads(), time_limit=3600, output=True, mip_start=mip_start)
+        blocks = matrices.blocks
+    elif lazy_linking.enabled():
+        # open linking rows only where the LP relaxation violates them, see lazy_linking
+        result, matrices, build_time = lazy_linking.solve_with_lazy_linking(
+            "SCENARIOS", model_inputs,
+            backend, threads=constants.solver_threads(), time_limit=3600, output=True, mip_start=mip_start)
+        blocks = matrices.blocks
+    elif backend == "xpress":
+        prob, build, open, supply, warehoused, delivered = build_SCENARIOS_problem(
+            Candidates, Times, Suppliers, Products, Customers, Scenarios,
+            Operating_df, Setup_df, CostSupplierCandidate,
+            DemandPeriodsGrouped, CostCandidateCustomers,
+            Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict)
+    else:
+        # the other solver backends are handed the model as arrays, see solvers.py
+        matrices = matrix_builder.build_SCENARIOS_matrices(
+            Candidates, Times, Suppliers, Products, Customers, Scenarios,
+            Operating_df, Setup_df, CostSupplierCandidate,
+            DemandPeriodsGrouped, CostCandidateCustomers,
+            Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict, names=False,
+            aggregated=constants.model_formulation() == "aggregated")
+
+    if not solved:
+        build_time = time.perf_counter() - build_start
+
+        if backend == "xpress":
+            solvers.import_xpress().setOutputEnabled(True)
+            if constants.solver_threads() is not None:
+                prob.controls.threads = constants.solver_threads()
+            prob.controls.maxtime = -3600
+
+            if mip_start is not None:
+                prob.addMipSol(mip_start, list(build) + list(open.ravel()))
+            with instrumentation.stage("solve"):
+                instrumentation.record(backend=backend, columns=prob.attributes.cols, rows=prob.attributes.rows,
+                                       nonzeros=prob.attributes.elems)
+                prob.solve()
+            result = solvers.get_xpress_result(prob, with_solution=False)
+        else:
+            blocks = matrices.blocks
+            result = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads(), time_limit=3600, output=True,
+                                            mip_start=mip_start)
+
+    if not result.has_solution:
+        postprocessing.postprocessing(result)
+        return {"solver": backend, "formulation": constants.model_formulation(), "status": result.status,
+                "obj_val": result.objective, "best_bound": result.bound, "gap": result.gap, "operating_costs": np.nan,
+                "building_costs": np.nan, "supply_costs": np.nan, "delivery_costs": np.nan,
+                "build_time": build_time, "solve_time": result.solve_time,
+                "first_stage": None}
+
+    print(f'The objective function value for scenarios is {result.objective}')
     
     #print and save some summary stats
     #the period when warehouses get built/opened is saved off into
     #the csv's build.csv and open.csv, respectively.
 
-    operating_costs = 0
-    building_costs = 0
-    supply_costs = 0
-    delivery_costs = 0
-    open = prob.getSolution(open)
-    build = prob.getSolution(build)
-    supply = prob.getSolution(supply)
-    delivery = prob.getSolution(delivered)
-    for c in Candidates:
-        building_costs = building_costs + build[c-1]*Setup_df["Setup cost"][c-1]
-        for t in Times:
-            operating_costs = operating_costs + open[c-1,t-1]*Operating_df["Operating cost"][c-1]
-            
+    instrumentation.start_stage("extraction")
+    if backend == "xpress" and not solved:
+        open = prob.getSolution(open)
+        build = prob.getSolution(build)
+        supply = prob.getSolution(supply)
+        delivered = prob.getSolution(delivered)
+    elif "supply" in blocks:
+        open, build, supply, delivered = results.get_solution_values(result.x, blocks,
+                                                                     ["open", "build", "supply", "delivered"])
+    else:
+        # the rolling horizon (without polishing) only keeps the build/open plan
+        open, build = results.get_solution_values(result.x, blocks, ["open", "build"])
+        supply = delivered = None
+    arrays_list = matrix_builder.get_model_arrays_list("SCENARIOS", model_inputs)
+    costs = results.get_cost_breakdown(arrays_list, build, open, supply, delivered)
+    operating_costs, building_costs = costs["operating_costs"], costs["building_costs"]
+    supply_costs, delivery_costs = costs["supply_costs"], costs["delivery_costs"]
+
+    instrumentation.end_stage()
+
+    instrumentation.start_stage("save_results")
     build_df = pd.DataFrame(data = build, index = Candidates)
     build_df = build_df[build_df.sum(axis=1) > 0]
     open_df = pd.DataFrame(data = open, index = Candidates, columns = Times)
     open_df = open_df[open_df.sum(axis=1)>0]
 
 
-    build_df.to_csv(f"build_{constants.clustertype()}_scenarios{len(Scenarios)}.csv")
-    open_df.to_csv(f"open_{constants.clustertype()}_scenarios_{len(Scenarios)}.csv")
+    build_df.to_csv(constants.get_output_path(f"build_{constants.clustertype()}_scenarios{len(Scenarios)}.csv"))
+    open_df.to_csv(constants.get_output_path(f"open_{constants.clustertype()}_scenarios_{len(Scenarios)}.csv"))
     vals = pd.DataFrame({"number_of_scenarios": [len(Scenarios)],
-                        "obj_val": [prob.attributes.objval],
+                        "solver": [backend],
+                        "obj_val": [result.objective],
                         "operating_costs": [operating_costs],
                         "building_costs": [building_costs],
-                        "run_time": [prob.attributes.time]})
-    vals.to_csv(f"model_stats_{constants.clustertype()}_scenarios{len(Scenarios)}.csv")
+                        "supply_costs": [supply_costs],
+                        "delivery_costs": [delivery_costs],
+                        "build_time": [build_time],
+                        "run_time": [result.solve_time]})
+    vals.to_csv(constants.get_output_path(f"model_stats_{constants.clustertype()}_scenarios{len(Scenarios)}.csv"))
 
     print(f"operating costs scenarios: {operating_costs}")
     print(f"building costs scenarios: {building_costs}")
+    print(f"supply costs scenarios: {supply_costs}")
+    print(f"delivery costs scenarios: {delivery_costs}")
+
+    # the nonzero supply and delivery flows, with their quantities and costs
+    if supply is not None:
+        flows = results.get_flows(arrays_list, supply, delivered, Candidates, Suppliers, Customers, Products, Times,
+                                  Scenarios)
+        results.save_flows(flows,
+                           constants.get_output_path(f"flows_{constants.clustertype()}_scenarios{len(Scenarios)}"))
+
+    instrumentation.end_stage()
+
+    postprocessing.postprocessing(result)
 
-    postprocessing.postprocessing(prob)
+    return {"solver": backend,
+            "formulation": constants.model_formulation(),
+            "status": result.status,
+            "obj_val": result.objective,
+            "best_bound": result.bound,
+            "gap": result.gap,
+            "operating_costs": operating_costs,
+            "building_costs": building_costs,
+            "supply_costs": supply_costs,
+            "delivery_costs": delivery_costs,
+            "build_time": build_time,
+            "solve_time": result.solve_time,
+            "first_stage": warm_start.get_first_stage_solution(Candidates, Times, build, open)}
@@ -0,0 +1,157 @@
+import time
+from itertools import count
+import numpy as np
+import constants
+import matrix_builder
+import solvers
+import instrumentation
+
+# =============================================================================
+# Arc sparsification of the delivery variables
+#
+# Rather than a delivered[c, k, p, t] (or assigned[c, k, t]) variable from every candidate
+# to every cluster, delivery variables are only created for the candidate-cluster pairs (arcs)
+# likely to be used: the constants.delivery_arcs_per_cluster() cheapest candidates for each
+# cluster, and every candidate within constants.delivery_arc_radius() miles of it.
+#
+# After each solve, the arcs left out are priced with the row duals of
+#   - the LP relaxation of the sparse model, and
+#   - the sparse model's LP with build/open fixed at the solution found.
+# An arc left out has no open linking row in the sparse model; pricing that row at zero
+# keeps the duals feasible for the full model, so if no arc has negative reduced cost the
+# LP relaxation of the full model has the same bound, and the deliveries found are optimal
+# over every arc for the warehouses chosen. Otherwise the arcs with negative reduced cost
+# are added and the model solved again. A sparse model without a feasible solution
+# is widened to twice as many arcs per cluster.
+# =============================================================================
+
+# reduced costs above -REDUCED_COST_TOLERANCE * (1 + |objective coefficient|) don't add an arc
+REDUCED_COST_TOLERANCE = 1e-6
+
+
+def enabled() -> bool:
+    return constants.delivery_arcs_per_cluster() is not None or constants.delivery_arc_radius() is not None
+
+
+def get_delivery_arcs(arrays_list: list, arcs_per_cluster: int = None, radius: float = None) -> np.ndarray:
+    """
+    Purpose of the function is to choose the delivery arcs to create, given matrix_builder.get_model_arrays
+    for each scenario: the arcs_per_cluster cheapest candidates for each cluster and every candidate within
+    radius miles of it, in any period and scenario (every arc when both are None).
+    Returns a boolean (candidate, cluster) array by position.
+    """
+    # cheapest delivery cost per unit of demand, (candidate, cluster)
+    cost = np.min([arrays["cost_candidate_customer"].min(axis=2) for arrays in arrays_list], axis=0)
+    nC, nK = cost.shape
+    if arcs_per_cluster is None and radius is None:
+        return np.ones((nC, nK), dtype=bool)
+
+    arcs = np.zeros((nC, nK), dtype=bool)
+    # every cluster keeps at least its cheapest candidate
+    cheapest = np.argsort(cost, axis=0, kind="stable")[:max(int(arcs_per_cluster or 1), 1)]
+    arcs[cheapest, np.arange(nK)] = True
+    if radius is not None:
+        # transforms.get_CostCandidateCustomers: cost = 2 * distance * cost per mile and tonne / 1000
+        distance = cost * 1000 / (2 * constants.VehicleCostPerMileAndTonneOverall[3])
+        arcs |= distance <= radius
+    return arcs
+
+
+def get_improving_arcs(matrices: matrix_builder.ModelMatrices, arrays_list: list, duals: np.ndarray,
+                       open_values: np.ndarray = None) -> np.ndarray:
+    """
+    Purpose of the function is to price the delivery arcs left out of a model with the row duals of one
+    of its LPs. open_values (candidate, period), when given, skips periods where the warehouse is closed.
+    Returns a boolean (candidate, cluster) array, True for left out arcs with negative reduced cost.
+    """
+    delivered = matrices.blocks["delivered"]
+    nC, nK = delivered.shape[:2]
+    left_out = delivered.reshape(nC, nK, -1)[:, :, 0] < 0
+    aggregated = "assigned" in matrices.blocks
+
+    improving = np.zeros((nC, nK), dtype=bool)
+    for sc, arrays in enumerate(arrays_list):
+        scenario = (Ellipsis, sc) if matrices.name == "SCENARIOS" else Ellipsis
+        demand_duals = duals[matrices.rows["demand"][scenario]]
+        hold_duals = duals[matrices.rows["deliver_hold"][scenario]]
+        grouped_demand = arrays["grouped_demand"]
+        cost = arrays["cost_candidate_customer"]
+
+        if aggregated:
+            # assigned[c, k, t]: demand row (k, t), hold rows (c, p, t) and capacity row (c, t)
+            total_demand = grouped_demand.sum(axis=1)
+            objcoef = arrays["probability"] * total_demand[None] * cost
+            reduced_costs = (objcoef - demand_duals[None]
+                             - np.einsum("kpt,cpt->ckt", grouped_demand, hold_duals)
+                             - total_demand[None] * duals[matrices.rows["deliver_capacity"][scenario]][:, None])
+            is_open = None if open_values is None else open_values[:, None, :]
+        else:
+            # delivered[c, k, p, t]: demand row (k, p, t) and hold row (c, p, t)
+            objcoef = arrays["probability"] * grouped_demand[None] * cost[:, :, None, :]
+            reduced_costs = objcoef - demand_duals[None] - grouped_demand[None] * hold_duals[:, None]
+            is_open = None if open_values is None else open_values[:, None, None, :]
+
+        negative = reduced_costs < -REDUCED_COST_TOLERANCE * (1 + np.abs(objcoef))
+        if is_open is not None:
+            negative &= is_open > 0.5
+        improving |= left_out & negative.reshape(nC, nK, -1).any(axis=2)
+    return improving
+
+
+@instrumentation.timed()
+def solve_with_sparse_arcs(model: str, model_inputs: tuple, backend: str, threads: int = None,
+                           time_limit: float = None, output: bool = False, mip_start: np.ndarray = None):
+    """
+    Purpose of the function is to solve the MECWLP (model 'MECWLP') or SCENARIOS (model 'SCENARIOS') model,
+    given its arguments, with the delivery arcs from get_delivery_arcs, adding the left out arcs that could
+    improve the solution until there are none.
+    The first solve starts from mip_start (build/open values, see solvers.solve_matrices) when given,
+    and each later one from the build/open decisions before it.
+    Returns the SolverResult of the last solve (with the solve time of every solve), its ModelMatrices
+    and the total build time.
+    """
+    arrays_list = matrix_builder.get_model_arrays_list(model, model_inputs)
+    build_matrices = {"MECWLP": matrix_builder.build_MECWLP_matrices,
+                      "SCENARIOS": matrix_builder.build_SCENARIOS_matrices}[model]
+    aggregated = constants.model_formulation() == "aggregated"
+    arcs = get_delivery_arcs(arrays_list, constants.delivery_arcs_per_cluster(), constants.delivery_arc_radius())
+
+    build_time = 0
+    solve_time = 0
+    for iteration in count(1):
+        build_start = time.perf_counter()
+        matrices = build_matrices(*model_inputs, names=False, aggregated=aggregated, arcs=arcs)
+        build_time += time.perf_counter() - build_start
+
+        result = solvers.solve_matrices(matrices, backend, threads=threads, time_limit=time_limit, output=output,
+                                        mip_start=mip_start)
+        solve_time += result.solve_time
+        if not result.has_solution:
+            if result.status != "infeasible" or arcs.all():
+                break
+            arcs |= get_delivery_arcs(arrays_list, 2 * arcs.sum(axis=0).max())
+            print(f"Arc sparsification iteration {iteration}: infeasible, widened to {arcs.sum()} of {arcs.size} arcs")
+            continue
+
+        improving = np.zeros_like(arcs)
+        relaxation = solvers.solve_lp(matrices)
+        lb = matrices.lb.copy()
+        ub = matrices.ub.copy()
+        lb[matrices.entind] = ub[matrices.entind] = np.round(result.x[matrices.entind])
+        plan = solvers.solve_lp(matrices, lb, ub)
+        for lp, open_values in [(relaxation, None), (plan, np.round(result.x[matrices.blocks["open"]]))]:
+            if lp.status != 0:
+                print("Arc sparsification: LP not solved, the arcs left out can't be priced")
+                continue
+            improving |= get_improving_arcs(matrices, arrays_list, lp.duals, open_values)
+
+        print(f"Arc sparsification iteration {iteration}: {arcs.sum()} of {arcs.size} arcs, "
+              f"{matrices.ncols} columns, objective {result.objective}, "
+              f"{improving.sum()} arcs left out with negative reduced cost")
+        if not improving.any():
+            break
+        arcs |= improving
+        mip_start = np.round(result.x[matrices.entind])
+
+    result.solve_time = solve_time
+    return result, matrices, build_time
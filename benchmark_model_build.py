@@ -0,0 +1,76 @@
+import time
+import sys
+from collections import Counter
+import numpy as np
+import xpress as xp
+import MECWLP_model
+import SCENARIOS_model
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# Compare the time taken to build the MECWLP and SCENARIOS models one term at a time ('generator')
+# against assembling them as sparse arrays and loading them in one call ('matrix'),
+# and check both build methods give the same model.
+# Uses the same input data and settings as main.py (see constants.py)
+#
+# python benchmark_model_build.py [number of scenarios for the SCENARIOS model]
+#==================================================================================================================
+
+
+def get_model_matrix(prob) -> dict:
+    """
+    Pull the objective, bounds, column types and constraint rows back out of a built problem,
+    keyed by column name so that neither column order, row order nor term order within a row matters.
+    """
+    ncols = prob.attributes.cols
+    nrows = prob.attributes.rows
+    colnames = prob.getNameList(xp.Namespaces.COLUMN, 0, ncols - 1)
+    obj, lb, ub, coltype = prob.getObj(), prob.getLB(), prob.getUB(), prob.getColType()
+    columns = {colnames[j]: (round(obj[j], 9), lb[j], ub[j], coltype[j]) for j in range(ncols)}
+
+    start, colind, rowcoef = prob.getRows(0, nrows - 1)
+    colind = [c if isinstance(c, (int, np.integer)) else prob.getIndex(c) for c in colind]
+    rowtype, rhs = prob.getRowType(), prob.getRHS()
+    rows = Counter(
+        (rowtype[r], round(rhs[r], 9),
+         tuple(sorted((colnames[colind[e]], round(rowcoef[e], 9)) for e in range(start[r], start[r + 1]) if rowcoef[e] != 0)))
+        for r in range(nrows)
+    )
+    return {"columns": columns, "rows": rows}
+
+
+def time_build(build_function, model_inputs, repeats: int):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        prob = build_function(*model_inputs)[0]
+        times.append(time.perf_counter() - start)
+    return prob, min(times)
+
+
+def benchmark_model_build(n_scenarios: int = 1, repeats: int = 3):
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    SCENARIOS_inputs = get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_scenarios)
+    xp.setOutputEnabled(False)
+
+    timings = {}
+    for model, build_problem, model_inputs in [
+            ("MECWLP", MECWLP_model.build_MECWLP_problem, MECWLP_inputs),
+            (f"SCENARIOS ({n_scenarios} scenarios)", SCENARIOS_model.build_SCENARIOS_problem, SCENARIOS_inputs)]:
+        matrices = {}
+        for build_method in ["generator", "matrix"]:
+            prob, timings[(model, build_method)] = time_build(
+                lambda *args: build_problem(*args, build_method=build_method), model_inputs, repeats)
+            matrices[build_method] = get_model_matrix(prob)
+            print(f"{model} {build_method}: {prob.attributes.cols} columns, {prob.attributes.rows} rows, "
+                  f"{prob.attributes.elems} nonzeros, best build time {timings[(model, build_method)]:.3f}s "
+                  f"over {repeats} runs")
+
+        print(f"{model} speed-up: {timings[(model, 'generator')] / timings[(model, 'matrix')]:.1f}x")
+        print(f"{model} models identical: {matrices['generator'] == matrices['matrix']}")
+
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_model_build(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
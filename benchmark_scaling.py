@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import constants
+import distance_matrix
+import preprocessing
+import matrix_builder
+import solvers
+import synthetic_data
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# Measure how preprocessing (preprocessing + transforms), building and solving the MECWLP and SCENARIOS models
+# scale with the size of the input data, on synthetic instances written by synthetic_data.py.
+#
+# Starting from BASE_SIZE, each of districts, candidates, products, periods, scenarios and clusters is scaled
+# on its own by each of SCALE_FACTORS. For each size, in a fresh process:
+#   - read:        reading the input files (preprocessing.read_input_data)
+#   - preprocess:  clustering, grouping demand and distances, transport costs (main.get_model_inputs),
+#                  without the preprocessing cache
+#   - build:       assembling each model (matrix_builder), with its rows, columns and nonzeros
+#   - solve:       solving each model (solvers.solve_matrices), limited to BENCHMARK_TIME_LIMIT seconds
+# and the peak memory of the process after each stage.
+# Results are saved as JSON, along with the git commit benchmarked, so that two versions can be compared:
+#
+# python benchmark_scaling.py [results .json] [baseline .json to compare against]
+#==================================================================================================================
+
+BASE_SIZE = {"districts": 200, "candidates": 20, "products": 3, "periods": 4, "scenarios": 4, "clusters": 10}
+SCALE_FACTORS = [2, 4]
+BENCHMARK_DATA_DIR = "SyntheticDataPY"
+BENCHMARK_TIME_LIMIT = 120
+# a stage counts as a regression when it takes this much longer (or uses this much more memory) than the baseline
+REGRESSION_TOLERANCE = 0.2
+
+
+def get_benchmark_sizes(base: dict = None, factors: list = None) -> list:
+    """
+    Purpose of the function is to list the instance sizes benchmarked: base (default BASE_SIZE),
+    then base with each dimension on its own multiplied by each of factors (default SCALE_FACTORS).
+    Candidates can't outnumber districts, nor clusters the districts, so those sizes are left out.
+    """
+    if base is None:
+        base = BASE_SIZE
+    if factors is None:
+        factors = SCALE_FACTORS
+    sizes = [dict(base)]
+    for dimension in base:
+        for factor in factors:
+            size = dict(base, **{dimension: base[dimension] * factor})
+            if size["candidates"] <= size["districts"] and size["clusters"] <= size["districts"]:
+                sizes.append(size)
+    return sizes
+
+
+def get_size_name(size: dict) -> str:
+    return "_".join(f"{dimension}{value}" for dimension, value in size.items())
+
+
+def get_instance(size: dict, seed: int = 0) -> str:
+    """
+    Purpose of the function is to return the directory of the synthetic instance of the given size,
+    writing it (and its memory-mapped distance matrix) first if it hasn't been already.
+    The number of clusters isn't part of the instance, so sizes differing only by clusters share one.
+    """
+    directory = (f"{BENCHMARK_DATA_DIR}/districts{size['districts']}_candidates{size['candidates']}_"
+                 f"products{size['products']}_periods{size['periods']}_scenarios{size['scenarios']}_seed{seed}")
+    # Operating.csv is written last
+    if not os.path.exists(f"{directory}/Operating.csv"):
+        print(f"Writing synthetic instance {directory}")
+        synthetic_data.generate_instance(directory, n_districts=size["districts"], n_candidates=size["candidates"],
+                                         n_products=size["products"], n_periods=size["periods"],
+                                         n_scenarios=size["scenarios"], seed=seed)
+        distance_matrix.load_district_distances(directory)
+    return directory
+
+
+def _peak_memory_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def benchmark_size(size: dict, directory: str, backend: str) -> dict:
+    """
+    Purpose of the function is to time each stage of preprocessing the instance in directory and
+    building and solving its MECWLP and SCENARIOS models, with the peak memory after each stage.
+    Run in a process of its own (see benchmark_scaling), so the peak memory is this size's alone.
+    """
+    constants.configure(data_directory=directory, use_preprocessing_cache=False, cluster_type="kmeans",
+                        cluster_size=size["clusters"], number_of_scenarios=size["scenarios"],
+                        solver_backend=backend, number_of_workers=1)
+    result = {"size": get_size_name(size), **size, "solver": backend,
+              "formulation": constants.model_formulation()}
+
+    def record(stage: str, start: float):
+        result[f"{stage}_time"] = time.perf_counter() - start
+        result[f"{stage}_peak_memory_mb"] = _peak_memory_mb()
+
+    start = time.perf_counter()
+    input_data = preprocessing.read_input_data()
+    record("read", start)
+
+    start = time.perf_counter()
+    MECWLP_inputs, scenario_data = get_model_inputs(input_data)
+    record("preprocess", start)
+
+    aggregated = constants.model_formulation() == "aggregated"
+    for model, build_matrices, model_inputs in [
+            ("MECWLP", matrix_builder.build_MECWLP_matrices, MECWLP_inputs),
+            ("SCENARIOS", matrix_builder.build_SCENARIOS_matrices, get_SCENARIOS_inputs(MECWLP_inputs, scenario_data))]:
+        start = time.perf_counter()
+        matrices = build_matrices(*model_inputs, names=False, aggregated=aggregated)
+        record(f"{model}_build", start)
+        result.update({f"{model}_columns": matrices.ncols, f"{model}_rows": matrices.nrows,
+                       f"{model}_nonzeros": matrices.A.nnz})
+
+        start = time.perf_counter()
+        try:
+            solved = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads(),
+                                            time_limit=BENCHMARK_TIME_LIMIT)
+        except Exception as error:
+            # e.g. the model too large for the xpress community licence
+            print(f"{get_size_name(size)} {model}: failed, {error}")
+            result[f"{model}_status"] = "failed"
+            continue
+        record(f"{model}_solve", start)
+        result.update({f"{model}_status": solved.status, f"{model}_obj_val": solved.objective,
+                       f"{model}_gap": solved.gap})
+        print(f"{get_size_name(size)} {model}: {matrices.ncols} columns, {solved.status}, "
+              f"build {result[f'{model}_build_time']:.3f}s, solve {result[f'{model}_solve_time']:.3f}s")
+    return result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_scaling(output: str = "benchmark_scaling.json", sizes: list = None, backend: str = None,
+                      seed: int = 0) -> dict:
+    """
+    Purpose of the function is to benchmark every size in sizes (default get_benchmark_sizes()),
+    each in a fresh process, and save the results to output as JSON.
+    """
+    if sizes is None:
+        sizes = get_benchmark_sizes()
+    if backend is None:
+        backend = constants.solver_backend()
+
+    results = []
+    for size in sizes:
+        directory = get_instance(size, seed)
+        # spawned rather than forked, so nothing this process has allocated counts towards the peak memory
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.append(pool.submit(benchmark_size, size, directory, backend).result())
+
+    benchmark = {"commit": _git_commit(), "created": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count(), "seed": seed, "results": results}
+    with open(output, "w") as f:
+        json.dump(benchmark, f, indent=2)
+    print(f"Saved {output}")
+    return benchmark
+
+
+def compare_benchmarks(baseline: str, current: str, tolerance: float = REGRESSION_TOLERANCE) -> pd.DataFrame:
+    """
+    Purpose of the function is to compare the times and peak memory of each size in two benchmark_scaling
+    JSON files, listing the ratio current / baseline of each, and printing those more than tolerance worse.
+    """
+    frames = []
+    for path in [baseline, current]:
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)["results"]).set_index("size"))
+    baseline_results, current_results = frames
+    measures = [column for column in baseline_results.columns
+                if column.endswith(("_time", "_peak_memory_mb")) and column in current_results.columns]
+    sizes = baseline_results.index.intersection(current_results.index)
+
+    comparison = (current_results.loc[sizes, measures] / baseline_results.loc[sizes, measures]).stack().rename("ratio")
+    comparison = comparison.reset_index().rename(columns={"level_1": "measure"})
+    regressions = comparison[comparison["ratio"] > 1 + tolerance]
+    print(f"{len(regressions)} of {len(comparison)} measures more than {tolerance:.0%} worse than {baseline}")
+    for row in regressions.itertuples():
+        print(f"  {row.size} {row.measure}: {row.ratio:.2f}x")
+    return comparison
+
+
+if __name__ == "__main__":
+    output = sys.argv[1] if len(sys.argv) > 1 else "benchmark_scaling.json"
+    benchmark_scaling(output)
+    if len(sys.argv) > 2:
+        compare_benchmarks(sys.argv[2], output)
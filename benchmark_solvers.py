@@ -0,0 +1,48 @@
+import sys
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# Solve identical MECWLP and SCENARIOS models with each solver backend (see solvers.py),
+# and compare status, objective, bound, gap and solve time. Results are saved to benchmark_solvers.csv.
+# Uses the same input data and settings as main.py (see constants.py)
+#
+# python benchmark_solvers.py [number of scenarios for the SCENARIOS model] [backend ...]
+#==================================================================================================================
+
+
+def benchmark_solvers(n_scenarios: int = 1, backends: list = None) -> pd.DataFrame:
+    if backends is None:
+        backends = solvers.BACKENDS
+
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    models = {"MECWLP": matrix_builder.build_MECWLP_matrices(*MECWLP_inputs, names=False),
+              "SCENARIOS": matrix_builder.build_SCENARIOS_matrices(
+                  *get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_scenarios), names=False)}
+
+    rows = []
+    for model, matrices in models.items():
+        for backend in backends:
+            try:
+                result = solvers.solve_matrices(matrices, backend)
+            except Exception as error:
+                # e.g. highspy not installed, or the model too large for the xpress community licence
+                print(f"{model} {backend}: failed, {error}")
+                rows.append({"model": model, "solver": backend, "status": "failed"})
+                continue
+            rows.append({"model": model, "solver": backend, "columns": matrices.ncols, "rows": matrices.nrows,
+                         "status": result.status, "obj_val": result.objective, "best_bound": result.bound,
+                         "gap": result.gap, "solve_time": result.solve_time})
+            print(f"{model} {backend}: {result.status}, objective {result.objective}, "
+                  f"gap {result.gap*100:.2f}%, {result.solve_time:.3f}s")
+
+    results = pd.DataFrame(rows)
+    results.to_csv(constants.get_output_path("benchmark_solvers.csv"), index=False)
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_solvers(int(sys.argv[1]) if len(sys.argv) > 1 else 1, sys.argv[2:] or None)
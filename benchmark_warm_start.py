@@ -0,0 +1,86 @@
+import sys
+import time
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+import warm_start
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# Time solving a series of related models from scratch against changing one model in place and
+# re-solving it from the last solution (warm_start.IncrementalModel):
+#   - the MECWLP model with each scenario's demand in turn
+#   - the SCENARIOS model with 1, 2, ... scenarios, adding one scenario at a time
+# From scratch, each model is assembled by matrix_builder and solved by solvers.solve_matrices.
+# Results are saved to benchmark_warm_start.csv.
+# Uses the same input data and settings as main.py (see constants.py)
+#
+# python benchmark_warm_start.py [number of scenarios] [backend, 'xpress' or 'highs']
+#==================================================================================================================
+
+
+def _from_scratch(build_matrices, model_inputs, backend: str):
+    start = time.perf_counter()
+    matrices = build_matrices(*model_inputs, names=False, aggregated=constants.model_formulation() == "aggregated")
+    build_time = time.perf_counter() - start
+    result = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads())
+    return result, build_time
+
+
+def benchmark_warm_start(n_scenarios: int = None, backend: str = None) -> pd.DataFrame:
+    if backend is None:
+        backend = constants.solver_backend()
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    SCENARIOS_inputs = get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_scenarios)
+    Scenarios, DemandPeriodsGrouped, CostCandidateCustomers, TotalDemand = (
+        SCENARIOS_inputs[5], SCENARIOS_inputs[9], SCENARIOS_inputs[10], SCENARIOS_inputs[13])
+
+    rows = []
+
+    def add_row(model, run, scratch, scratch_build_time, incremental):
+        update_time = incremental.log[-2]["update_time"]
+        rows.append({"model": model, "run": run, "solver": backend,
+                     "scratch_obj_val": scratch.objective, "scratch_build_time": scratch_build_time,
+                     "scratch_solve_time": scratch.solve_time,
+                     "incremental_obj_val": incremental.result.objective, "incremental_update_time": update_time,
+                     "incremental_solve_time": incremental.result.solve_time,
+                     "speed_up": (scratch_build_time + scratch.solve_time)
+                                 / (update_time + incremental.result.solve_time)})
+        print(f"{model} {run}: from scratch {scratch_build_time + scratch.solve_time:.3f}s, "
+              f"incremental {update_time + incremental.result.solve_time:.3f}s, "
+              f"objectives {scratch.objective} / {incremental.result.objective}")
+
+    # =============================================================================
+    # MECWLP model with each scenario's demand
+    # =============================================================================
+    incremental = warm_start.IncrementalModel("MECWLP", MECWLP_inputs, backend, threads=constants.solver_threads())
+    incremental.solve()
+    for sc in range(len(Scenarios)):
+        model_inputs = list(MECWLP_inputs)
+        model_inputs[8], model_inputs[9], model_inputs[12] = DemandPeriodsGrouped[sc], CostCandidateCustomers[sc], TotalDemand[sc]
+        scratch, scratch_build_time = _from_scratch(matrix_builder.build_MECWLP_matrices, model_inputs, backend)
+        incremental.update_scenario(0, DemandPeriodsGrouped[sc], CostCandidateCustomers[sc], TotalDemand[sc])
+        incremental.solve()
+        add_row("MECWLP", f"scenario {sc + 1} demand", scratch, scratch_build_time, incremental)
+
+    # =============================================================================
+    # SCENARIOS model, one scenario added at a time
+    # =============================================================================
+    incremental = warm_start.IncrementalModel("SCENARIOS", get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, 1),
+                                              backend, threads=constants.solver_threads())
+    incremental.solve()
+    for n in range(2, len(Scenarios) + 1):
+        scratch, scratch_build_time = _from_scratch(matrix_builder.build_SCENARIOS_matrices,
+                                                    get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n), backend)
+        incremental.add_scenario(DemandPeriodsGrouped[n - 1], CostCandidateCustomers[n - 1], TotalDemand[n - 1])
+        incremental.solve()
+        add_row("SCENARIOS", f"{n} scenarios", scratch, scratch_build_time, incremental)
+
+    results = pd.DataFrame(rows)
+    results.to_csv(constants.get_output_path("benchmark_warm_start.csv"), index=False)
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_warm_start(int(sys.argv[1]) if len(sys.argv) > 1 else None, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,308 @@
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import constants
+import matrix_builder
+import solvers
+import postprocessing
+
+# =============================================================================
+# Benders (L-shaped) decomposition of the SCENARIOS model
+#
+# Master problem: build/open decisions plus a recourse cost estimate theta,
+#   one per scenario (multi-cut) or one overall (single-cut).
+# Subproblems: for fixed open, one LP per scenario over supply/warehoused/delivered,
+#   min q_s y  s.t.  W_s y (<=, =) h_s - L_s x,  0 <= y <= u
+# Optimality cuts come from the subproblem duals pi and reduced costs d:
+#   theta_s >= pi (h_s - L_s x) + sum_j u_j min(d_j, 0)
+# Feasibility cuts come from the duals of an elastic (phase 1) version of the
+#   subproblem whenever a scenario can't be served by the open warehouses.
+# Master and subproblems are solved by xpress, whatever constants.solver_backend().
+# =============================================================================
+
+
+def _load_lp(name: str, rowtype, rhs, objcoef, A, lb, ub):
+    prob = solvers.import_xpress().problem(name)
+    A = sp.csc_matrix(A)
+    prob.loadLP(name, list(rowtype), rhs, None, objcoef, A.indptr, None, A.indices, A.data, lb, ub)
+    return prob
+
+
+def get_scenario_subproblems(Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                             Operating_df, Setup_df, CostSupplierCandidate,
+                             DemandPeriodsGrouped, CostCandidateCustomers,
+                             Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict) -> list:
+    """
+    Purpose of the function is to set up one recourse LP per scenario, using the
+    block laid out by matrix_builder, along with an elastic copy of it used to
+    test feasibility. Each subproblem keeps the coefficients on open (L) so its
+    right hand side can be updated for every master solution.
+    """
+    nC, nS, nP, nT, nK = len(Candidates), len(Suppliers), len(Products), len(Times), len(Customers)
+
+    pattern = None
+    subproblems = []
+    for sc in range(len(Scenarios)):
+        arrays = matrix_builder.get_model_arrays(Candidates, Times, Suppliers, Products, Customers,
+                                                 Operating_df, Setup_df, CostSupplierCandidate,
+                                                 DemandPeriodsGrouped[sc], CostCandidateCustomers[sc],
+                                                 Suppliers_df, Candidates_df,
+                                                 TotalDemandProductPeriodScenarios_dict[sc])
+        if pattern is None:
+            pattern = matrix_builder.recourse_pattern(nC, nS, nP, nT, nK, arrays["product_group"],
+                                                      constants.model_formulation() == "aggregated")
+            n1 = pattern["n_first_stage"]
+            rowtype = pattern["rowtype"]
+            ub = matrix_builder.recourse_upper_bounds(pattern)
+            lb = np.zeros(ub.size)
+
+        block, h, q = matrix_builder.recourse_values(pattern, arrays["supplier_demand"], arrays["grouped_demand"],
+                                                     arrays["cost_supplier_candidate"],
+                                                     arrays["cost_candidate_customer"],
+                                                     arrays["supplier_capacity"], arrays["candidate_capacity"])
+        L = block[:, :n1].tocsr()
+        W = block[:, n1:].tocsc()
+
+        # elastic copy: one artificial column per <= row (-1) and two per = row (+1/-1)
+        less = np.flatnonzero(rowtype == "L")
+        equal = np.flatnonzero(rowtype == "E")
+        artificial_rows = np.concatenate([less, equal, equal])
+        artificial_vals = np.concatenate([-np.ones(less.size), np.ones(equal.size), -np.ones(equal.size)])
+        artificial = sp.csc_matrix((artificial_vals, (artificial_rows, np.arange(artificial_rows.size))),
+                                   shape=(W.shape[0], artificial_rows.size))
+
+        subproblems.append({
+            "L": L,
+            "h": h,
+            "ub": ub,
+            "lp": _load_lp(f"recourse_{sc + 1}", rowtype, h, q, W, lb, ub),
+            "elastic": _load_lp(f"elastic_{sc + 1}", rowtype, h,
+                                np.concatenate([np.zeros(W.shape[1]), np.ones(artificial_rows.size)]),
+                                sp.hstack([W, artificial]),
+                                np.zeros(W.shape[1] + artificial_rows.size),
+                                np.concatenate([ub, np.full(artificial_rows.size, np.inf)])),
+            "total_demand": arrays["supplier_demand"],
+        })
+
+    return subproblems
+
+
+def _cut(subproblem: dict, prob, ncols: int):
+    """
+    Cut coefficients alpha + beta x from the duals and reduced costs of a solved subproblem.
+    Only the first ncols columns carry upper bounds that enter the cut.
+    """
+    duals = np.array(prob.getDuals())
+    reduced_costs = np.array(prob.getRedCosts())[:ncols]
+    ub = subproblem["ub"]
+    finite = np.isfinite(ub)
+    alpha = duals.dot(subproblem["h"]) + np.minimum(reduced_costs[finite], 0).dot(ub[finite])
+    beta = -subproblem["L"].T.dot(duals)
+    return alpha, beta
+
+
+def solve_subproblem(subproblem: dict, x: np.ndarray, feasibility_tolerance: float = 1e-6):
+    """
+    Solve one scenario's recourse LP for the master solution x.
+    Returns (feasible, recourse cost, alpha, beta) where the cut is
+    theta >= alpha + beta x if feasible, and alpha + beta x <= 0 if not.
+    """
+    rhs = subproblem["h"] - subproblem["L"].dot(x)
+    ncols = subproblem["ub"].size
+    rows = list(range(rhs.size))
+
+    lp = subproblem["lp"]
+    lp.chgRHS(rows, rhs)
+    lp.solve()
+    if lp.attributes.solstatus == solvers.import_xpress().SolStatus.OPTIMAL:
+        alpha, beta = _cut(subproblem, lp, ncols)
+        return True, lp.attributes.objval, alpha, beta
+
+    elastic = subproblem["elastic"]
+    elastic.chgRHS(rows, rhs)
+    elastic.solve()
+    if elastic.attributes.objval <= feasibility_tolerance:
+        raise RuntimeError("Recourse LP reported infeasible but its elastic version is feasible")
+    alpha, beta = _cut(subproblem, elastic, ncols)
+    return False, np.inf, alpha, beta
+
+
+def _add_rows(prob, rowtype: str, rhs: list, coefs: list):
+    """
+    Add dense cut rows (one coefficient per master column) to the master problem.
+    """
+    A = sp.csr_matrix(np.vstack(coefs))
+    A.eliminate_zeros()
+    prob.addRows([rowtype] * len(rhs), rhs, None, A.indptr, A.indices, A.data)
+
+
+def benders_SCENARIOS(Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                      Operating_df, Setup_df, CostSupplierCandidate,
+                      DemandPeriodsGrouped, CostCandidateCustomers,
+                      Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict,
+                      multi_cut=None, gap_tolerance=None, max_iterations=None):
+    """
+    Solve the SCENARIOS model by Benders decomposition. Takes the same arguments as SCENARIOS_model.
+
+    multi_cut (default constants.benders_multi_cut()): one recourse estimate and cut per scenario
+    per iteration, rather than a single aggregated cut.
+    Stops once the gap between the master problem bound and the best plan found
+    is within gap_tolerance (default constants.benders_gap_tolerance()), or after
+    max_iterations (default constants.benders_max_iterations()).
+    """
+    if multi_cut is None:
+        multi_cut = constants.benders_multi_cut()
+    if gap_tolerance is None:
+        gap_tolerance = constants.benders_gap_tolerance()
+    if max_iterations is None:
+        max_iterations = constants.benders_max_iterations()
+
+    start_time = time.perf_counter()
+    xp = solvers.import_xpress()
+    xp.setOutputEnabled(False)
+
+    subproblems = get_scenario_subproblems(Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                                           Operating_df, Setup_df, CostSupplierCandidate,
+                                           DemandPeriodsGrouped, CostCandidateCustomers,
+                                           Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict)
+    nC, nT, nSc = len(Candidates), len(Times), len(Scenarios)
+    n1 = nC + nC * nT
+    n_theta = nSc if multi_cut else 1
+    weights = matrix_builder.get_scenario_probabilities(Scenarios)
+
+    # =============================================================================
+    # Master problem: build, open and theta
+    # =============================================================================
+    arrays = matrix_builder.get_model_arrays(Candidates, Times, Suppliers, Products, Customers,
+                                             Operating_df, Setup_df, CostSupplierCandidate,
+                                             DemandPeriodsGrouped[0], CostCandidateCustomers[0],
+                                             Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict[0])
+    first_stage_cost = np.concatenate([arrays["setup"], np.repeat(arrays["operating"], nT)])
+
+    rows, cols, vals, rowtype, rhs = matrix_builder.first_stage_rows(nC, nT)
+    # valid inequality: the warehouses open in each period must be able to hold that period's
+    # total demand in every scenario (otherwise some scenario is certainly infeasible)
+    product_group = arrays["product_group"]
+    first_supplier_of_group = np.unique(product_group, return_index=True)[1]
+    total_demand = np.max([sub["total_demand"][first_supplier_of_group].sum(axis=0) for sub in subproblems], axis=0)
+    capacity_rows = rhs.size + np.repeat(np.arange(nT), nC)
+    capacity_cols = nC + np.tile(np.arange(nC) * nT, nT) + np.repeat(np.arange(nT), nC)
+    capacity_vals = np.tile(arrays["candidate_capacity"], nT)
+
+    A = sp.csc_matrix((np.concatenate([vals, capacity_vals]),
+                       (np.concatenate([rows, capacity_rows]), np.concatenate([cols, capacity_cols]))),
+                      shape=(rhs.size + nT, n1 + n_theta))
+    master = xp.problem("SCENARIOS_master")
+    master.loadMIP("SCENARIOS_master", list(rowtype) + ["G"] * nT, np.concatenate([rhs, total_demand]), None,
+                   np.concatenate([first_stage_cost, weights if multi_cut else [1.0]]),
+                   A.indptr, None, A.indices, A.data,
+                   np.zeros(n1 + n_theta), np.concatenate([np.ones(n1), np.full(n_theta, np.inf)]),
+                   coltype=["B"] * n1, entind=np.arange(n1))
+
+    # =============================================================================
+    # Cutting plane loop
+    # =============================================================================
+    lower_bound = -np.inf
+    upper_bound = np.inf
+    best_x = None
+    iteration_log = []
+
+    for iteration in range(1, max_iterations + 1):
+        master.solve()
+        if master.attributes.solstatus not in [xp.SolStatus.OPTIMAL, xp.SolStatus.FEASIBLE]:
+            print("Benders master problem has no solution")
+            break
+        lower_bound = max(lower_bound, master.attributes.bestbound)
+        solution = np.array(master.getSolution())
+        x = np.round(solution[:n1])
+
+        results = [solve_subproblem(sub, x) for sub in subproblems]
+        feasible = all(result[0] for result in results)
+
+        optimality_rhs, optimality_coefs, feasibility_rhs, feasibility_coefs = [], [], [], []
+        for sc, (scenario_feasible, _, alpha, beta) in enumerate(results):
+            if not scenario_feasible:
+                # alpha + beta x <= 0
+                feasibility_rhs.append(-alpha)
+                feasibility_coefs.append(np.concatenate([beta, np.zeros(n_theta)]))
+            elif multi_cut:
+                # theta_sc - beta x >= alpha
+                theta = np.zeros(n_theta)
+                theta[sc] = 1
+                optimality_rhs.append(alpha)
+                optimality_coefs.append(np.concatenate([-beta, theta]))
+
+        if feasible:
+            recourse_costs = np.array([result[1] for result in results])
+            plan_cost = first_stage_cost.dot(x) + weights.dot(recourse_costs)
+            if plan_cost < upper_bound:
+                upper_bound = plan_cost
+                best_x = x
+            if not multi_cut:
+                optimality_rhs.append(weights.dot([result[2] for result in results]))
+                optimality_coefs.append(np.concatenate([-np.sum([w * result[3] for w, result in zip(weights, results)],
+                                                               axis=0), [1.0]]))
+
+        gap = abs(upper_bound - lower_bound) / (1e-10 + abs(upper_bound)) if np.isfinite(upper_bound) else np.inf
+        iteration_log.append({"iteration": iteration,
+                              "lower_bound": lower_bound,
+                              "upper_bound": upper_bound,
+                              "gap": gap,
+                              "optimality_cuts": len(optimality_rhs),
+                              "feasibility_cuts": len(feasibility_rhs),
+                              "time": time.perf_counter() - start_time})
+        print(f"Benders iteration {iteration}: lower bound {lower_bound:.2f}, upper bound {upper_bound:.2f}, "
+              f"gap {gap*100:.2f}%")
+
+        if gap <= gap_tolerance:
+            break
+        if not optimality_rhs and not feasibility_rhs:
+            break
+        if optimality_rhs:
+            _add_rows(master, "G", optimality_rhs, optimality_coefs)
+        if feasibility_rhs:
+            _add_rows(master, "L", feasibility_rhs, feasibility_coefs)
+
+    run_time = time.perf_counter() - start_time
+
+    #print and save some summary stats
+    #the period when warehouses get built/opened is saved off into
+    #the csv's build.csv and open.csv, respectively.
+    if best_x is None:
+        postprocessing.postprocessing(master, best_obj=upper_bound, best_bound=lower_bound,
+                                      iterations=len(iteration_log))
+        return None
+
+    build = best_x[:nC]
+    open = best_x[nC:].reshape(nC, nT)
+    building_costs = arrays["setup"].dot(build)
+    operating_costs = arrays["operating"].dot(open.sum(axis=1))
+
+    build_df = pd.DataFrame(data = build, index = Candidates)
+    build_df = build_df[build_df.sum(axis=1) > 0]
+    open_df = pd.DataFrame(data = open, index = Candidates, columns = Times)
+    open_df = open_df[open_df.sum(axis=1)>0]
+
+    cut_type = "multicut" if multi_cut else "singlecut"
+    build_df.to_csv(constants.get_output_path(f"build_{constants.clustertype()}_scenarios{nSc}_benders.csv"))
+    open_df.to_csv(constants.get_output_path(f"open_{constants.clustertype()}_scenarios_{nSc}_benders.csv"))
+    pd.DataFrame(iteration_log).to_csv(
+        constants.get_output_path(f"benders_log_{constants.clustertype()}_scenarios{nSc}_{cut_type}.csv"))
+    vals = pd.DataFrame({"number_of_scenarios": [nSc],
+                        "obj_val": [upper_bound],
+                        "best_bound": [lower_bound],
+                        "iterations": [len(iteration_log)],
+                        "operating_costs": [operating_costs],
+                        "building_costs": [building_costs],
+                        "run_time": [run_time]})
+    vals.to_csv(constants.get_output_path(f"model_stats_{constants.clustertype()}_scenarios{nSc}_benders.csv"))
+
+    print(f'The objective function value for scenarios (Benders) is {upper_bound}')
+    print(f"operating costs scenarios: {operating_costs}")
+    print(f"building costs scenarios: {building_costs}")
+
+    postprocessing.postprocessing(master, best_obj=upper_bound, best_bound=lower_bound,
+                                  iterations=len(iteration_log))
+
+    return best_x
@@ -0,0 +1,166 @@
+import numpy as np
+import scipy.sparse as sp
+import constants
+import matrix_builder
+import solvers
+
+# =============================================================================
+# Candidate pre-screening
+#
+# Drops candidate warehouses that can't be part of an optimal solution before
+# the MECWLP / SCENARIOS model is built, along with all their variables:
+#
+# 1. Dominance: candidate a is dominated by candidate b when b costs no more to
+#    set up and operate, no more to supply and to deliver from (to every cluster,
+#    in every period and scenario), and can hold a whole period's demand on its own.
+#    Any solution using a then does at least as well using b in its place.
+# 2. Reduced cost fixing: the LP relaxation (tightened with capacity * open limits on
+#    warehouse stock) gives a lower bound z_LP, and rounding up its build/open values
+#    gives a feasible plan, whose cost is an upper bound UB.
+#    A candidate in use is built and, as warehouses remain open, open in the last period,
+#    so costs at least z_LP + d_build + d_open_last (the reduced costs of those columns).
+#    Where that exceeds UB the candidate can't be used in any optimal solution.
+#
+# The LP relaxations are solved with scipy's HiGHS, whatever the solver backend,
+# so screening isn't limited by the xpress community licence.
+# =============================================================================
+
+# relative tolerance on the reduced cost test, so rounding errors never drop a candidate wrongly
+REDUCED_COST_TOLERANCE = 1e-6
+
+
+def get_dominated_candidates(arrays_list: list) -> np.ndarray:
+    """
+    Purpose of the function is to find candidates dominated by another candidate, given
+    matrix_builder.get_model_arrays for each scenario (a single entry for the MECWLP model).
+    Returns a boolean array, True for dominated candidates.
+    """
+    arrays = arrays_list[0]
+    nC = arrays["setup"].size
+    # largest total demand in any period and scenario
+    max_total_demand = max(a["grouped_demand"].sum(axis=(0, 1)).max() for a in arrays_list)
+    # (candidate, supplier) followed by (cluster, period) for each scenario
+    transport_costs = np.hstack([arrays["cost_supplier_candidate"].T] +
+                                [a["cost_candidate_customer"].reshape(nC, -1) for a in arrays_list])
+
+    dominated = np.zeros(nC, dtype=bool)
+    for b in np.flatnonzero(arrays["candidate_capacity"] >= max_total_demand):
+        no_worse = ((arrays["setup"][b] <= arrays["setup"]) &
+                    (arrays["operating"][b] <= arrays["operating"]) &
+                    (transport_costs[b] <= transport_costs).all(axis=1))
+        # candidates identical to b are only dropped in favour of an earlier one
+        identical = ((arrays["setup"][b] == arrays["setup"]) &
+                     (arrays["operating"][b] == arrays["operating"]) &
+                     (transport_costs[b] == transport_costs).all(axis=1))
+        no_worse[identical & (np.arange(nC) <= b)] = False
+        dominated |= no_worse
+    return dominated
+
+
+def _capacity_open_rows(matrices: matrix_builder.ModelMatrices, candidate_capacity: np.ndarray):
+    """
+    Valid inequalities tightening the LP relaxation:
+    sum_p warehoused[c, p, t] <= capacity[c] * open[c, t], in every scenario.
+    """
+    warehoused = matrices.blocks["warehoused"]
+    if warehoused.ndim == 3:
+        warehoused = warehoused[..., None]
+    nC, nP, nT, nSc = warehoused.shape
+    row = np.arange(nC * nT * nSc).reshape(nC, nT, nSc)
+    rows = np.concatenate([np.broadcast_to(row[:, None], warehoused.shape).ravel(), row.ravel()])
+    cols = np.concatenate([warehoused.ravel(),
+                           np.broadcast_to(matrices.blocks["open"][:, :, None], row.shape).ravel()])
+    vals = np.concatenate([np.ones(warehoused.size),
+                           -np.broadcast_to(candidate_capacity[:, None, None], row.shape).ravel()])
+    return sp.csr_matrix((vals, (rows, cols)), shape=(row.size, matrices.ncols))
+
+
+def get_reduced_cost_fixed_candidates(matrices: matrix_builder.ModelMatrices,
+                                      candidate_capacity: np.ndarray) -> np.ndarray:
+    """
+    Purpose of the function is to find the candidates that reduced cost fixing on the
+    LP relaxation of the model rules out. Returns a boolean array, True for those candidates.
+    """
+    build = matrices.blocks["build"]
+    open_cols = matrices.blocks["open"]
+    fixed = np.zeros(build.size, dtype=bool)
+
+    capacity_open = _capacity_open_rows(matrices, candidate_capacity)
+    A = sp.vstack([matrices.A, capacity_open])
+    rowtype = np.concatenate([matrices.rowtype, np.full(capacity_open.shape[0], "L")])
+    rhs = np.concatenate([matrices.rhs, np.zeros(capacity_open.shape[0])])
+    relaxation = solvers.solve_lp(matrices, matrices.lb, matrices.ub, A, rowtype, rhs)
+    if relaxation.status != 0:
+        print("Candidate screening: LP relaxation not solved, no candidates fixed")
+        return fixed
+
+    # rounding up build/open keeps the LP's deliveries feasible: a plan and so an upper bound,
+    # which is then improved by closing the warehouses that plan doesn't use
+    is_open = np.ceil(relaxation.x[open_cols] - 1e-9)
+    upper_bound = np.inf
+    for _ in range(2):
+        lb = matrices.lb.copy()
+        ub = matrices.ub.copy()
+        lb[open_cols] = ub[open_cols] = is_open
+        lb[build] = ub[build] = is_open.max(axis=1)
+        plan = solvers.solve_lp(matrices, lb, ub)
+        if plan.status != 0:
+            break
+        upper_bound = min(upper_bound, plan.fun)
+        used = plan.x[matrices.blocks["supply"]].reshape(build.size, -1).sum(axis=1) > 1e-9
+        is_open = is_open * used[:, None]
+
+    if not np.isfinite(upper_bound):
+        print("Candidate screening: no upper bound from the LP relaxation, no candidates fixed")
+        return fixed
+
+    # zero for columns not at their lower bound
+    reduced_costs = relaxation.lower.marginals
+    threshold = upper_bound + REDUCED_COST_TOLERANCE * (1 + abs(upper_bound))
+    fixed = relaxation.fun + reduced_costs[build] + reduced_costs[open_cols[:, -1]] > threshold
+    print(f"Candidate screening: LP bound {relaxation.fun:.2f}, best rounded plan {upper_bound:.2f}")
+    return fixed
+
+
+def screen_candidates(model: str, model_inputs: tuple) -> tuple:
+    """
+    Purpose of the function is to drop dominated and reduced-cost-fixed candidates from the
+    arguments of MECWLP_model (model 'MECWLP') or SCENARIOS_model (model 'SCENARIOS'),
+    returning the same arguments for the surviving candidates only.
+    """
+    arrays_list = matrix_builder.get_model_arrays_list(model, model_inputs)
+    if model == "MECWLP":
+        (Candidates, Times, Suppliers, Products, Customers, Operating_df, Setup_df, CostSupplierCandidate,
+         DemandPeriodsGrouped, CostCandidateCustomers, Suppliers_df, Candidates_df, TotalDemand) = model_inputs
+        build_matrices = matrix_builder.build_MECWLP_matrices
+    else:
+        (Candidates, Times, Suppliers, Products, Customers, Scenarios, Operating_df, Setup_df, CostSupplierCandidate,
+         DemandPeriodsGrouped, CostCandidateCustomers, Suppliers_df, Candidates_df, TotalDemand) = model_inputs
+        build_matrices = matrix_builder.build_SCENARIOS_matrices
+
+    dominated = get_dominated_candidates(arrays_list)
+
+    aggregated = constants.model_formulation() == "aggregated"
+    matrices = build_matrices(*model_inputs, names=False, aggregated=aggregated)
+    fixed = get_reduced_cost_fixed_candidates(matrices, arrays_list[0]["candidate_capacity"])
+
+    keep = ~(dominated | fixed)
+    Candidates = Candidates[keep]
+    CostSupplierCandidate = np.asarray(CostSupplierCandidate)[:, keep]
+    if model == "MECWLP":
+        screened_inputs = (Candidates, Times, Suppliers, Products, Customers, Operating_df, Setup_df,
+                           CostSupplierCandidate, DemandPeriodsGrouped, np.asarray(CostCandidateCustomers)[keep],
+                           Suppliers_df, Candidates_df, TotalDemand)
+    else:
+        screened_inputs = (Candidates, Times, Suppliers, Products, Customers, Scenarios, Operating_df, Setup_df,
+                           CostSupplierCandidate, DemandPeriodsGrouped,
+                           [np.asarray(costs)[keep] for costs in CostCandidateCustomers],
+                           Suppliers_df, Candidates_df, TotalDemand)
+
+    screened = build_matrices(*screened_inputs, names=False, aggregated=aggregated)
+    print(f"Candidate screening: kept {keep.sum()} of {keep.size} candidates "
+          f"({dominated.sum()} dominated, {(fixed & ~dominated).sum()} fixed by reduced cost)")
+    print(f"Candidate screening: {matrices.ncols} -> {screened.ncols} columns, "
+          f"{matrices.nrows} -> {screened.nrows} rows, {matrices.A.nnz} -> {screened.A.nnz} nonzeros")
+
+    return screened_inputs
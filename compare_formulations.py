@@ -0,0 +1,53 @@
+import sys
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# Compare the full MECWLP / SCENARIOS models against their aggregated formulation
+# (one assignment variable per candidate, cluster and period, see matrix_builder.build_MECWLP_matrices):
+# model size, solve time and how much the objective goes up by making every product of a cluster
+# come from the same warehouses. Results are saved to compare_formulations.csv.
+# Uses the same input data, settings and solver backend as main.py (see constants.py)
+#
+# python compare_formulations.py [number of scenarios for the SCENARIOS model]
+#==================================================================================================================
+
+
+def compare_formulations(n_scenarios: int = 1) -> pd.DataFrame:
+    backend = constants.solver_backend()
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    SCENARIOS_inputs = get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_scenarios)
+
+    rows = []
+    for model, build_matrices, model_inputs in [("MECWLP", matrix_builder.build_MECWLP_matrices, MECWLP_inputs),
+                                                ("SCENARIOS", matrix_builder.build_SCENARIOS_matrices,
+                                                 SCENARIOS_inputs)]:
+        for formulation in ["full", "aggregated"]:
+            matrices = build_matrices(*model_inputs, names=False, aggregated=formulation == "aggregated")
+            result = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads())
+            rows.append({"model": model, "formulation": formulation, "solver": backend,
+                         "columns": matrices.ncols, "rows": matrices.nrows, "nonzeros": matrices.A.nnz,
+                         "status": result.status, "obj_val": result.objective, "best_bound": result.bound,
+                         "solve_time": result.solve_time})
+
+        full, aggregated = rows[-2], rows[-1]
+        difference = aggregated["obj_val"] - full["obj_val"]
+        print(f"{model}: full {full['columns']} columns, {full['rows']} rows, objective {full['obj_val']}, "
+              f"{full['solve_time']:.3f}s")
+        print(f"{model}: aggregated {aggregated['columns']} columns, {aggregated['rows']} rows, "
+              f"objective {aggregated['obj_val']}, {aggregated['solve_time']:.3f}s")
+        print(f"{model}: aggregated objective difference {difference:.4f} "
+              f"({difference / (1e-10 + abs(full['obj_val'])) * 100:.4f}%)")
+        for row in [full, aggregated]:
+            row["objective_difference"] = row["obj_val"] - full["obj_val"]
+
+    results = pd.DataFrame(rows)
+    results.to_csv(constants.get_output_path("compare_formulations.csv"), index=False)
+    return results
+
+
+if __name__ == "__main__":
+    compare_formulations(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -1,13 +1,285 @@
+import os
+
+# Settings changed for a single run with configure(), e.g. by the sweep runner (sweep.py).
+# Any setting not configured takes the value returned by its function below.
+_settings = {}
+
+def configure(**settings):
+    """
+    override settings for this process: cluster_type ('parliament' or 'kmeans'), cluster_size,
+    number_of_scenarios, solver_threads, number_of_workers, solver_backend,
+    model_formulation, delivery_arcs_per_cluster, delivery_arc_radius, rolling_horizon_window,
+    rolling_horizon_step, clustering_algorithm, cluster_by_demand, data_directory, use_preprocessing_cache,
+    instrumentation, lazy_linking, model, output_directory, reduced_scenarios, scenarios_solver,
+    screen_candidates
+    settings given as None are left as they are
+    """
+    known = {"cluster_type", "cluster_size", "number_of_scenarios", "solver_threads", "number_of_workers",
+             "solver_backend", "model_formulation", "delivery_arcs_per_cluster", "delivery_arc_radius",
+             "rolling_horizon_window", "rolling_horizon_step", "clustering_algorithm", "cluster_by_demand",
+             "data_directory", "use_preprocessing_cache", "instrumentation", "lazy_linking", "model",
+             "output_directory", "reduced_scenarios", "scenarios_solver", "screen_candidates"}
+    unknown = set(settings) - known
+    if unknown:
+        raise ValueError(f"Unknown settings: {sorted(unknown)}")
+    _settings.update({name: value for name, value in settings.items() if value is not None})
+
+
+def reset_configuration():
+    """
+    undo every configure() call, going back to the settings below
+    """
+    _settings.clear()
+
+
 def get_filepath()->str:
-    filepath = "CaseStudyDataPY"
+    """
+    directory of the input data, e.g. a synthetic instance written by synthetic_data.py
+    """
+    filepath = _settings.get("data_directory", "CaseStudyDataPY")
     return filepath
 
+def output_directory()->str:
+    """
+    directory the results of a run (build/open decisions, model stats, flows, logs and traces) are written to
+    """
+    return _settings.get("output_directory", ".")
+
+def get_output_path(filename: str)->str:
+    """
+    path of the output file called filename in output_directory(), creating the directory if need be
+    """
+    directory = output_directory()
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
+
+def models_to_solve():
+    """
+    models solved by main.py: 'MECWLP', 'SCENARIOS', or 'both', the SCENARIOS model then starting
+    from the build/open decisions of the MECWLP model
+    """
+    return _settings.get("model", "MECWLP")
+
+def scenarios_solver():
+    """
+    how main.py solves the SCENARIOS model: 'extensive' for the model with every scenario at once
+    (SCENARIOS_model.py), or 'benders' for Benders decomposition (benders.py), which scales to many
+    more scenarios but always uses xpress
+    """
+    return _settings.get("scenarios_solver", "extensive")
+
+def use_preprocessing_cache():
+    """
+    return True to store the preprocessed input data (preprocessing_cache.py) and read it back
+    on later runs with the same input files and settings
+    """
+    return _settings.get("use_preprocessing_cache", True)
+
+def preprocessing_cache_dir():
+    return ".preprocessing_cache"
+
+
+def instrumentation():
+    """
+    return True to record the time taken by each stage of a run (reading, clustering, building, solving, ...),
+    and the size of each model built, saved as trace_*.json (see instrumentation.py)
+    """
+    return _settings.get("instrumentation", False)
+
+def instrumentation_memory():
+    """
+    return True to also record the peak memory of each stage when instrumentation() is on
+    (with tracemalloc, which slows down code allocating many small objects)
+    """
+    return True
+
+
 def number_of_scenarios_to_use():
-    return 1
+    return _settings.get("number_of_scenarios", 1)
+
+
+def reduced_scenarios():
+    """
+    scenario reduction (see scenario_reduction.py): return N to solve the SCENARIOS model with N of the
+    scenarios read in, chosen by fast forward selection and weighted by the probability they stand for
+    return None to solve it with every scenario read in, each equally likely
+    """
+    return _settings.get("reduced_scenarios", None)
+
+
+def number_of_workers():
+    """
+    number of processes used to work through scenarios in parallel (scenario_pool.py)
+    return None (or 1) to run scenarios one after another in this process: a process pool only
+    pays off when each scenario takes far longer than starting the workers (sweep.py: one per configuration)
+    """
+    return _settings.get("number_of_workers", None)
+
+def solver_threads():
+    """
+    number of threads each solve may use, None leaves it to the solver
+    """
+    return _settings.get("solver_threads", None)
+
+
+def solver_backend():
+    """
+    solver used for the MECWLP and SCENARIOS models (see solvers.py):
+    'xpress', or 'highs' / 'scipy' to use HiGHS, which has no model size limit
+    """
+    return _settings.get("solver_backend", "xpress")
+
+
+def sweep_configurations():
+    """
+    runs made by sweep.py: the model to solve, how to cluster customers and how many scenarios to use
+    (and optionally "solver", the solver backend, "formulation", the model formulation,
+    "arcs_per_cluster", see delivery_arcs_per_cluster(), and "window", see rolling_horizon_window())
+    """
+    return [{"model": "MECWLP", "cluster_type": "kmeans", "cluster_size": k, "number_of_scenarios": 1}
+            for k in [10, 20, 50]] + \
+           [{"model": "MECWLP", "cluster_type": "parliament", "cluster_size": None, "number_of_scenarios": 1}]
+
+
+def benders_multi_cut():
+    """
+    Benders decomposition of the scenarios model (benders.py):
+    return True to add one optimality cut per scenario each iteration,
+    False to add a single cut averaged over scenarios
+    """
+    return True
+
+def benders_gap_tolerance():
+    return 1e-4
+
+def benders_max_iterations():
+    return 200
+
+
+def lagrangian_start():
+    """
+    return True to start the MECWLP model from the plan found by Lagrangian relaxation (see lagrangian.py)
+    """
+    return False
+
+def lagrangian_gap_tolerance():
+    return 1e-3
+
+def lagrangian_max_iterations():
+    return 300
+
+
+def model_build_method():
+    """
+    return 'matrix' to assemble the models as sparse arrays and load them into the solver in one call
+    return 'generator' to build them one variable/constraint term at a time
+    both give the same model, 'matrix' is much faster to build
+    """
+    return "matrix"
+
+
+def warm_start_from():
+    """
+    return the cluster type of an earlier run (e.g. 'kmeans10') to start the MECWLP model from the build/open
+    decisions it saved (build_kmeans10.csv and open_kmeans10.csv, see warm_start.py)
+    return None to solve from scratch
+    """
+    return None
+
+def sweep_warm_start():
+    """
+    return True for sweep.py to make its runs one after another, each starting from the build/open decisions
+    of the run before it, False to make them in parallel, each from scratch
+    """
+    return False
+
+
+def screen_candidates():
+    """
+    return True to drop candidates that can't be in an optimal solution before building the models
+    (see candidate_screening.py), at the cost of an LP solve and a rounding heuristic
+    return False to build the models over every candidate
+    """
+    return _settings.get("screen_candidates", False)
+
+
+def model_formulation():
+    """
+    return 'full' for the model with a delivered variable per product,
+    or 'aggregated' for one assignment variable per (candidate, cluster, period), shared by every product:
+    |Products| times fewer delivery variables and constraints (see matrix_builder.build_MECWLP_matrices)
+    """
+    return _settings.get("model_formulation", "full")
+
+
+def delivery_arcs_per_cluster():
+    """
+    arc sparsification (see arc_sparsification.py): return K to only create delivery variables
+    from the K cheapest candidates to each cluster, adding more where they could improve the solution
+    return None to create delivery variables from every candidate to every cluster
+    """
+    return _settings.get("delivery_arcs_per_cluster", None)
+
+def delivery_arc_radius():
+    """
+    arc sparsification: return a distance in miles to (also) create delivery variables from every candidate
+    within that distance of a cluster, None for no radius
+    """
+    return _settings.get("delivery_arc_radius", None)
+
+
+def lazy_linking():
+    """
+    return True to build the models with one open linking row per candidate and period, adding the
+    delivered <= open rows violated by the LP relaxation until there are none (see lazy_linking.py)
+    return False to create every delivered <= open row up front
+    """
+    return _settings.get("lazy_linking", False)
+
+
+def rolling_horizon_window():
+    """
+    rolling horizon (see rolling_horizon.py): return W to solve the models W periods at a time,
+    fixing the open decisions of the first rolling_horizon_step() periods and moving the window on
+    return None to solve over every period at once
+    """
+    return _settings.get("rolling_horizon_window", None)
+
+def rolling_horizon_step():
+    """
+    rolling horizon: number of periods fixed after each window
+    """
+    return _settings.get("rolling_horizon_step", 1)
+
+def rolling_horizon_polish():
+    """
+    rolling horizon: return True to finish with a solve over every period, started from the plan found
+    """
+    return False
+
+def rolling_horizon_polish_time_limit():
+    """
+    rolling horizon: time limit in seconds of the solve over every period
+    """
+    return 600
 
 
 def cluster_size():
-    return 10
+    return _settings.get("cluster_size", 10)
+
+def clustering_algorithm():
+    """
+    kmeans clustering (see preprocessing.get_cluster_labels): return 'kmeans' for KMeans,
+    or 'minibatch' for MiniBatchKMeans, much faster for thousands of clusters
+    """
+    return _settings.get("clustering_algorithm", "kmeans")
+
+def cluster_by_demand():
+    """
+    return True to weight each postcode district by its demand when clustering with kmeans,
+    giving smaller clusters where demand is concentrated
+    """
+    return _settings.get("cluster_by_demand", False)
 
 def clustertype():
     """
@@ -15,6 +287,8 @@ def clustertype():
     return kmeans{cluster_size()} if you'd like to cluster demand, k being set by the cluster size function above
     """
     #return "parliament"
+    if _settings.get("cluster_type") == "parliament":
+        return "parliament"
     return f"kmeans{cluster_size()}"
 
 # =============================================================================
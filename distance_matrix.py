@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Memory-mapped district-district distance matrix
+#
+# Distance District-District.csv is a dense N x N matrix. It's converted once into
+# a float32 .npy file (plus its row and column district IDs) next to the csv,
+# which is then memory-mapped: only the rows and columns that are actually
+# read get loaded, rather than the full matrix.
+# The conversion is redone whenever the csv is newer than the .npy file;
+# once converted, the csv can be removed.
+# =============================================================================
+
+CONVERSION_CHUNK_ROWS = 1000
+
+
+class DistrictDistances:
+    """
+    Memory-mapped distance matrix with its row (index) and column district IDs.
+    Pickles as its file path, so it can be sent to worker processes cheaply.
+    """
+
+    def __init__(self, npy_path: str):
+        self.npy_path = npy_path
+        self.matrix = np.load(npy_path, mmap_mode="r")
+        self.index = pd.Index(np.load(_ids_path(npy_path, "index")))
+        self.columns = pd.Index(np.load(_ids_path(npy_path, "columns")))
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def read(self, row_positions, column_labels) -> np.ndarray:
+        """
+        Read the distances from the rows at row_positions to the districts in column_labels.
+        """
+        column_positions = self.columns.get_indexer(column_labels)
+        if (column_positions < 0).any():
+            raise KeyError(f"Districts missing from the distance matrix: "
+                           f"{list(pd.Index(column_labels)[column_positions < 0])}")
+        return np.asarray(self.matrix[np.asarray(row_positions)][:, column_positions], dtype=float)
+
+    def __getstate__(self):
+        return {"npy_path": self.npy_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["npy_path"])
+
+
+def _ids_path(npy_path: str, which: str) -> str:
+    return f"{os.path.splitext(npy_path)[0]}_{which}.npy"
+
+
+def convert_distance_matrix(csv_path: str, npy_path: str):
+    """
+    Convert a distance matrix csv (first column holding the row IDs, header the column IDs)
+    to a float32 .npy file, a chunk of rows at a time, without reading the whole csv into memory.
+    """
+    columns = pd.read_csv(csv_path, index_col=0, nrows=0).columns.astype(int)
+    with open(csv_path, "rb") as f:
+        nrows = sum(1 for _ in f) - 1
+
+    tmp_path = f"{npy_path}.tmp.npy"
+    matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(nrows, len(columns)))
+    index = []
+    start = 0
+    for chunk in pd.read_csv(csv_path, index_col=0, chunksize=CONVERSION_CHUNK_ROWS):
+        matrix[start:start + chunk.shape[0]] = chunk.to_numpy(dtype=np.float32)
+        index.append(chunk.index.to_numpy())
+        start += chunk.shape[0]
+    matrix.flush()
+    del matrix
+
+    np.save(_ids_path(npy_path, "index"), np.concatenate(index))
+    np.save(_ids_path(npy_path, "columns"), columns.to_numpy())
+    os.replace(tmp_path, npy_path)
+
+
+def load_district_distances(data_dir: str) -> DistrictDistances:
+    """
+    Memory-map the district-district distance matrix, converting the csv first if needed.
+    """
+    csv_path = f"{data_dir}/Distance District-District.csv"
+    npy_path = f"{data_dir}/Distance District-District.npy"
+
+    # without the csv (e.g. removed to save space once converted) the .npy file is used as it is
+    if not os.path.exists(npy_path) or (os.path.exists(csv_path)
+                                        and os.path.getmtime(npy_path) < os.path.getmtime(csv_path)):
+        print("Converting the district-district distance matrix to a memory-mapped .npy file")
+        convert_distance_matrix(csv_path, npy_path)
+
+    return DistrictDistances(npy_path)
@@ -0,0 +1,159 @@
+import time
+import json
+import functools
+import tracemalloc
+from contextlib import nullcontext
+from datetime import datetime
+import constants
+
+# =============================================================================
+# Per-run trace of where time and memory go
+#
+# Each stage of a run (reading the csvs, clustering, building the model, solving, ...) is wrapped in
+#   with instrumentation.stage("clustering"):
+# a function decorated with @instrumentation.timed(), or start_stage(name) ... end_stage().
+# Stages nest, and each is recorded with its path (e.g. MECWLP_model/solve), when it started
+# and how long it took, and with constants.instrumentation_memory(), the peak memory allocated during it
+# above what was allocated when it started (tracemalloc, so memory allocated by python and numpy,
+# not by the solvers).
+# instrumentation.record(columns=...) adds values, such as the size of the model built, to the current stage.
+#
+# A run is started by start_run and its trace saved as JSON by save_trace.
+# Outside of a run, or with constants.instrumentation() False, every stage is the same do-nothing
+# context and record does nothing, so the instrumentation costs next to nothing when switched off.
+# =============================================================================
+
+# the run being traced, None when not tracing
+_trace = None
+_NO_STAGE = nullcontext()
+
+
+class _Stage:
+    """
+    Records the time and peak memory of one stage of the run traced.
+    """
+
+    def __init__(self, trace: dict, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        stack = self.trace["stack"]
+        path = "/".join([frame["record"]["stage"] for frame in stack[-1:]] + [self.name])
+        self.record = {"stage": path, "depth": len(stack), "start": time.perf_counter() - self.trace["start"]}
+        self.trace["stages"].append(self.record)
+        self.frame = {"record": self.record, "stage": self}
+        if self.trace["memory"]:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak so far belongs to the stage this one is nested in
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            self.frame.update({"allocated": current, "peak": current})
+        stack.append(self.frame)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record["time"] = time.perf_counter() - self.started
+        stack = self.trace["stack"]
+        stack.pop()
+        if self.trace["memory"]:
+            peak = max(self.frame["peak"], tracemalloc.get_traced_memory()[1])
+            self.record["peak_memory_mb"] = (peak - self.frame["allocated"]) / 1024 ** 2
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+        return False
+
+
+def start_run(name: str):
+    """
+    Purpose of the function is to start tracing a run called name, when constants.instrumentation() is set.
+    """
+    global _trace
+    if not constants.instrumentation():
+        _trace = None
+        return
+    memory = constants.instrumentation_memory()
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    _trace = {"run": name, "created": datetime.now().isoformat(timespec="seconds"),
+              "settings": dict(constants._settings), "memory": memory, "started_tracemalloc": started_tracemalloc,
+              "start": time.perf_counter(), "stages": [], "stack": []}
+
+
+def stage(name: str):
+    """
+    Context manager timing the stage called name (nested in whichever stage is running).
+    """
+    if _trace is None:
+        return _NO_STAGE
+    return _Stage(_trace, name)
+
+
+def start_stage(name: str):
+    """
+    Start timing the stage called name, until end_stage(): for stages spanning a long stretch of code,
+    where stage() would mean indenting all of it.
+    """
+    if _trace is None:
+        return
+    _Stage(_trace, name).__enter__()
+
+
+def end_stage():
+    """
+    Finish the stage last started by start_stage.
+    """
+    if _trace is None or not _trace["stack"]:
+        return
+    _trace["stack"][-1]["stage"].__exit__(None, None, None)
+
+
+def timed(name: str = None):
+    """
+    Decorator timing every call to a function as a stage, called name (default the function's name).
+    """
+    def decorator(function):
+        stage_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return function(*args, **kwargs)
+            with _Stage(_trace, stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(**values):
+    """
+    Add values (e.g. columns, rows and nonzeros of the model built) to the current stage.
+    """
+    if _trace is None or not _trace["stack"]:
+        return
+    _trace["stack"][-1]["record"].update(values)
+
+
+def save_trace(path: str = None) -> list:
+    """
+    Purpose of the function is to stop tracing the run and save its trace to path
+    (default trace_{run name}.json in constants.output_directory()). Returns the stages recorded, an empty list when not tracing.
+    """
+    global _trace
+    if _trace is None:
+        return []
+    trace, _trace = _trace, None
+    if trace["started_tracemalloc"]:
+        tracemalloc.stop()
+    if path is None:
+        path = constants.get_output_path(f"trace_{trace['run']}.json")
+    with open(path, "w") as f:
+        json.dump({"run": trace["run"], "created": trace["created"], "settings": trace["settings"],
+                   "total_time": time.perf_counter() - trace["start"], "stages": trace["stages"]},
+                  f, indent=2, default=str)
+    print(f"Saved the trace of {trace['run']} to {path}")
+    return trace["stages"]
@@ -0,0 +1,299 @@
+import time
+import numpy as np
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+import warm_start
+
+# =============================================================================
+# Lagrangian relaxation of the MECWLP and SCENARIOS models
+#
+# The demand rows (sum_c delivered[c, k, p, t] == 1, multipliers lambda[k, p, t] per scenario) and
+# the supplier capacity rows (multipliers rho[s, t] >= 0 per scenario) are moved into the objective.
+# As every period's stock is delivered (total supply == total demand), what is left splits into one
+# subproblem per (candidate, period, scenario), solved in closed form with numpy:
+#   - each unit of product p delivered to cluster k costs its delivery cost, plus the supply cost from
+#     the cheapest supplier of p (with rho), less lambda[k, p, t] / demand[k, p, t]
+#   - a warehouse takes the units with negative cost, cheapest first, up to its capacity
+#     (a fractional knapsack)
+# and one subproblem per candidate for build/open: open from the period that minimises setup cost plus
+# operating cost and knapsack values from then on, or never build.
+# Each solution gives a lower bound on the model's objective (also of the aggregated formulation, which
+# only restricts the model), and the multipliers are moved along the subgradient (Polyak step).
+#
+# Upper bounds come from repairing the build/open plans found: warehouses are opened (cheapest
+# Lagrangian cost per unit of capacity first) until each period's demand fits, the recourse is solved as
+# an LP with build/open fixed, and warehouses that end up unused in early periods are opened later
+# (or not at all). The best plan is returned and can be used as a MIP start for the models.
+# =============================================================================
+
+# the step size multiplier starts at STEP_START, and is halved after STEP_PATIENCE iterations without
+# a better lower bound; the search stops once it falls below STEP_MIN
+STEP_START = 2.0
+STEP_PATIENCE = 10
+STEP_MIN = 1e-4
+# plans are repaired and costed with an LP every UPPER_BOUND_FREQUENCY iterations,
+# and once more for the best lower bound at the end
+UPPER_BOUND_FREQUENCY = 10
+
+
+def _supply_costs(arrays: dict, supplier_multipliers: np.ndarray, weight: float, nP: int):
+    """
+    Cheapest supply cost per unit of each product at each candidate, and the supplier giving it,
+    (candidate, product, period).
+    """
+    # (candidate, supplier, period)
+    costs = (weight * arrays["cost_supplier_candidate"].T[:, :, None]
+             + (supplier_multipliers / arrays["supplier_capacity"][:, None])[None])
+    suppliers = arrays["product_group"] - 1
+    nC, nT = costs.shape[0], costs.shape[2]
+    cheapest = np.zeros((nC, nP, nT))
+    cheapest_supplier = np.zeros((nC, nP, nT), dtype=int)
+    for p in range(nP):
+        of_product = np.flatnonzero(suppliers == p)
+        best = np.argmin(costs[:, of_product], axis=1)
+        cheapest_supplier[:, p] = of_product[best]
+        cheapest[:, p] = np.take_along_axis(costs[:, of_product], best[:, None], axis=1)[:, 0]
+    return cheapest, cheapest_supplier
+
+
+def _knapsack(unit_costs: np.ndarray, amounts: np.ndarray, capacity: np.ndarray):
+    """
+    Fractional knapsack along the last axis of unit_costs (candidate, period, item): the amounts of
+    items with negative cost taken, cheapest first, up to the candidate's capacity.
+    Returns the amount taken of each item and the total cost per (candidate, period).
+    """
+    order = np.argsort(unit_costs, axis=2)
+    sorted_costs = np.take_along_axis(unit_costs, order, axis=2)
+    sorted_amounts = np.take_along_axis(np.broadcast_to(amounts, unit_costs.shape), order, axis=2)
+    before = np.cumsum(sorted_amounts, axis=2) - sorted_amounts
+    taken = np.clip(capacity[:, None, None] - before, 0, sorted_amounts) * (sorted_costs < 0)
+    amount = np.zeros(unit_costs.shape)
+    np.put_along_axis(amount, order, taken, axis=2)
+    return amount, (taken * sorted_costs).sum(axis=2)
+
+
+def solve_lagrangian_subproblem(arrays_list: list, demand_multipliers: list, supplier_multipliers: list):
+    """
+    Purpose of the function is to solve the Lagrangian subproblem for the given multipliers, a
+    (cluster, product, period) and a (supplier, period) array per scenario.
+    Returns the lower bound, the build (candidate) and open (candidate, period) decisions,
+    the subgradients of the multipliers and the Lagrangian cost of opening each (candidate, period).
+    """
+    nC, nK, nT = arrays_list[0]["cost_candidate_customer"].shape
+    nP = arrays_list[0]["grouped_demand"].shape[1]
+
+    bound = 0
+    open_costs = np.tile(arrays_list[0]["operating"][:, None], (1, nT))
+    knapsacks = []
+    for arrays, lam, rho in zip(arrays_list, demand_multipliers, supplier_multipliers):
+        demand = arrays["grouped_demand"]
+        weight = arrays["probability"]
+        supply_costs, cheapest_supplier = _supply_costs(arrays, rho, weight, nP)
+        reward = np.divide(lam, demand, out=np.zeros_like(lam), where=demand > 0)
+        # (candidate, cluster, product, period) -> (candidate, period, cluster * product)
+        unit_costs = (weight * arrays["cost_candidate_customer"][:, :, None, :] + supply_costs[:, None]
+                      - reward[None])
+        unit_costs = unit_costs.transpose(0, 3, 1, 2).reshape(nC, nT, nK * nP)
+        amounts = demand.transpose(2, 0, 1).reshape(nT, nK * nP)
+        amount, value = _knapsack(unit_costs, amounts, arrays["candidate_capacity"])
+        open_costs += value
+        bound += lam[demand > 0].sum() - rho.sum()
+        knapsacks.append((amount, cheapest_supplier))
+
+    # open from period tau (cost: setup plus open costs from tau on) or never build (cost: 0)
+    tail_costs = np.cumsum(open_costs[:, ::-1], axis=1)[:, ::-1]
+    options = np.concatenate([arrays_list[0]["setup"][:, None] + tail_costs, np.zeros((nC, 1))], axis=1)
+    first_open = np.argmin(options, axis=1)
+    bound += options[np.arange(nC), first_open].sum()
+    open = (np.arange(nT)[None] >= first_open[:, None]).astype(float)
+    build = open.max(axis=1)
+
+    demand_subgradients = []
+    supplier_subgradients = []
+    for arrays, rho, (amount, cheapest_supplier) in zip(arrays_list, supplier_multipliers, knapsacks):
+        demand = arrays["grouped_demand"]
+        # (candidate, period, cluster * product) -> (candidate, cluster, product, period), from open warehouses
+        amount = (amount * open[:, :, None]).reshape(nC, nT, nK, nP).transpose(0, 2, 3, 1)
+        delivered = np.divide(amount.sum(axis=0), demand, out=np.ones_like(demand), where=demand > 0)
+        demand_subgradients.append(np.where(demand > 0, 1 - delivered, 0))
+
+        supplied = np.zeros(rho.shape)
+        periods = np.broadcast_to(np.arange(nT), (nC, nT))
+        for p in range(nP):
+            np.add.at(supplied, (cheapest_supplier[:, p], periods), amount[:, :, p].sum(axis=1))
+        subgradient = supplied / arrays["supplier_capacity"][:, None] - 1
+        # multipliers at zero can't decrease
+        supplier_subgradients.append(np.where((rho <= 0) & (subgradient < 0), 0, subgradient))
+    return bound, build, open, demand_subgradients, supplier_subgradients, open_costs
+
+
+def repair_plan(arrays_list: list, open: np.ndarray, open_costs: np.ndarray) -> np.ndarray:
+    """
+    Purpose of the function is to open more warehouses until the capacity open in each period can hold
+    that period's demand in every scenario, choosing the lowest open_costs (plus setup cost if not yet built)
+    per unit of capacity first. Warehouses remain open once opened.
+    Returns the open decisions (candidate, period), or None when the candidates can't hold the demand.
+    """
+    capacity = arrays_list[0]["candidate_capacity"]
+    setup = arrays_list[0]["setup"]
+    total_demand = np.max([arrays["grouped_demand"].sum(axis=(0, 1)) for arrays in arrays_list], axis=0)
+    tail_costs = np.cumsum(open_costs[:, ::-1], axis=1)[:, ::-1]
+    open = open.copy()
+    for t in range(open.shape[1]):
+        while capacity.dot(open[:, t]) < total_demand[t] * (1 + 1e-9):
+            closed = open[:, t] < 0.5
+            if not closed.any():
+                return None
+            costs = (setup * (open.max(axis=1) < 0.5) + tail_costs[:, t]) / capacity
+            c = np.flatnonzero(closed)[np.argmin(costs[closed])]
+            open[c, t:] = 1
+    return open
+
+
+def _plan_cost(matrices: matrix_builder.ModelMatrices, open: np.ndarray):
+    """
+    Cost of a build/open plan, from the LP with build/open fixed,
+    and the periods each warehouse is used in (candidate, period). None when the plan isn't feasible.
+    """
+    lb = matrices.lb.copy()
+    ub = matrices.ub.copy()
+    lb[matrices.blocks["build"]] = ub[matrices.blocks["build"]] = open.max(axis=1)
+    lb[matrices.blocks["open"]] = ub[matrices.blocks["open"]] = open
+    lp = solvers.solve_lp(matrices, lb, ub)
+    if lp.status != 0:
+        return None, None
+    warehoused = lp.x[matrices.blocks["warehoused"]]
+    # (candidate, product, period[, scenario])
+    stock = warehoused.reshape(warehoused.shape[0], warehoused.shape[1], warehoused.shape[2], -1).sum(axis=(1, 3))
+    return lp.fun, stock > 1e-6 * (1 + stock.max())
+
+
+def _upper_bound(matrices: matrix_builder.ModelMatrices, arrays_list: list, open: np.ndarray,
+                 open_costs: np.ndarray, costed: dict):
+    """
+    Cost of the plan repaired from a Lagrangian solution, with each warehouse then opened from the first
+    period it's used in if that's cheaper. costed holds the cost of every plan tried so far.
+    Returns the cost and the plan, or None, None when the plan was tried before or isn't feasible.
+    """
+    plan = repair_plan(arrays_list, open, open_costs)
+    if plan is None or plan.tobytes() in costed:
+        return None, None
+    cost, used = _plan_cost(matrices, plan)
+    costed[plan.tobytes()] = cost
+    if cost is None:
+        return None, None
+    trimmed = np.maximum.accumulate(used, axis=1).astype(float)
+    if not np.array_equal(trimmed, plan) and trimmed.tobytes() not in costed:
+        trimmed_cost = _plan_cost(matrices, trimmed)[0]
+        costed[trimmed.tobytes()] = trimmed_cost
+        if trimmed_cost is not None and trimmed_cost < cost:
+            return trimmed_cost, trimmed
+    return cost, plan
+
+
+def lagrangian_heuristic(model: str, model_inputs: tuple, max_iterations: int = None, gap_tolerance: float = None,
+                         time_limit: float = None):
+    """
+    Purpose of the function is to find lower and upper bounds on the MECWLP (model 'MECWLP') or SCENARIOS
+    (model 'SCENARIOS') model, given its arguments, by Lagrangian relaxation.
+    Stops once the gap is within gap_tolerance (default constants.lagrangian_gap_tolerance()),
+    after max_iterations (default constants.lagrangian_max_iterations()) or time_limit seconds.
+
+    Returns a SolverResult with the cost of the best plan found as objective, the lower bound as bound and
+    x the build/open values (see solvers.solve_matrices mip_start), and the plan as a
+    warm_start.FirstStageSolution (None when no feasible plan was found).
+    """
+    if max_iterations is None:
+        max_iterations = constants.lagrangian_max_iterations()
+    if gap_tolerance is None:
+        gap_tolerance = constants.lagrangian_gap_tolerance()
+
+    start_time = time.perf_counter()
+    Candidates, Times = model_inputs[0], list(model_inputs[1])
+    nC, nT = len(Candidates), len(Times)
+    arrays_list = matrix_builder.get_model_arrays_list(model, model_inputs)
+    build_matrices = {"MECWLP": matrix_builder.build_MECWLP_matrices,
+                      "SCENARIOS": matrix_builder.build_SCENARIOS_matrices}[model]
+    matrices = build_matrices(*model_inputs, names=False, aggregated=constants.model_formulation() == "aggregated")
+
+    # start from the cost of serving each cluster's demand from its cheapest candidate
+    nP = arrays_list[0]["grouped_demand"].shape[1]
+    demand_multipliers = []
+    supplier_multipliers = []
+    for arrays in arrays_list:
+        rho = np.zeros(arrays["supplier_demand"].shape)
+        weight = arrays["probability"]
+        supply_costs = _supply_costs(arrays, rho, weight, nP)[0]
+        unit_costs = weight * arrays["cost_candidate_customer"][:, :, None, :] + supply_costs[:, None]
+        demand_multipliers.append(arrays["grouped_demand"] * unit_costs.min(axis=0))
+        supplier_multipliers.append(rho)
+
+    lower_bound = -np.inf
+    upper_bound = np.inf
+    best_open = None
+    costed = {}
+    step = STEP_START
+    since_improved = 0
+    iteration_log = []
+    for iteration in range(1, max_iterations + 1):
+        (bound, build, open, demand_subgradients, supplier_subgradients,
+         open_costs) = solve_lagrangian_subproblem(arrays_list, demand_multipliers, supplier_multipliers)
+        if bound > lower_bound + 1e-9 * abs(bound):
+            lower_bound = bound
+            best_bound_plan = (open, open_costs)
+            since_improved = 0
+        else:
+            since_improved += 1
+            if since_improved >= STEP_PATIENCE:
+                step /= 2
+                since_improved = 0
+
+        if iteration == 1 or iteration % UPPER_BOUND_FREQUENCY == 0:
+            cost, plan = _upper_bound(matrices, arrays_list, open, open_costs, costed)
+            if cost is not None and cost < upper_bound:
+                upper_bound, best_open = cost, plan
+
+        gap = (upper_bound - lower_bound) / (1e-10 + abs(upper_bound)) if np.isfinite(upper_bound) else np.inf
+        iteration_log.append({"iteration": iteration,
+                              "lower_bound": lower_bound,
+                              "upper_bound": upper_bound,
+                              "gap": gap,
+                              "step": step,
+                              "time": time.perf_counter() - start_time})
+        if (gap <= gap_tolerance or step < STEP_MIN
+                or (time_limit is not None and time.perf_counter() - start_time > time_limit)):
+            break
+
+        # Polyak step towards the best plan's cost
+        norm = (sum(np.sum(g ** 2) for g in demand_subgradients)
+                + sum(np.sum(g ** 2) for g in supplier_subgradients))
+        if norm == 0:
+            break
+        target = upper_bound if np.isfinite(upper_bound) else lower_bound + 0.1 * abs(lower_bound)
+        size = step * (target - bound) / norm
+        demand_multipliers = [lam + size * g for lam, g in zip(demand_multipliers, demand_subgradients)]
+        supplier_multipliers = [np.maximum(rho + size * g, 0) for rho, g in zip(supplier_multipliers,
+                                                                                 supplier_subgradients)]
+
+    # the plan of the best lower bound may not have been costed yet
+    cost, plan = _upper_bound(matrices, arrays_list, *best_bound_plan, costed)
+    if cost is not None and cost < upper_bound:
+        upper_bound, best_open = cost, plan
+        gap = (upper_bound - lower_bound) / (1e-10 + abs(upper_bound))
+        iteration_log[-1].update(upper_bound=upper_bound, gap=gap)
+
+    run_time = time.perf_counter() - start_time
+    print(f"Lagrangian relaxation: {len(iteration_log)} iterations in {run_time:.2f}s, "
+          f"lower bound {lower_bound:.2f}, upper bound {upper_bound:.2f}, gap {gap*100:.2f}%")
+    pd.DataFrame(iteration_log).to_csv(
+        constants.get_output_path(f"lagrangian_log_{model}_{constants.clustertype()}.csv"), index=False)
+
+    if best_open is None:
+        return solvers.SolverResult(backend="lagrangian", status="no solution", bound=lower_bound,
+                                    solve_time=run_time), None
+    build = best_open.max(axis=1)
+    result = solvers.SolverResult(backend="lagrangian", status="feasible", objective=upper_bound, bound=lower_bound,
+                                  solve_time=run_time, x=np.concatenate([build, best_open.ravel()]))
+    return result, warm_start.get_first_stage_solution(Candidates, Times, build, best_open)
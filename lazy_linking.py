@@ -0,0 +1,90 @@
+import time
+import numpy as np
+import constants
+import matrix_builder
+import solvers
+import instrumentation
+
+# =============================================================================
+# Lazy open linking rows
+#
+# delivered[c, k, p, t] <= open[c, t] (assigned[c, k, t] <= open[c, t] in the aggregated formulation)
+# is the largest block of rows in the MECWLP and SCENARIOS models, one per delivery column,
+# and few of them bind. The models are instead built with one row per candidate and period,
+#   sum over k, p of delivered[c, k, p, t] <= |K||P| open[c, t]
+# which allows exactly the same solutions when open is binary, but gives a weaker LP relaxation.
+# Its LP relaxation is solved, the disaggregated rows it violates are added, and the LP solved
+# again until it violates none: its bound is then the LP bound of the full model, as the LP solution
+# found satisfies every row of the full model. The MIP is then solved once, with the rows found.
+# Rows are added to every scenario at once, so the SCENARIOS model shares one row pattern.
+# =============================================================================
+
+# a row is violated when delivered exceeds open by more than this
+LINKING_TOLERANCE = 1e-6
+MAX_LINKING_ROUNDS = 50
+
+
+def enabled() -> bool:
+    return constants.lazy_linking()
+
+
+def get_violated_links(matrices: matrix_builder.ModelMatrices, x: np.ndarray) -> np.ndarray:
+    """
+    Purpose of the function is to find the open linking rows left out of a model (see
+    matrix_builder.recourse_pattern) that a solution x violates, in any scenario.
+    Returns a boolean array over the delivery columns in the order they are laid out.
+    """
+    name = "assigned" if "assigned" in matrices.blocks else "delivered"
+    columns = matrices.blocks[name]
+    if matrices.name != "SCENARIOS":
+        columns = columns[..., None]
+    kept = columns[..., 0] >= 0
+    # open (candidate, period), against the delivery columns (candidate, cluster[, product], period, scenario)
+    open_values = x[matrices.blocks["open"]].reshape((columns.shape[0],) + (1,) * (columns.ndim - 3)
+                                                     + (columns.shape[-2], 1))
+    violated = ((x[np.maximum(columns, 0)] - open_values) > LINKING_TOLERANCE).any(axis=-1)
+    return violated[kept]
+
+
+@instrumentation.timed()
+def solve_with_lazy_linking(model: str, model_inputs: tuple, backend: str, threads: int = None,
+                            time_limit: float = None, output: bool = False, mip_start: np.ndarray = None):
+    """
+    Purpose of the function is to solve the MECWLP (model 'MECWLP') or SCENARIOS (model 'SCENARIOS') model,
+    given its arguments, adding the open linking rows violated by its LP relaxation until there are none,
+    then solving the MIP with the rows added, starting from mip_start when given.
+    Returns the SolverResult (with the time spent on the LPs included), its ModelMatrices and the total build time.
+    """
+    build_matrices = {"MECWLP": matrix_builder.build_MECWLP_matrices,
+                      "SCENARIOS": matrix_builder.build_SCENARIOS_matrices}[model]
+    aggregated = constants.model_formulation() == "aggregated"
+
+    # to start with only the rows summed over each candidate and period
+    linking = np.zeros(0, dtype=bool)
+    build_time = 0
+    lp_time = 0
+    for iteration in range(1, MAX_LINKING_ROUNDS + 1):
+        build_start = time.perf_counter()
+        matrices = build_matrices(*model_inputs, names=False, aggregated=aggregated, linking=linking)
+        build_time += time.perf_counter() - build_start
+
+        lp_start = time.perf_counter()
+        relaxation = solvers.solve_lp(matrices)
+        lp_time += time.perf_counter() - lp_start
+        if relaxation.status != 0:
+            print(f"Lazy linking round {iteration}: LP relaxation not solved ({relaxation.message})")
+            break
+        violated = get_violated_links(matrices, relaxation.x)
+        if linking.size == 0:
+            linking = np.zeros_like(violated)
+        print(f"Lazy linking round {iteration}: {matrices.nrows} rows, LP bound {relaxation.fun}, "
+              f"{violated.sum()} linking rows violated")
+        if not violated.any():
+            break
+        linking |= violated
+
+    print(f"Lazy linking: {linking.sum()} of {linking.size} linking rows added")
+    result = solvers.solve_matrices(matrices, backend, threads=threads, time_limit=time_limit, output=output,
+                                    mip_start=mip_start)
+    result.solve_time += lp_time
+    return result, matrices, build_time
@@ -1,74 +1,320 @@
-import pandas as pd
-import numpy as np
-import xpress as xp
 import os
-import zipfile
-import preprocessing 
-import postprocessing
-import MECWLP_model
-import SCENARIOS_model
+import sys
+import json
+import argparse
+import importlib.util
 import constants
-import transforms
+import instrumentation
 
 #==================================================================================================================
-# To set model parameters, such as method of clustering to use, how many clusters to use, how many scenarios to use
-# Update the values in constants.py
+# Run the models from the command line, with settings from a JSON config file and/or command line options:
+#   python main.py [run] [--config run.json] [--model both] [--cluster-type kmeans] [--cluster-size 20] ...
+#   python main.py validate [...]    check the settings and that the input files are there, without reading them
+#   python main.py warm-cache [...]  preprocess the input data into the preprocessing cache (preprocessing_cache.py)
+# The config file holds any of the settings of constants.configure(), e.g.
+#   {"model": "both", "cluster_type": "kmeans", "cluster_size": 20, "number_of_scenarios": 5,
+#    "output_directory": "results"}
+# with command line options taking precedence. Settings given in neither take their value in constants.py.
+#
+# pandas, sklearn, the solvers and the models are only imported by the commands that need them,
+# so validate, and warm-cache once the cache is warm, start in a fraction of a second.
 #==================================================================================================================
 
-#read in input data and group customer demand and adjust distances between candidates and customers accordingly
-(Suppliers_df, Candidates_df, DemandPeriods_df, DemandPeriodsScenarios_df, DistanceSupplierDistrict_df,
-  DistanceDistrictPeriod_df_dict, DemandPeriodsGrouped, con_index_dict, Operating_df,
-    Setup_df, DemandPeriodsGrouped_scenarios, DistanceDistrictPeriod_df_scenarios_dict_list,
-    TotalDemandProductPeriod_dict, TotalDemandProductPeriodScenarios_dict) = preprocessing.read_input_data_and_preprocess()
-
-# Maximum supplier index (assumed to be integer-indexed)
-nbSuppliers = Suppliers_df.index.max()
-# Maximum candidate index
-nbCandidates = Candidates_df.index.max()
-# Number of time periods
-nbPeriods = DemandPeriods_df["Period"].max()
-# Number of scenarios
-nbScenarios = DemandPeriodsScenarios_df["Scenario"].max()
-# =============================================================================
-# Index sets
-# =============================================================================
-Customers  = list(con_index_dict.keys())
-Candidates = Candidates_df.index
-Suppliers  = Suppliers_df.index
-Products = range(1, DemandPeriods_df["Product"].max() + 1)
-# -----------------------------------------------------------------------------
-# Time periods and scenarios
-# -----------------------------------------------------------------------------
-Times = range(1, nbPeriods + 1)
-Scenarios = range(1, nbScenarios + 1)
-# =============================================================================
-# Transport cost calculations
-# =============================================================================
-CostSupplierCandidate = transforms.get_CostSupplierCandidate(DistanceSupplierDistrict_df,Suppliers_df,
-                                                             constants.VehicleCostPerMileAndTonneOverall,
-                                                             Candidates, Suppliers)
-CostCandidateCustomers = transforms.get_CostCandidateCustomers(DistanceDistrictPeriod_df_dict,
-                                                               constants.VehicleCostPerMileAndTonneOverall,
-                                                               Candidates, Customers, Times)
-CostCandidateCustomers_scenarios = []
-for i in range(constants.number_of_scenarios_to_use()):
-    CostCandidateCustomers_scenarios.append(transforms.get_CostCandidateCustomers(DistanceDistrictPeriod_df_scenarios_dict_list[i],
-                                                               constants.VehicleCostPerMileAndTonneOverall,
-                                                               Candidates, Customers, Times))
-
-#Formulate & solve the MECWLP model
-MECWLP_model.MECWLP_model(Candidates, Times, Suppliers, Products,Customers,
-                          Operating_df, Setup_df, CostSupplierCandidate,
-                          DemandPeriodsGrouped, CostCandidateCustomers,
-                          Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict)
-
-#Formulate & solve the Scenarios model
-#print(f"Number of Scenarios to run: {len(Scenarios)}")
-#SCENARIOS_model.SCENARIOS_model(Candidates, Times, Suppliers, Products,Customers, Scenarios,
-#                                Operating_df, Setup_df, CostSupplierCandidate,
-#                                DemandPeriodsGrouped_scenarios, CostCandidateCustomers_scenarios,
-#                                Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict)
-
-
-
-print("ok!")
\ No newline at end of file
+# files read from the input data directory (see preprocessing.read_input_data)
+INPUT_FILES = ["Suppliers.csv", "PostcodeDistricts.csv", "DemandPeriods.csv", "DemandPeriodScenarios.csv",
+               "Candidates.csv", "Setup.csv", "Operating.csv", "Distance Supplier-District.csv",
+               "Distance District-District.csv"]
+# package each solver backend needs (see solvers.py)
+SOLVER_PACKAGES = {"xpress": "xpress", "highs": "highspy", "scipy": "scipy"}
+
+@instrumentation.timed()
+def get_model_inputs(input_data: dict = None):
+    """
+    Purpose of the function is to read in (or take from input_data, see preprocessing.read_input_data)
+    and preprocess the input data with the settings in constants.py, and work out transport costs.
+    Returns the arguments of the MECWLP model, and the per-scenario data:
+    (grouped demand, candidate-customer costs, total demand) for each scenario.
+    """
+    import numpy as np
+    import preprocessing_cache
+    import transforms
+    import scenario_pool
+    #read in input data and group customer demand and adjust distances between candidates and customers accordingly
+    (Suppliers_df, Candidates_df, DemandPeriods_df, DemandPeriodsScenarios_df, DistanceSupplierDistrict_df,
+      DistanceDistrictPeriod_df_dict, DemandPeriodsGrouped, con_index_dict, Operating_df,
+        Setup_df, DemandPeriodsGrouped_scenarios, DistanceDistrictPeriod_df_scenarios_dict_list,
+        TotalDemandProductPeriod_dict, TotalDemandProductPeriodScenarios_dict) = preprocessing_cache.read_input_data_and_preprocess(input_data)
+
+    # Number of time periods
+    nbPeriods = DemandPeriods_df["Period"].max()
+    # =============================================================================
+    # Index sets
+    # =============================================================================
+    Customers  = list(con_index_dict.keys())
+    Candidates = Candidates_df.index
+    Suppliers  = Suppliers_df.index
+    Products = range(1, DemandPeriods_df["Product"].max() + 1)
+    # -----------------------------------------------------------------------------
+    # Time periods
+    # -----------------------------------------------------------------------------
+    Times = range(1, nbPeriods + 1)
+    # =============================================================================
+    # Transport cost calculations
+    # =============================================================================
+    CostSupplierCandidate = transforms.get_CostSupplierCandidate(DistanceSupplierDistrict_df,Suppliers_df,
+                                                                 constants.VehicleCostPerMileAndTonneOverall,
+                                                                 Candidates, Suppliers)
+    CostCandidateCustomers = transforms.get_CostCandidateCustomers(DistanceDistrictPeriod_df_dict,
+                                                                   constants.VehicleCostPerMileAndTonneOverall,
+                                                                   Candidates, Customers, Times)
+    scenario_distances = DistanceDistrictPeriod_df_scenarios_dict_list
+    if all(hasattr(distances, "distances") for distances in scenario_distances):
+        # the demand weighted distances of every scenario go to the workers once, through shared memory
+        first = scenario_distances[0]
+        CostCandidateCustomers_scenarios = scenario_pool.map_scenarios(
+            transforms.get_CostCandidateCustomers_scenario,
+            [(sc, first.constituencies, first.periods, first.rows, constants.VehicleCostPerMileAndTonneOverall,
+              Candidates, Customers, Times) for sc in range(len(scenario_distances))],
+            shared={"scenario_distances": np.stack([distances.distances for distances in scenario_distances])})
+    else:
+        CostCandidateCustomers_scenarios = scenario_pool.map_scenarios(
+            transforms.get_CostCandidateCustomers,
+            [(distances, constants.VehicleCostPerMileAndTonneOverall, Candidates, Customers, Times)
+             for distances in scenario_distances])
+
+    MECWLP_inputs = (Candidates, Times, Suppliers, Products, Customers,
+                     Operating_df, Setup_df, CostSupplierCandidate,
+                     DemandPeriodsGrouped, CostCandidateCustomers,
+                     Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict)
+    scenario_data = (DemandPeriodsGrouped_scenarios, CostCandidateCustomers_scenarios,
+                     TotalDemandProductPeriodScenarios_dict)
+
+    return MECWLP_inputs, scenario_data
+
+
+def get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_scenarios: int = None):
+    """
+    Arguments for the SCENARIOS model (or benders.benders_SCENARIOS) with n_scenarios scenarios,
+    by default every scenario read in.
+    Only constants.number_of_scenarios_to_use() scenarios are read in, so for larger models
+    the scenarios that were read in are reused in turn.
+    """
+    (Candidates, Times, Suppliers, Products, Customers, Operating_df, Setup_df, CostSupplierCandidate,
+     _, _, Suppliers_df, Candidates_df, _) = MECWLP_inputs
+    DemandPeriodsGrouped_scenarios, CostCandidateCustomers_scenarios, TotalDemandProductPeriodScenarios_dict = scenario_data
+    if n_scenarios is None:
+        n_scenarios = len(DemandPeriodsGrouped_scenarios)
+    cycle = [i % len(DemandPeriodsGrouped_scenarios) for i in range(n_scenarios)]
+
+    return (Candidates, Times, Suppliers, Products, Customers, range(1, n_scenarios + 1),
+            Operating_df, Setup_df, CostSupplierCandidate,
+            [DemandPeriodsGrouped_scenarios[i] for i in cycle],
+            [CostCandidateCustomers_scenarios[i] for i in cycle],
+            Suppliers_df, Candidates_df,
+            [TotalDemandProductPeriodScenarios_dict[i] for i in cycle])
+
+
+def run():
+    """
+    Purpose of the function is to preprocess the input data and solve the models chosen by
+    constants.models_to_solve(), saving their results to constants.output_directory().
+    Each model and solve method is only imported when the run uses it.
+    """
+    #time each stage of the run, if set (see instrumentation.py)
+    instrumentation.start_run(f"main_{constants.clustertype()}")
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    # the scenario costs are over every candidate, so the SCENARIOS model is screened on its own
+    SCENARIOS_inputs = get_SCENARIOS_inputs(MECWLP_inputs, scenario_data)
+    models = constants.models_to_solve()
+
+    #Formulate & solve the MECWLP model, for the candidates that could be in an optimal solution
+    MECWLP_results = None
+    if models in ("MECWLP", "both"):
+        import MECWLP_model
+        if constants.screen_candidates():
+            import candidate_screening
+            with instrumentation.stage("screen_candidates"):
+                MECWLP_inputs = candidate_screening.screen_candidates("MECWLP", MECWLP_inputs)
+        #starting from the build/open decisions of an earlier run, if set in constants.py
+        mip_start = None
+        if constants.warm_start_from() is not None:
+            import warm_start
+            mip_start = warm_start.read_first_stage_solution(
+                constants.get_output_path(f"build_{constants.warm_start_from()}.csv"),
+                constants.get_output_path(f"open_{constants.warm_start_from()}.csv"))
+        #or from the plan found by Lagrangian relaxation (see lagrangian.py), which gives a lower bound in seconds
+        elif constants.lagrangian_start():
+            import lagrangian
+            with instrumentation.stage("lagrangian_heuristic"):
+                mip_start = lagrangian.lagrangian_heuristic("MECWLP", MECWLP_inputs)[1]
+        MECWLP_results = MECWLP_model.MECWLP_model(*MECWLP_inputs, mip_start=mip_start)
+
+    #Formulate & solve the Scenarios model, from the MECWLP build/open decisions when it was solved first
+    if models in ("SCENARIOS", "both"):
+        #on fewer scenarios standing for all of those read in, if set (see scenario_reduction.py)
+        if constants.reduced_scenarios() is not None:
+            import scenario_reduction
+            SCENARIOS_inputs = scenario_reduction.reduce_scenarios(SCENARIOS_inputs, constants.reduced_scenarios())
+        if constants.screen_candidates():
+            import candidate_screening
+            with instrumentation.stage("screen_candidates"):
+                SCENARIOS_inputs = candidate_screening.screen_candidates("SCENARIOS", SCENARIOS_inputs)
+        print(f"Number of Scenarios to run: {len(SCENARIOS_inputs[5])}")
+        #by Benders decomposition, if set (scales to many more scenarios than the extensive model)
+        if constants.scenarios_solver() == "benders":
+            import benders
+            benders.benders_SCENARIOS(*SCENARIOS_inputs)
+        else:
+            import SCENARIOS_model
+            SCENARIOS_model.SCENARIOS_model(*SCENARIOS_inputs,
+                                            mip_start=None if MECWLP_results is None
+                                            else MECWLP_results["first_stage"])
+
+    instrumentation.save_trace()
+
+    print("ok!")
+
+
+def get_solve_methods() -> list:
+    """
+    Purpose of the function is to list the settings that make the models build and solve themselves
+    (rolling_horizon.py, arc_sparsification.py, lazy_linking.py), which are set.
+    Only one of them can be used in a run.
+    """
+    methods = {"rolling_horizon_window": constants.rolling_horizon_window() is not None,
+               "delivery_arcs_per_cluster/delivery_arc_radius": (constants.delivery_arcs_per_cluster() is not None
+                                                                 or constants.delivery_arc_radius() is not None),
+               "lazy_linking": constants.lazy_linking()}
+    return [name for name, enabled in methods.items() if enabled]
+
+
+def validate() -> list:
+    """
+    Purpose of the function is to check the settings, that the input files are there and that the solver
+    backend is installed, without reading or importing anything heavy.
+    Returns the problems found, an empty list when there are none.
+    """
+    problems = []
+    choices = {"model": (constants.models_to_solve(), ["MECWLP", "SCENARIOS", "both"]),
+               "cluster_type": (constants._settings.get("cluster_type", "kmeans"), ["kmeans", "parliament"]),
+               "solver_backend": (constants.solver_backend(), list(SOLVER_PACKAGES)),
+               "model_formulation": (constants.model_formulation(), ["full", "aggregated"]),
+               "clustering_algorithm": (constants.clustering_algorithm(), ["kmeans", "minibatch"]),
+               "scenarios_solver": (constants.scenarios_solver(), ["extensive", "benders"])}
+    for name, (value, allowed) in choices.items():
+        if value not in allowed:
+            problems.append(f"{name} is {value!r}, it must be one of {allowed}")
+    counts = {"cluster_size": constants.cluster_size(), "number_of_scenarios": constants.number_of_scenarios_to_use(),
+              "reduced_scenarios": constants.reduced_scenarios(), "solver_threads": constants.solver_threads(),
+              "number_of_workers": constants.number_of_workers()}
+    for name, value in counts.items():
+        if value is not None and (not isinstance(value, int) or value < 1):
+            problems.append(f"{name} is {value!r}, it must be a whole number of at least 1")
+    solve_methods = get_solve_methods()
+    if len(solve_methods) > 1:
+        problems.append(f"{', '.join(solve_methods)} can't be used together, set only one of them")
+
+    data_dir = constants.get_filepath()
+    if not os.path.isdir(data_dir):
+        problems.append(f"The input data directory {data_dir} doesn't exist")
+    else:
+        # the district-district distances can be read from their memory-mapped copy (see distance_matrix.py)
+        problems += [f"{data_dir}/{name} is missing" for name in INPUT_FILES
+                     if not os.path.isfile(os.path.join(data_dir, name))
+                     and not (name == "Distance District-District.csv"
+                              and os.path.isfile(os.path.join(data_dir, "Distance District-District.npy")))]
+    if constants.clustertype() == "parliament":
+        import postcode_lookup
+        if not os.path.isfile(postcode_lookup.POSTCODE_LOOKUP_FILE):
+            problems.append(f"Clustering by constituency needs the postcode lookup "
+                            f"{postcode_lookup.POSTCODE_LOOKUP_FILE}")
+    package = SOLVER_PACKAGES.get(constants.solver_backend())
+    if package is not None and importlib.util.find_spec(package) is None:
+        problems.append(f"The {constants.solver_backend()} solver backend needs {package}: pip install {package}")
+    if (constants.models_to_solve() in ("SCENARIOS", "both") and constants.scenarios_solver() == "benders"
+            and importlib.util.find_spec("xpress") is None):
+        problems.append("Benders decomposition (scenarios_solver 'benders') needs xpress: pip install xpress")
+    return problems
+
+
+def warm_cache():
+    """
+    Purpose of the function is to preprocess the input data into the preprocessing cache, if it isn't there already,
+    so later runs with the same input files and settings start from it.
+    """
+    import preprocessing_cache
+    if not constants.use_preprocessing_cache():
+        print("The preprocessing cache is switched off (use_preprocessing_cache), nothing to warm")
+    elif preprocessing_cache.is_cached():
+        print(f"The preprocessed input data for {constants.clustertype()} is already cached")
+    else:
+        preprocessing_cache.read_input_data_and_preprocess()
+        print(f"Cached the preprocessed input data for {constants.clustertype()}")
+
+
+def parse_arguments(argv: list = None) -> tuple:
+    """
+    Purpose of the function is to read the command and the settings from the command line and config file.
+    Returns the command and the settings, to hand to constants.configure().
+    """
+    parser = argparse.ArgumentParser(description="Solve the MECWLP and SCENARIOS warehouse location models.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "validate", "warm-cache"])
+    parser.add_argument("--config", help="JSON file of settings (see constants.configure)")
+    parser.add_argument("--model", choices=["MECWLP", "SCENARIOS", "both"])
+    parser.add_argument("--cluster-type", dest="cluster_type", choices=["kmeans", "parliament"])
+    parser.add_argument("--cluster-size", dest="cluster_size", type=int, help="number of kmeans clusters")
+    parser.add_argument("--scenarios", dest="number_of_scenarios", type=int)
+    parser.add_argument("--scenarios-solver", dest="scenarios_solver", choices=["extensive", "benders"],
+                        help="solve the SCENARIOS model all at once or by Benders decomposition")
+    parser.add_argument("--reduce-scenarios", dest="reduced_scenarios", type=int,
+                        help="solve the SCENARIOS model with this many representative scenarios")
+    parser.add_argument("--solver", dest="solver_backend", choices=list(SOLVER_PACKAGES))
+    parser.add_argument("--formulation", dest="model_formulation", choices=["full", "aggregated"])
+    parser.add_argument("--threads", dest="solver_threads", type=int, help="threads each solve may use")
+    parser.add_argument("--workers", dest="number_of_workers", type=int,
+                        help="processes to work through scenarios with")
+    parser.add_argument("--data-directory", dest="data_directory")
+    parser.add_argument("--output-directory", dest="output_directory")
+    parser.add_argument("--no-cache", dest="use_preprocessing_cache", action="store_const", const=False,
+                        help="preprocess the input data from scratch")
+    parser.add_argument("--screen-candidates", dest="screen_candidates", action="store_const", const=True,
+                        help="drop candidates that can't be in an optimal solution first (see candidate_screening.py)")
+    parser.add_argument("--trace", dest="instrumentation", action="store_const", const=True,
+                        help="save the time and memory taken by each stage (see instrumentation.py)")
+    arguments = vars(parser.parse_args(argv))
+
+    command, config = arguments.pop("command"), arguments.pop("config")
+    settings = {}
+    if config is not None:
+        with open(config) as f:
+            settings = json.load(f)
+    settings.update({name: value for name, value in arguments.items() if value is not None})
+    return command, settings
+
+
+def main(argv: list = None) -> int:
+    command, settings = parse_arguments(argv)
+    constants.configure(**settings)
+
+    problems = validate()
+    for problem in problems:
+        print(problem)
+    if command == "validate":
+        if not problems:
+            print(f"Settings and input files ok: {constants.models_to_solve()} with {constants.clustertype()}, "
+                  f"{constants.number_of_scenarios_to_use()} scenarios, solved by {constants.solver_backend()}")
+        return 1 if problems else 0
+    if problems:
+        return 1
+
+    if command == "warm-cache":
+        warm_cache()
+    else:
+        run()
+    return 0
+
+
+# scenarios are worked through in a process pool (see scenario_pool.py),
+# whose worker processes import this file: only run the model when executed directly
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,667 @@
+import numpy as np
+from collections.abc import Mapping
+import scipy.sparse as sp
+import instrumentation
+from dataclasses import dataclass, field
+
+
+# =============================================================================
+# Column-wise (matrix) construction of the MECWLP and SCENARIOS models
+#
+# Rather than creating each variable with prob.addVariable and each constraint
+# through nested xp.Sum generators, the objective, bounds and constraint rows are
+# assembled as NumPy / SciPy sparse arrays and handed to the solver in a single
+# loadMIP call. Columns and rows are laid out in exactly the order the generator
+# formulation in MECWLP_model creates them, so both build paths give the same model.
+# The SCENARIOS model has the same columns and rows, ordered scenario by scenario.
+#
+# Columns are split into first stage (build, open) and recourse
+# (supply, warehoused, delivered) so that the recourse block can be reused.
+# =============================================================================
+
+@dataclass
+class ModelMatrices:
+    """
+    Objective, bounds and constraint matrix for a model in column order,
+    along with the column indices of each variable array (build, open, ...),
+    shaped as the variable array is indexed in the generator formulation,
+    and the row indices of the delivery constraints (see _delivery_rows).
+    """
+    name: str
+    objcoef: np.ndarray
+    A: sp.csc_matrix
+    rowtype: np.ndarray
+    rhs: np.ndarray
+    lb: np.ndarray
+    ub: np.ndarray
+    entind: np.ndarray
+    blocks: dict = field(default_factory=dict)
+    colnames: list = None
+    rows: dict = field(default_factory=dict)
+
+    @property
+    def ncols(self):
+        return self.A.shape[1]
+
+    @property
+    def nrows(self):
+        return self.A.shape[0]
+
+
+def get_model_arrays(Candidates, Times, Suppliers, Products, Customers,
+                     Operating_df, Setup_df, CostSupplierCandidate,
+                     DemandPeriodsGrouped, CostCandidateCustomers,
+                     Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict) -> dict:
+    """
+    Purpose of the function is to turn the tuple-keyed demand and capacity inputs
+    of the models into dense arrays indexed by position
+    (candidate c-1, supplier s-1, cluster k, product p-1, period t-1),
+    alongside the cost arrays from transforms.
+    """
+    Candidates = list(Candidates)
+    Suppliers = list(Suppliers)
+    Times = list(Times)
+    Products = list(Products)
+
+    candidate_positions = np.asarray(Candidates) - 1
+    product_group = Suppliers_df["Product group"].loc[Suppliers].to_numpy().astype(int)
+
+    arrays = {
+        "operating": Operating_df["Operating cost"].to_numpy(dtype=float)[candidate_positions],
+        "setup": Setup_df["Setup cost"].to_numpy(dtype=float)[candidate_positions],
+        "candidate_capacity": Candidates_df["Capacity"].loc[Candidates].to_numpy(dtype=float),
+        "supplier_capacity": Suppliers_df["Capacity"].loc[Suppliers].to_numpy(dtype=float),
+        "product_group": product_group,
+        # (supplier, period)
+        "supplier_demand": np.array([[TotalDemandProductPeriod_dict[(g, t)] for t in Times]
+                                     for g in product_group], dtype=float).reshape(len(Suppliers), len(Times)),
+        # (supplier, candidate)
+        "cost_supplier_candidate": np.asarray(CostSupplierCandidate, dtype=float),
+        # (cluster, product, period)
+        "grouped_demand": np.array([DemandPeriodsGrouped[con, p, t]
+                                    for con in Customers for p in Products for t in Times],
+                                   dtype=float).reshape(len(Customers), len(Products), len(Times)),
+        # (candidate, cluster, period)
+        "cost_candidate_customer": np.asarray(CostCandidateCustomers, dtype=float),
+    }
+    return arrays
+
+
+def get_scenario_probabilities(Scenarios) -> np.ndarray:
+    """
+    probability of each scenario: Scenarios is either a sequence of scenarios, each equally likely,
+    or maps each scenario to its probability (see scenario_reduction.py)
+    """
+    if isinstance(Scenarios, Mapping):
+        return np.array([Scenarios[sc] for sc in Scenarios], dtype=float)
+    return np.full(len(Scenarios), 1 / len(Scenarios))
+
+
+def get_model_arrays_list(model: str, model_inputs: tuple) -> list:
+    """
+    get_model_arrays for each scenario, given the arguments of MECWLP_model (model 'MECWLP',
+    giving a single entry) or of SCENARIOS_model (model 'SCENARIOS'),
+    with the probability of each scenario (1 for the MECWLP model) added as probability.
+    """
+    if model == "MECWLP":
+        (Candidates, Times, Suppliers, Products, Customers, Operating_df, Setup_df, CostSupplierCandidate,
+         DemandPeriodsGrouped, CostCandidateCustomers, Suppliers_df, Candidates_df, TotalDemand) = model_inputs
+        scenario_inputs = [(DemandPeriodsGrouped, CostCandidateCustomers, TotalDemand)]
+        probabilities = [1.0]
+    elif model == "SCENARIOS":
+        (Candidates, Times, Suppliers, Products, Customers, Scenarios, Operating_df, Setup_df, CostSupplierCandidate,
+         DemandPeriodsGrouped, CostCandidateCustomers, Suppliers_df, Candidates_df, TotalDemand) = model_inputs
+        scenario_inputs = list(zip(DemandPeriodsGrouped, CostCandidateCustomers, TotalDemand))
+        probabilities = get_scenario_probabilities(Scenarios)
+    else:
+        raise ValueError(f"Unknown model: {model}")
+
+    return [dict(get_model_arrays(Candidates, Times, Suppliers, Products, Customers, Operating_df, Setup_df,
+                                  CostSupplierCandidate, grouped, costs, Suppliers_df, Candidates_df, total),
+                 probability=probability)
+            for (grouped, costs, total), probability in zip(scenario_inputs, probabilities)]
+
+
+def first_stage_rows(nC: int, nT: int):
+    """
+    Rows only involving build/open:
+    if a warehouse is open it must have been built, and a warehouse remains open.
+    """
+    c = np.arange(nC)
+    build_col = c
+    open_col = nC + c[:, None] * nT + np.arange(nT)[None, :]
+
+    # sum_t open[c, t] - |T| * build[c] <= 0
+    rows_built = np.concatenate([np.repeat(c, nT), c])
+    cols_built = np.concatenate([open_col.ravel(), build_col])
+    vals_built = np.concatenate([np.ones(nC * nT), np.full(nC, -float(nT))])
+
+    # open[c, t] - open[c, t-1] >= 0 for t > 1
+    n_remain = nC * (nT - 1)
+    remain = nC + np.arange(n_remain)
+    rows_remain = np.concatenate([remain, remain])
+    cols_remain = np.concatenate([open_col[:, 1:].ravel(), open_col[:, :-1].ravel()])
+    vals_remain = np.concatenate([np.ones(n_remain), -np.ones(n_remain)])
+
+    rows = np.concatenate([rows_built, rows_remain])
+    cols = np.concatenate([cols_built, cols_remain])
+    vals = np.concatenate([vals_built, vals_remain])
+    rowtype = np.array(["L"] * nC + ["G"] * n_remain)
+    rhs = np.zeros(nC + n_remain)
+
+    return rows, cols, vals, rowtype, rhs
+
+
+def recourse_pattern(nC: int, nS: int, nP: int, nT: int, nK: int, product_group: np.ndarray,
+                     aggregated: bool = False, arcs: np.ndarray = None, linking: np.ndarray = None) -> dict:
+    """
+    Purpose of the function is to lay out the sparsity pattern of one scenario's
+    supply/warehoused/delivered constraint block, in the row order of the generator
+    formulation. Columns index [build, open, supply, warehoused, delivered].
+
+    Coefficients that depend on demand are not stored directly: each nonzero keeps
+    a constant factor plus an index into the flattened total demand (supplier, period),
+    the grouped demand (cluster, product, period) followed by its total over products
+    (cluster, period), and candidate capacity arrays, the last index of each
+    meaning 'no factor'. recourse_values then fills in the coefficients for a given
+    scenario without recomputing the pattern.
+
+    aggregated lays out the aggregated formulation (see build_MECWLP_matrices) instead,
+    with assigned (candidate, cluster, period) columns in place of delivered.
+    arcs, a boolean (candidate, cluster) array, only lays out delivered (or assigned) columns
+    and their open linking rows for the candidate-cluster pairs that are True (default all).
+    linking, a boolean array over the delivered (or assigned) columns in the order they are laid out,
+    replaces their open linking rows by one row per (candidate, period), summed over clusters and products,
+    plus the rows of the columns that are True (see lazy_linking). Default every row.
+    """
+    n1 = nC + nC * nT
+    arcs = np.ones((nC, nK), dtype=bool) if arcs is None else np.asarray(arcs, dtype=bool)
+    g = np.asarray(product_group, dtype=int) - 1
+    td_none = nS * nT
+    dg_none = nK * nP * nT + nK * nT
+    cap_none = nC
+
+    cc, ss, tt = np.meshgrid(np.arange(nC), np.arange(nS), np.arange(nT), indexing="ij")
+    cc, ss, tt = cc.ravel(), ss.ravel(), tt.ravel()
+    supply_col = n1 + (cc * nS + ss) * nT + tt
+    supply_open_col = nC + cc * nT + tt
+    supply_td = ss * nT + tt
+
+    cw, pw, tw = np.meshgrid(np.arange(nC), np.arange(nP), np.arange(nT), indexing="ij")
+    cw, pw, tw = cw.ravel(), pw.ravel(), tw.ravel()
+    warehoused_col = n1 + nC * nS * nT + (cw * nP + pw) * nT + tw
+
+    # delivered columns are only laid out for the candidate-cluster arcs kept, in the same order
+    cd, kd, pd_, td = np.meshgrid(np.arange(nC), np.arange(nK), np.arange(nP), np.arange(nT), indexing="ij")
+    kept = arcs[cd, kd]
+    cd, kd, pd_, td = cd[kept], kd[kept], pd_[kept], td[kept]
+    delivered_dg = (kd * nP + pd_) * nT + td
+    first_delivered_col = n1 + nC * nS * nT + nC * nP * nT
+    if aggregated:
+        # one assigned column per (candidate, cluster, period), shared by every product
+        ca, ka, ta = np.meshgrid(np.arange(nC), np.arange(nK), np.arange(nT), indexing="ij")
+        kept = arcs[ca, ka]
+        ca, ka, ta = ca[kept], ka[kept], ta[kept]
+        assigned_col = first_delivered_col + np.arange(ca.size)
+        assigned_position = np.full(nC * nK * nT, -1)
+        assigned_position[(ca * nK + ka) * nT + ta] = np.arange(ca.size)
+        delivered_col = first_delivered_col + assigned_position[(cd * nK + kd) * nT + td]
+        assigned_dg = nK * nP * nT + ka * nT + ta
+    else:
+        delivered_col = first_delivered_col + np.arange(cd.size)
+
+    n_supply = supply_col.size
+    n_warehoused = warehoused_col.size
+    n_delivered = assigned_col.size if aggregated else delivered_col.size
+
+    rows, cols, const, td_idx, dg_idx, cap_idx, rowtype = [], [], [], [], [], [], []
+    offset = 0
+    # first row of each group of delivery constraints, see _delivery_rows
+    row_offsets = {}
+
+    def add(r, c, v, tdi=None, dgi=None, capi=None):
+        rows.append(r + offset)
+        cols.append(c)
+        const.append(np.broadcast_to(np.asarray(v, dtype=float), r.shape))
+        td_idx.append(np.full(r.shape, td_none) if tdi is None else tdi)
+        dg_idx.append(np.full(r.shape, dg_none) if dgi is None else dgi)
+        cap_idx.append(np.full(r.shape, cap_none) if capi is None else capi)
+
+    # Can't supply to a warehouse that is not open
+    r = np.arange(n_supply)
+    add(r, supply_col, 1.0)
+    add(r, supply_open_col, -1.0)
+    rowtype.append(np.full(n_supply, "L"))
+    offset += n_supply
+
+    # supply of each product group sums to one in each period
+    add(g[ss] * nT + tt, supply_col, 1.0)
+    rowtype.append(np.full(nP * nT, "E"))
+    offset += nP * nT
+
+    # can't supply more than total supplier capacity
+    add(ss * nT + tt, supply_col, 1.0, tdi=supply_td)
+    rowtype.append(np.full(nS * nT, "L"))
+    offset += nS * nT
+
+    # no point in supplying more than total product demand
+    add(ss * nT + tt, supply_col, 1.0, tdi=supply_td)
+    rowtype.append(np.full(nS * nT, "L"))
+    offset += nS * nT
+
+    # update warehouse stock
+    add(np.arange(n_warehoused), warehoused_col, 1.0)
+    add((cc * nP + g[ss]) * nT + tt, supply_col, -1.0, tdi=supply_td)
+    rowtype.append(np.full(n_warehoused, "E"))
+    offset += n_warehoused
+
+    # warehouse cannot hold more stock than its capacity
+    add(cw * nT + tw, warehoused_col, 1.0)
+    rowtype.append(np.full(nC * nT, "L"))
+    offset += nC * nT
+
+    # Cannot deliver from a warehouse that is not open, once per delivered column
+    # (per (candidate, cluster, period) assigned column in the aggregated formulation)
+    link_col, link_c, link_t = (assigned_col, ca, ta) if aggregated else (delivered_col, cd, td)
+    if linking is None:
+        r = np.arange(n_delivered)
+        add(r, link_col, 1.0)
+        add(r, nC + link_c * nT + link_t, -1.0)
+        n_linking = n_delivered
+    else:
+        # the columns of each (candidate, period) summed up, which is exact for binary open,
+        # then the rows in linking, which only tighten the LP relaxation
+        c_open = np.arange(nC * nT)
+        add(link_c * nT + link_t, link_col, 1.0)
+        add(c_open, nC + c_open, -np.bincount(link_c * nT + link_t, minlength=nC * nT).astype(float))
+        kept_links = np.flatnonzero(linking)
+        r = nC * nT + np.arange(kept_links.size)
+        add(r, link_col[kept_links], 1.0)
+        add(r, nC + link_c[kept_links] * nT + link_t[kept_links], -1.0)
+        n_linking = nC * nT + kept_links.size
+    rowtype.append(np.full(n_linking, "L"))
+    offset += n_linking
+
+    if aggregated:
+        # Ensure we meet customer demand
+        row_offsets["demand"] = offset
+        add(ka * nT + ta, assigned_col, 1.0)
+        rowtype.append(np.full(nK * nT, "E"))
+        offset += nK * nT
+
+        # can't deliver more than the warehouses hold, each product's demand folded into the coefficient
+        row_offsets["deliver_hold"] = offset
+        add((cd * nP + pd_) * nT + td, delivered_col, 1.0, dgi=delivered_dg)
+        add(np.arange(n_warehoused), warehoused_col, -1.0)
+        rowtype.append(np.full(n_warehoused, "L"))
+        offset += n_warehoused
+
+        # tightened open linking: a warehouse can only deliver up to its capacity, and only when open
+        row_offsets["deliver_capacity"] = offset
+        add(ca * nT + ta, assigned_col, 1.0, dgi=assigned_dg)
+        c_open = np.arange(nC * nT)
+        add(c_open, nC + c_open, -1.0, capi=c_open // nT)
+        rowtype.append(np.full(nC * nT, "L"))
+        offset += nC * nT
+    else:
+        # Ensure we meet customer demand
+        row_offsets["demand"] = offset
+        add(delivered_dg, delivered_col, 1.0)
+        rowtype.append(np.full(nK * nP * nT, "E"))
+        offset += nK * nP * nT
+
+        # can't deliver more than the warehouses hold
+        row_offsets["deliver_hold"] = offset
+        add((cd * nP + pd_) * nT + td, delivered_col, 1.0, dgi=delivered_dg)
+        add(np.arange(n_warehoused), warehoused_col, -1.0)
+        rowtype.append(np.full(n_warehoused, "L"))
+        offset += n_warehoused
+
+    return {
+        "dims": (nC, nS, nP, nT, nK),
+        "aggregated": aggregated,
+        "arcs": arcs,
+        "product_group": g + 1,
+        "nrows": offset,
+        "row_offsets": row_offsets,
+        "n_first_stage": n1,
+        "n_recourse": n_supply + n_warehoused + n_delivered,
+        "n_delivered": n_delivered,
+        "n_linking": n_linking,
+        "rows": np.concatenate(rows),
+        "cols": np.concatenate(cols),
+        "const": np.concatenate(const),
+        "td_idx": np.concatenate(td_idx),
+        "dg_idx": np.concatenate(dg_idx),
+        "cap_idx": np.concatenate(cap_idx),
+        "rowtype": np.concatenate(rowtype),
+        "supply_td": supply_td,
+        "delivered_dg": assigned_dg if aggregated else delivered_dg,
+        "supply_cost_idx": (ss, cc),
+        "delivered_cost_idx": (ca, ka, ta) if aggregated else (cd, kd, td),
+    }
+
+
+def recourse_values(pattern: dict, supplier_demand: np.ndarray, grouped_demand: np.ndarray,
+                    cost_supplier_candidate: np.ndarray, cost_candidate_customer: np.ndarray,
+                    supplier_capacity: np.ndarray, candidate_capacity: np.ndarray):
+    """
+    Purpose of the function is to fill in the coefficients, right hand sides and
+    objective of a recourse block for one scenario's demand and costs.
+    Returns the block matrix over [build, open, recourse] columns, rhs and recourse objective.
+    """
+    nC, nS, nP, nT, nK = pattern["dims"]
+    td_ext = np.append(np.asarray(supplier_demand, dtype=float).ravel(), 1.0)
+    grouped_demand = np.asarray(grouped_demand, dtype=float)
+    dg_ext = np.concatenate([grouped_demand.ravel(), grouped_demand.sum(axis=1).ravel(), [1.0]])
+    cap_ext = np.append(np.asarray(candidate_capacity, dtype=float), 1.0)
+
+    vals = (pattern["const"] * td_ext[pattern["td_idx"]] * dg_ext[pattern["dg_idx"]]
+            * cap_ext[pattern["cap_idx"]])
+    block = sp.csr_matrix((vals, (pattern["rows"], pattern["cols"])),
+                          shape=(pattern["nrows"], pattern["n_first_stage"] + pattern["n_recourse"]))
+    block.eliminate_zeros()
+
+    rhs = np.concatenate([
+        np.zeros(nC * nS * nT),
+        np.ones(nP * nT),
+        np.repeat(np.asarray(supplier_capacity, dtype=float), nT),
+        td_ext[:-1],
+        np.zeros(nC * nP * nT),
+        np.repeat(np.asarray(candidate_capacity, dtype=float), nT),
+    ] + ([
+        np.zeros(pattern["n_linking"]),
+        np.ones(nK * nT),
+        np.zeros(nC * nP * nT),
+        np.zeros(nC * nT),
+    ] if pattern["aggregated"] else [
+        np.zeros(pattern["n_linking"]),
+        np.ones(nK * nP * nT),
+        np.zeros(nC * nP * nT),
+    ]))
+
+    ss, cc = pattern["supply_cost_idx"]
+    cd, kd, td = pattern["delivered_cost_idx"]
+    objcoef = np.concatenate([
+        td_ext[pattern["supply_td"]] * np.asarray(cost_supplier_candidate)[ss, cc],
+        np.zeros(nC * nP * nT),
+        dg_ext[pattern["delivered_dg"]] * np.asarray(cost_candidate_customer)[cd, kd, td],
+    ])
+
+    return block, rhs, objcoef
+
+
+def recourse_upper_bounds(pattern: dict) -> np.ndarray:
+    """
+    supply and delivered (or assigned) are proportions (at most 1), warehoused is unbounded above.
+    """
+    nC, nS, nP, nT, nK = pattern["dims"]
+    return np.concatenate([np.ones(nC * nS * nT),
+                           np.full(nC * nP * nT, np.inf),
+                           np.ones(pattern["n_delivered"])])
+
+
+def _column_names(Candidates, Times, Suppliers, Products, Customers, aggregated: bool = False,
+                  arcs: np.ndarray = None) -> list:
+    if arcs is None:
+        arcs = np.ones((len(Candidates), len(Customers)), dtype=bool)
+    names = ['build_{0}'.format(c) for c in Candidates]
+    names += ['open_{0}_{1}'.format(c, t) for c in Candidates for t in Times]
+    names += ['supply_{0}_{1}_{2}'.format(c, s, t) for c in Candidates for s in Suppliers for t in Times]
+    names += ['warehoused_{0}_{1}_{2}'.format(c, p, t) for c in Candidates for p in Products for t in Times]
+    if aggregated:
+        names += ['assigned_{0}_{1}_{2}'.format(c, con, t)
+                  for i, c in enumerate(Candidates) for k, con in enumerate(Customers) if arcs[i, k] for t in Times]
+    else:
+        names += ['delivered_{0}_{1}_{2}_{3}'.format(c, con, p, t)
+                  for i, c in enumerate(Candidates) for k, con in enumerate(Customers) if arcs[i, k]
+                  for p in Products for t in Times]
+    return names
+
+
+def _delivery_rows(pattern: dict, n_first_rows: int, nSc: int = None) -> dict:
+    """
+    Row indices of the delivery constraints, for pricing delivered columns that were left out
+    (see arc_sparsification): 'demand' (cluster, product, period), or (cluster, period) in the
+    aggregated formulation, 'deliver_hold' (candidate, product, period) and, in the aggregated
+    formulation, 'deliver_capacity' (candidate, period). With scenarios each takes a trailing scenario index.
+    """
+    nC, nS, nP, nT, nK = pattern["dims"]
+    shapes = {"demand": (nK, nT) if pattern["aggregated"] else (nK, nP, nT), "deliver_hold": (nC, nP, nT)}
+    if pattern["aggregated"]:
+        shapes["deliver_capacity"] = (nC, nT)
+
+    rows = {}
+    for name, shape in shapes.items():
+        block_rows = n_first_rows + pattern["row_offsets"][name] + np.arange(int(np.prod(shape))).reshape(shape)
+        if nSc is None:
+            rows[name] = block_rows
+        else:
+            rows[name] = block_rows[..., None] + pattern["nrows"] * np.arange(nSc)
+    return rows
+
+
+@instrumentation.timed()
+def build_MECWLP_matrices(Candidates, Times, Suppliers, Products, Customers,
+                          Operating_df, Setup_df, CostSupplierCandidate,
+                          DemandPeriodsGrouped, CostCandidateCustomers,
+                          Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict,
+                          names: bool = True, aggregated: bool = False, arcs: np.ndarray = None,
+                          linking: np.ndarray = None) -> ModelMatrices:
+    """
+    Purpose of the function is to assemble the MECWLP model of MECWLP_model as arrays:
+    objective coefficients, variable bounds and a sparse constraint matrix,
+    with columns and rows in the same order as the generator formulation.
+
+    aggregated assembles the aggregated formulation instead: one assigned[c, k, t] column
+    per candidate, cluster and period in place of delivered[c, k, p, t], so every product
+    of a cluster is delivered from the same warehouse(s) in the same proportions.
+    Product volumes are folded into the coefficients, which cuts the delivered columns
+    and their open linking and demand rows by a factor of |Products|. The open linking is
+    tightened by also limiting what each warehouse delivers to its capacity times open.
+
+    arcs, a boolean (candidate, cluster) array by position, only creates delivery variables
+    from a candidate to a cluster where it is True (default every pair, see arc_sparsification).
+    Left out delivery variables have column index -1 in blocks.
+    linking, a boolean array over the delivery columns, only creates the open linking rows of the
+    columns where it is True, plus one summed row per candidate and period (default every row, see lazy_linking).
+    """
+    arrays = get_model_arrays(Candidates, Times, Suppliers, Products, Customers,
+                              Operating_df, Setup_df, CostSupplierCandidate,
+                              DemandPeriodsGrouped, CostCandidateCustomers,
+                              Suppliers_df, Candidates_df, TotalDemandProductPeriod_dict)
+    nC, nS, nP, nT, nK = len(Candidates), len(Suppliers), len(Products), len(Times), len(Customers)
+
+    pattern = recourse_pattern(nC, nS, nP, nT, nK, arrays["product_group"], aggregated, arcs, linking)
+    block, block_rhs, recourse_obj = recourse_values(pattern, arrays["supplier_demand"], arrays["grouped_demand"],
+                                                     arrays["cost_supplier_candidate"],
+                                                     arrays["cost_candidate_customer"],
+                                                     arrays["supplier_capacity"], arrays["candidate_capacity"])
+
+    n1 = pattern["n_first_stage"]
+    ncols = n1 + pattern["n_recourse"]
+    rows, cols, vals, first_rowtype, first_rhs = first_stage_rows(nC, nT)
+    first = sp.csr_matrix((vals, (rows, cols)), shape=(first_rowtype.size, ncols))
+
+    A = sp.vstack([first, block], format="csc")
+    objcoef = np.concatenate([arrays["setup"], np.repeat(arrays["operating"], nT), recourse_obj])
+
+    ub = np.concatenate([np.ones(n1), recourse_upper_bounds(pattern)])
+
+    return ModelMatrices(
+        name="MECWLP",
+        objcoef=objcoef,
+        A=A,
+        rowtype=np.concatenate([first_rowtype, pattern["rowtype"]]),
+        rhs=np.concatenate([first_rhs, block_rhs]),
+        lb=np.zeros(ncols),
+        ub=ub,
+        entind=np.arange(n1),
+        blocks=_variable_blocks(nC, nS, nP, nT, nK, aggregated=aggregated, arcs=pattern["arcs"]),
+        colnames=(_column_names(Candidates, Times, Suppliers, Products, Customers, aggregated, pattern["arcs"])
+                  if names else None),
+        rows=_delivery_rows(pattern, first_rowtype.size),
+    )
+
+
+def _scenario_column_names(Candidates, Times, Suppliers, Products, Customers, Scenarios, blocks: dict) -> list:
+    names = np.empty(max(columns.max() for columns in blocks.values()) + 1, dtype=object)
+
+    def set_names(columns, labels):
+        # columns of -1 were left out of the model (see arc_sparsification)
+        columns = columns.ravel()
+        names[columns[columns >= 0]] = np.array(labels, dtype=object)[columns >= 0]
+
+    set_names(blocks["build"], ['build_{0}'.format(c) for c in Candidates])
+    set_names(blocks["open"], ['open_{0}_{1}'.format(c, t) for c in Candidates for t in Times])
+    set_names(blocks["supply"], ['supply_{0}_{1}_{2}_{3}'.format(c, s, t, sc)
+                                 for c in Candidates for s in Suppliers for t in Times for sc in Scenarios])
+    set_names(blocks["warehoused"], ['warehoused_{0}_{1}_{2}_{3}'.format(c, p, t, sc)
+                                     for c in Candidates for p in Products for t in Times for sc in Scenarios])
+    if "assigned" in blocks:
+        set_names(blocks["assigned"], ['assigned_{0}_{1}_{2}_{3}'.format(c, con, t, sc)
+                                       for c in Candidates for con in Customers
+                                       for t in Times for sc in Scenarios])
+    else:
+        set_names(blocks["delivered"], ['delivered_{0}_{1}_{2}_{3}_{4}'.format(c, con, p, t, sc)
+                                        for c in Candidates for con in Customers
+                                        for p in Products for t in Times for sc in Scenarios])
+    return names.tolist()
+
+
+@instrumentation.timed()
+def build_SCENARIOS_matrices(Candidates, Times, Suppliers, Products, Customers, Scenarios,
+                             Operating_df, Setup_df, CostSupplierCandidate,
+                             DemandPeriodsGrouped, CostCandidateCustomers,
+                             Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict,
+                             names: bool = True, aggregated: bool = False, arcs: np.ndarray = None,
+                             linking: np.ndarray = None) -> ModelMatrices:
+    """
+    Purpose of the function is to assemble the extensive form of SCENARIOS_model as arrays.
+
+    The sparsity pattern of one scenario's supply/warehoused/delivered block is laid out once;
+    for each scenario only the demand and cost dependent coefficients are filled in.
+    The scenario blocks are then stacked block-diagonally, next to the shared build/open
+    columns they link to:
+
+        [ F   0             ]    F:   build/open rows
+        [ L_1 W_1           ]    L_s: scenario s coefficients on open
+        [ L_2     W_2       ]    W_s: scenario s coefficients on supply/warehoused/delivered
+        [ ...          ...  ]
+
+    DemandPeriodsGrouped, CostCandidateCustomers and TotalDemandProductPeriodScenarios_dict are
+    lists with one entry per scenario, as in SCENARIOS_model. Each scenario is weighted by its probability
+    (see get_scenario_probabilities), 1/len(Scenarios) unless Scenarios gives them.
+    aggregated assembles the aggregated formulation and arcs leaves out delivery variables,
+    as in build_MECWLP_matrices, the same arcs being kept in every scenario,
+    and linking leaves out open linking rows as in build_MECWLP_matrices, the same rows in every scenario.
+    """
+    nC, nS, nP, nT, nK, nSc = (len(Candidates), len(Suppliers), len(Products), len(Times),
+                               len(Customers), len(Scenarios))
+
+    probabilities = get_scenario_probabilities(Scenarios)
+
+    pattern = None
+    links, recourse_blocks, recourse_rhs, recourse_obj = [], [], [], []
+    for sc in range(nSc):
+        arrays = get_model_arrays(Candidates, Times, Suppliers, Products, Customers,
+                                  Operating_df, Setup_df, CostSupplierCandidate,
+                                  DemandPeriodsGrouped[sc], CostCandidateCustomers[sc],
+                                  Suppliers_df, Candidates_df, TotalDemandProductPeriodScenarios_dict[sc])
+        if pattern is None:
+            pattern = recourse_pattern(nC, nS, nP, nT, nK, arrays["product_group"], aggregated, arcs, linking)
+            n1 = pattern["n_first_stage"]
+
+        block, rhs, objcoef = recourse_values(pattern, arrays["supplier_demand"], arrays["grouped_demand"],
+                                              arrays["cost_supplier_candidate"],
+                                              arrays["cost_candidate_customer"],
+                                              arrays["supplier_capacity"], arrays["candidate_capacity"])
+        links.append(block[:, :n1])
+        recourse_blocks.append(block[:, n1:])
+        recourse_rhs.append(rhs)
+        recourse_obj.append(objcoef * probabilities[sc])
+
+    n2 = pattern["n_recourse"]
+    rows, cols, vals, first_rowtype, first_rhs = first_stage_rows(nC, nT)
+    first = sp.csr_matrix((vals, (rows, cols)), shape=(first_rowtype.size, n1 + nSc * n2))
+    scenario_rows = sp.hstack([sp.vstack(links), sp.block_diag(recourse_blocks)])
+    A = sp.vstack([first, scenario_rows], format="csc")
+
+    ncols = n1 + nSc * n2
+    recourse_ub = recourse_upper_bounds(pattern)
+    blocks = _variable_blocks(nC, nS, nP, nT, nK, nSc, aggregated, pattern["arcs"])
+
+    return ModelMatrices(
+        name="SCENARIOS",
+        objcoef=np.concatenate([arrays["setup"], np.repeat(arrays["operating"], nT)] + recourse_obj),
+        A=A,
+        rowtype=np.concatenate([first_rowtype] + [pattern["rowtype"]] * nSc),
+        rhs=np.concatenate([first_rhs] + recourse_rhs),
+        lb=np.zeros(ncols),
+        ub=np.concatenate([np.ones(n1)] + [recourse_ub] * nSc),
+        entind=np.arange(n1),
+        blocks=blocks,
+        colnames=(_scenario_column_names(Candidates, Times, Suppliers, Products, Customers, Scenarios, blocks)
+                  if names else None),
+        rows=_delivery_rows(pattern, first_rowtype.size, nSc),
+    )
+
+
+def _variable_blocks(nC: int, nS: int, nP: int, nT: int, nK: int, nSc: int = None, aggregated: bool = False,
+                     arcs: np.ndarray = None) -> dict:
+    """
+    Column indices of each variable array. Without scenarios the columns are
+    [build, open, supply, warehoused, delivered]; with scenarios they are
+    [build, open] followed by one [supply, warehoused, delivered] block per scenario,
+    and the recourse arrays take a trailing scenario index.
+    In the aggregated formulation assigned (candidate, cluster, period) takes the place of
+    delivered, and delivered[c, k, p, t] is the assigned[c, k, t] column for every product.
+    Delivery variables for candidate-cluster pairs not in arcs have column index -1.
+    """
+    if arcs is None:
+        arcs = np.ones((nC, nK), dtype=bool)
+    n1 = nC + nC * nT
+    blocks = {"build": np.arange(nC), "open": np.arange(nC, n1).reshape(nC, nT)}
+
+    recourse_shapes = [("supply", (nC, nS, nT)), ("warehoused", (nC, nP, nT)),
+                       ("assigned", (nC, nK, nT)) if aggregated else ("delivered", (nC, nK, nP, nT))]
+    kept = {name: (np.broadcast_to(arcs.reshape((nC, nK) + (1,) * (len(shape) - 2)), shape)
+                   if name in ["assigned", "delivered"] else np.ones(shape, dtype=bool))
+            for name, shape in recourse_shapes}
+    n2 = sum(int(kept[name].sum()) for name, _ in recourse_shapes)
+    offset = n1
+    for name, shape in recourse_shapes:
+        size = int(kept[name].sum())
+        columns = np.full(shape, -1)
+        columns[kept[name]] = np.arange(offset, offset + size)
+        if nSc is None:
+            blocks[name] = columns
+        else:
+            scenario_offsets = n2 * np.arange(nSc)
+            blocks[name] = np.where(columns[..., None] >= 0, columns[..., None] + scenario_offsets, -1)
+        offset += size
+
+    if aggregated:
+        assigned = blocks["assigned"]
+        blocks["delivered"] = np.broadcast_to(assigned[:, :, None], (nC, nK, nP) + assigned.shape[2:])
+    return blocks
+
+
+@instrumentation.timed()
+def load_into_xpress(prob, matrices: ModelMatrices) -> dict:
+    """
+    Load the model into an xpress problem in one call and
+    return the variable arrays, shaped as in the generator formulation.
+    """
+    import xpress as xp
+    A = matrices.A.tocsc()
+    prob.loadMIP(matrices.name, matrices.rowtype.tolist(), matrices.rhs, None, matrices.objcoef,
+                 A.indptr, None, A.indices, A.data, matrices.lb, matrices.ub,
+                 coltype=["B"] * matrices.entind.size, entind=matrices.entind)
+    if matrices.colnames is not None:
+        prob.addNames(xp.Namespaces.COLUMN, matrices.colnames, 0, matrices.ncols - 1)
+
+    variables = np.array(prob.getVariable(), dtype=xp.npvar)
+    # delivery variables left out of the model (column -1, see arc_sparsification) are None
+    return {name: np.where(columns >= 0, variables[np.maximum(columns, 0)], None) if (columns < 0).any()
+            else variables[columns] for name, columns in matrices.blocks.items()}
@@ -0,0 +1,117 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Compiled postcode -> westminster constituency lookup
+#
+# The ONS postcode directory (pcd_pcon_uk_lu_may_24_cut.csv, or the full directory of ~2.7M postcodes)
+# is compiled once into .npy files next to the csv:
+#   _postcodes.npy  every postcode, spaces removed, as sorted fixed width bytes
+#   _codes.npy      the position in _names.npy of each postcode's constituency
+#   _names.npy      the constituency names
+# The first two are memory-mapped, and a column of postcodes is looked up with a single vectorized
+# binary search (np.searchsorted), rather than building a dictionary of every postcode on each run.
+# The compilation is redone whenever the csv is newer than the compiled files.
+#
+# python postcode_lookup.py [path to the postcode directory csv]
+# =============================================================================
+
+POSTCODE_LOOKUP_FILE = "pcd_pcon_uk_lu_may_24_cut.csv"
+COMPILATION_CHUNK_ROWS = 500000
+
+
+def _compiled_path(csv_path: str, which: str) -> str:
+    return f"{os.path.splitext(csv_path)[0]}_{which}.npy"
+
+
+def normalise_postcodes(postcodes) -> np.ndarray:
+    """
+    Postcodes with every space removed, as an array of str.
+    """
+    return pd.Series(postcodes, dtype=object).astype(str).str.replace(" ", "", regex=False).to_numpy(dtype=str)
+
+
+class PostcodeLookup:
+    """
+    Memory-mapped sorted postcodes, with the constituency of each.
+    Pickles as the path of the csv it was compiled from, so it can be sent to worker processes cheaply.
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self.postcodes = np.load(_compiled_path(csv_path, "postcodes"), mmap_mode="r")
+        self.codes = np.load(_compiled_path(csv_path, "codes"), mmap_mode="r")
+        self.names = np.load(_compiled_path(csv_path, "names"), allow_pickle=True)
+
+    def __len__(self):
+        return self.postcodes.shape[0]
+
+    def lookup(self, postcodes) -> np.ndarray:
+        """
+        Constituency of each of postcodes (spaces are ignored), NaN for postcodes not in the lookup.
+        """
+        query = normalise_postcodes(postcodes)
+        width = self.postcodes.dtype.itemsize
+        # anything longer than the longest postcode compiled can't be in the lookup
+        fits = np.char.str_len(query) <= width if query.size else np.zeros(0, dtype=bool)
+        query = np.char.encode(np.where(fits, query, ""), "ascii", "replace").astype(f"S{width}")
+
+        positions = np.searchsorted(self.postcodes, query)
+        positions = np.minimum(positions, len(self) - 1)
+        found = fits & (len(self) > 0) & (self.postcodes[positions] == query)
+
+        constituencies = np.full(query.shape, np.nan, dtype=object)
+        constituencies[found] = self.names[self.codes[positions[found]]]
+        return constituencies
+
+    def __getstate__(self):
+        return {"csv_path": self.csv_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["csv_path"])
+
+
+def compile_postcode_lookup(csv_path: str):
+    """
+    Compile the postcode directory csv (with columns pcd, the postcode, and pconnm, the constituency name)
+    into the sorted postcode, constituency code and constituency name .npy files, a chunk of rows at a time.
+    A postcode listed more than once takes its last constituency.
+    """
+    postcodes = []
+    constituencies = []
+    for chunk in pd.read_csv(csv_path, usecols=["pcd", "pconnm"], dtype=str, chunksize=COMPILATION_CHUNK_ROWS):
+        postcodes.append(np.char.encode(normalise_postcodes(chunk["pcd"]), "ascii", "replace"))
+        constituencies.append(pd.Categorical(chunk["pconnm"]))
+    postcodes = np.concatenate(postcodes) if postcodes else np.zeros(0, dtype="S1")
+    constituencies = pd.api.types.union_categoricals(constituencies) if constituencies \
+        else pd.Categorical([], categories=pd.Index([], dtype=object))
+
+    # np.unique keeps the first of each postcode, so go through them last first
+    postcodes, last = np.unique(postcodes[::-1], return_index=True)
+    codes = constituencies.codes[::-1][last].astype(np.int32)
+    names = np.append(np.asarray(constituencies.categories, dtype=object), np.nan)
+    # postcodes without a constituency
+    codes[codes < 0] = len(names) - 1
+
+    for which, array in [("postcodes", postcodes), ("codes", codes), ("names", names)]:
+        tmp_path = f"{_compiled_path(csv_path, which)}.tmp.npy"
+        np.save(tmp_path, array, allow_pickle=which == "names")
+        os.replace(tmp_path, _compiled_path(csv_path, which))
+
+
+def load_postcode_lookup(csv_path: str = POSTCODE_LOOKUP_FILE) -> PostcodeLookup:
+    """
+    Memory-map the compiled postcode lookup, compiling the csv first if needed.
+    """
+    compiled = [_compiled_path(csv_path, which) for which in ["postcodes", "codes", "names"]]
+    if any(not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csv_path) for path in compiled):
+        print("Compiling the postcode to constituency lookup")
+        compile_postcode_lookup(csv_path)
+
+    return PostcodeLookup(csv_path)
+
+
+if __name__ == "__main__":
+    load_postcode_lookup(sys.argv[1] if len(sys.argv) > 1 else POSTCODE_LOOKUP_FILE)
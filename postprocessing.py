@@ -1,29 +1,38 @@
-import xpress as xp
+import solvers
 
-def postprocessing(prob):
+def postprocessing(prob, best_obj=None, best_bound=None, iterations=None):
     # =============================================================================
 # Post-processing and data visualisation
 # =============================================================================
+    # For a decomposition method prob is the master problem: the best plan found,
+    # the master bound and the number of iterations are passed in instead.
+    if iterations is not None:
+        print(f"Decomposition finished after {iterations} iterations")
+        if best_obj is None or best_obj == float("inf"):
+            print("No solution available")
+            return
+        print(f"Best bound: {best_bound}")
+        gap = abs(best_obj - best_bound) / (1e-10 +abs(best_obj))
+        print(f"Gap: {gap*100:.2f}%")
+        return
 
-    sol_status = prob.attributes.solstatus
+    # Otherwise prob is either a solved xpress problem, or the SolverResult from another backend (see solvers.py)
+    if isinstance(prob, solvers.SolverResult):
+        result = prob
+    else:
+        result = solvers.get_xpress_result(prob, with_solution=False)
 
-    if sol_status == xp.SolStatus.OPTIMAL:
-        print("Optimal solution found")
-        best_obj = prob.attributes.objval
-        best_bound = prob.attributes.bestbound
-        mip_gap = abs(best_obj - best_bound) / (1e-10 +abs(best_obj))
-        print(f"MIP Gap: {mip_gap*100:.2f}%")
+    if result.status == "optimal":
+        print(f"Optimal solution found ({result.backend})")
+        print(f"MIP Gap: {result.gap*100:.2f}%")
     
-    elif sol_status == xp.SolStatus.FEASIBLE:
-        print("Feasible solution (not proven optimal)")
-        best_obj = prob.attributes.objval
-        best_bound = prob.attributes.bestbound
-        print(f"Best bound: {best_bound}")
-        mip_gap = abs(best_obj - best_bound) / (1e-10 +abs(best_obj))
-        print(f"MIP Gap: {mip_gap*100:.2f}%")
-    elif sol_status == xp.SolStatus.INFEASIBLE:
+    elif result.status == "feasible":
+        print(f"Feasible solution (not proven optimal, {result.backend})")
+        print(f"Best bound: {result.bound}")
+        print(f"MIP Gap: {result.gap*100:.2f}%")
+    elif result.status == "infeasible":
         print("Model is infeasible")
-    elif sol_status == xp.SolStatus.UNBOUNDED:
+    elif result.status == "unbounded":
         print("Model is unbounded")
     else:
         print("No solution available")
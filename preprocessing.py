@@ -1,10 +1,43 @@
 import pandas as pd
 from typing import Tuple
+from collections.abc import Mapping
+import scipy.sparse as sp
 import constants
-from sklearn.cluster import KMeans
 import numpy as np
+import transforms
+import distance_matrix
+import postcode_lookup
+import instrumentation
+
+@instrumentation.timed()
+def get_cluster_labels(coordinates: np.ndarray, n_clusters: int, algorithm: str = None,
+                       weights: np.ndarray = None) -> np.ndarray:
+    """
+    Purpose of the function is to cluster points (the rows of coordinates) into n_clusters with
+    algorithm (default constants.clustering_algorithm()):
+    'kmeans' for KMeans, or 'minibatch' for MiniBatchKMeans, which fits on random batches of points
+    and is much faster for tens of thousands of points and thousands of clusters.
+    When weights are given each point counts in proportion to its weight, so clusters are
+    smaller where there is more demand.
+    """
+    if algorithm is None:
+        algorithm = constants.clustering_algorithm()
+    # sklearn is only needed when clustering, not when the clustered data is read back from the cache
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if algorithm == "kmeans":
+        clustering = KMeans(n_clusters=n_clusters, random_state=1815, n_init="auto")
+    elif algorithm == "minibatch":
+        clustering = MiniBatchKMeans(n_clusters=n_clusters, random_state=1815, n_init="auto", batch_size=1024)
+    else:
+        raise ValueError(f"Unknown clustering algorithm: {algorithm}")
 
-def get_constituency(PostcodeDistricts: pd.DataFrame) -> Tuple[pd.DataFrame, dict]:
+    return clustering.fit(coordinates, sample_weight=weights).labels_
+
+
+@instrumentation.timed()
+def get_constituency(PostcodeDistricts: pd.DataFrame,
+                     DemandPeriods_df: pd.DataFrame = None) -> Tuple[pd.DataFrame, dict]:
     """
     Purpose of the function is to cluster customers into a 'constituency' which
     can then be used to group demand
@@ -13,7 +46,8 @@ def get_constituency(PostcodeDistricts: pd.DataFrame) -> Tuple[pd.DataFrame, dic
 
     1. Read in a cut of ONS' postcode directory for the UK and match on the westminster constituency
       that all of the postcode districts belong to
-    2. Cluster customers using kmeans, k being set by constants.cluster_size()
+    2. Cluster customers using kmeans, k being set by constants.cluster_size(), see get_cluster_labels.
+      With constants.cluster_by_demand() each district is weighted by its total demand in DemandPeriods_df
 
     Additionally, we return a dictionary containing the indices for columns in the distance
     matrixes which correspond to postcode districts in that constituency, to be used later
@@ -24,29 +58,32 @@ def get_constituency(PostcodeDistricts: pd.DataFrame) -> Tuple[pd.DataFrame, dic
     print(f"Clustering customers by using method: {constants.clustertype()}")
 
     if constants.clustertype() =="parliament":
-        pc_lookup = pd.read_csv("pcd_pcon_uk_lu_may_24_cut.csv")
-        pc_lookup["pcd"] = pc_lookup["pcd"].str.replace(" ", "")
-
-        pc_dict = {postcode: constituency for postcode, constituency in zip(pc_lookup["pcd"], pc_lookup["pconnm"])}
+        # compiled once into a memory-mapped sorted index, see postcode_lookup
+        pc_lookup = postcode_lookup.load_postcode_lookup()
 
-        PostcodeDistricts["Constituency"] = PostcodeDistricts["Reference PC"].map(pc_dict)
+        PostcodeDistricts["Constituency"] = pc_lookup.lookup(PostcodeDistricts["Reference PC"])
 
     else:
-        clustering_prep = [[PostcodeDistricts["X (Easting)"][i], PostcodeDistricts["Y (Northing)"][i]] for i in range(PostcodeDistricts.shape[0])]
-        #print(clustering_prep[0])        
-        clusters = KMeans(n_clusters=constants.cluster_size(), random_state=1815, n_init="auto").fit(np.array(clustering_prep))
-        PostcodeDistricts["Constituency"] = clusters.labels_
+        # (district, 2) array straight from the coordinate columns, no copy when they're already float
+        coordinates = PostcodeDistricts[["X (Easting)", "Y (Northing)"]].to_numpy(dtype=float, copy=False)
+        weights = None
+        if constants.cluster_by_demand():
+            if DemandPeriods_df is None:
+                raise ValueError("Clustering by demand needs the demand data")
+            demand = DemandPeriods_df.groupby("Customer")["Demand"].sum()
+            weights = PostcodeDistricts["District ID"].map(demand).fillna(0).to_numpy(dtype=float)
+        PostcodeDistricts["Constituency"] = get_cluster_labels(coordinates, constants.cluster_size(), weights=weights)
+
+    # indices of the districts in each constituency, from a single grouping pass
+    groups = PostcodeDistricts.groupby("Constituency", sort=True, dropna=False).indices
+    constituencies = pd.Index(list(groups.keys())).tolist()
+    index_dict = {constituency: list(PostcodeDistricts.index[positions])
+                  for constituency, positions in zip(constituencies, groups.values())}
 
-    constituency_set = set(PostcodeDistricts["Constituency"].tolist())
-
-    index_dict = {constituency: list(PostcodeDistricts[PostcodeDistricts["Constituency"]==constituency].index)
-                  for constituency in constituency_set
-    }
-
-  
     return PostcodeDistricts, index_dict
 
 
+@instrumentation.timed()
 def get_clustered_demand(DemandPeriods_df: pd.DataFrame, PostcodeDistricts_constituency: pd.DataFrame)->Tuple[dict, dict]:
     """
     Purpose of the function is to group demand for each postcode district in a given constituency,
@@ -85,38 +122,99 @@ def get_clustered_demand(DemandPeriods_df: pd.DataFrame, PostcodeDistricts_const
     return DemandPeriodsGrouped, DemandPeriods_df 
 
 
-def get_clustered_distance_weighted_by_demand(DistanceDistrictDistrict_df: pd.DataFrame,
+class ClusteredDistances(Mapping):
+    """
+    Read-only (constituency, period) -> pd.Series view over the array of demand weighted
+    distances from get_clustered_distance_array, for code expecting the dictionary
+    get_clustered_distance_weighted_by_demand used to return.
+    The array itself is available as .distances, indexed (constituency, period, row),
+    .rows holding the position in the distance matrix of each row (district j is position j-1).
+    """
+
+    def __init__(self, distances: np.ndarray, constituencies: list, periods: list, rows):
+        self.distances = distances
+        self.constituencies = list(constituencies)
+        self.periods = list(periods)
+        self.rows = np.asarray(rows)
+        self._constituency_position = {con: i for i, con in enumerate(self.constituencies)}
+        self._period_position = {p: i for i, p in enumerate(self.periods)}
+
+    def __getitem__(self, key):
+        con, p = key
+        return pd.Series(self.distances[self._constituency_position[con], self._period_position[p]],
+                         index=self.rows, copy=False)
+
+    def __iter__(self):
+        return ((con, p) for p in self.periods for con in self.constituencies)
+
+    def __len__(self):
+        return len(self.constituencies) * len(self.periods)
+
+
+def get_clustered_distance_array(DistanceDistrictDistrict, DemandPeriods_df: pd.DataFrame,
+                                 constituencies: list, row_positions=None)->Tuple[np.ndarray, list]:
+    """
+    Purpose of the function is to create a distance value from each district in row_positions
+    (by default all of them; in practice the potential warehouse locations) to each constituency,
+    for each time period: the distance to each postcode district in the constituency weighted by
+    its proportion of total constituency demand.
+
+    DistanceDistrictDistrict is either the distance DataFrame or the memory-mapped
+    distance_matrix.DistrictDistances, of which only the rows and demand district columns needed are read.
+    The proportions are laid out as one sparse (district, constituency x period) weight matrix,
+    so all weighted distances come from a single product with those distances.
+    Returns a dense (constituency, period, row) array and the periods.
+    """
+    periods = sorted(set(DemandPeriods_df["Period"]))
+    if row_positions is None:
+        row_positions = np.arange(DistanceDistrictDistrict.shape[0])
+
+    constituency_position = pd.Index(constituencies).get_indexer(DemandPeriods_df["Constituency"])
+    DemandPeriods_df = DemandPeriods_df[constituency_position >= 0]
+    constituency_position = constituency_position[constituency_position >= 0]
+    period_position = pd.Index(periods).get_indexer(DemandPeriods_df["Period"])
+
+    districts = pd.Index(np.sort(DemandPeriods_df["Customer"].unique()))
+    if isinstance(DistanceDistrictDistrict, pd.DataFrame):
+        district_distances = DistanceDistrictDistrict.iloc[row_positions][districts].to_numpy(dtype=float)
+    else:
+        district_distances = DistanceDistrictDistrict.read(row_positions, districts)
+
+    weights = sp.csr_matrix(
+        (DemandPeriods_df["DemandProportion"].to_numpy(dtype=float),
+         (districts.get_indexer(DemandPeriods_df["Customer"]), constituency_position * len(periods) + period_position)),
+        shape=(len(districts), len(constituencies) * len(periods)))
+
+    distances = np.asarray(weights.T @ district_distances.T)
+
+    return distances.reshape(len(constituencies), len(periods), len(row_positions)), periods
+
+
+@instrumentation.timed()
+def get_clustered_distance_weighted_by_demand(DistanceDistrictDistrict,
                                               DemandPeriods_df: pd.DataFrame,
-                                              con_index_dict: dict)->dict:
+                                              con_index_dict: dict,
+                                              row_positions=None)->ClusteredDistances:
     """
     Purpose of the function is to create a distance value from each potential warehouse location
     to each relevant constituency, for each time period.
     TO do this, for each potential warehouse location, we sum the weighted distance of each postcode district
     in the constituency to the potential warehouse location, weighted by its proportion of total constituency demand,
     in each time period.
-    """
-    
-    con_distances = {constituency: DistanceDistrictDistrict_df[[i + 1 for i in constituency_indices]] 
-                     for constituency, constituency_indices in con_index_dict.items()}
-    
-   
-    demand_periods = list(set(DemandPeriods_df["Period"]))
-    demand_periods.sort()
-
-    
-    weighted_con_distance_dict = {}
 
-    for p in demand_periods:
-        DemandPeriods_df_year = DemandPeriods_df[DemandPeriods_df["Period"] == p]        
-        for con in con_distances.keys():
-            DemandPeriods_df_year_ct = DemandPeriods_df_year[DemandPeriods_df_year["Constituency"] == con]
-            con_distances_array = con_distances[con].to_numpy()
-            weights = DemandPeriods_df_year_ct["DemandProportion"].to_numpy()
-            weighted_con_distance_dict[(con, p)] = pd.Series(con_distances_array.dot(weights))
+    The result is keyed by (constituency, period), each value holding the distance from every
+    district in row_positions, see get_clustered_distance_array.
+    """
+    constituencies = list(con_index_dict.keys())
+    if row_positions is None:
+        row_positions = np.arange(DistanceDistrictDistrict.shape[0])
+    distances, periods = get_clustered_distance_array(DistanceDistrictDistrict, DemandPeriods_df,
+                                                      constituencies, row_positions)
 
-    return weighted_con_distance_dict
+    return ClusteredDistances(distances, constituencies, periods, row_positions)
 
 
+@instrumentation.timed()
 def get_total_demand_per_product_per_period(DemandPeriods_df: pd.DataFrame)->dict:
         DemandPeriods_total = DemandPeriods_df.groupby(["Product", "Period"])["Demand"].sum()
       #  DemandPeriods_total.to_csv("checkgood.csv")
@@ -129,9 +227,96 @@ def get_total_demand_per_product_per_period(DemandPeriods_df: pd.DataFrame)->dic
         return DemandPeriodsTotal_dict
 
 
-def read_input_data_and_preprocess():
+@instrumentation.timed()
+def get_clustered_demand_scenarios(DemandPeriodsScenarios_df: pd.DataFrame,
+                                   PostcodeDistricts_constituency: pd.DataFrame,
+                                   constituencies: list, scenarios: list) -> dict:
     """
-    Read in all relevant input data, group demand and distances between candidates + customers
+    Purpose of the function is to group demand for every scenario at once, rather than filtering the
+    scenario demand once per scenario: each row is given its (scenario, constituency, product, period)
+    position, and demand summed over those positions in a single pass.
+    Returns a dictionary of dense arrays along with their labels:
+    grouped_demand (scenario, constituency, product, period), total_demand (scenario, product, period),
+    and proportion (scenario, district, period), the share of each district in its constituency's demand
+    in each period, summed over product, for the districts in 'districts'.
+    """
+    products = np.sort(DemandPeriodsScenarios_df["Product"].unique())
+    periods = np.sort(DemandPeriodsScenarios_df["Period"].unique())
+    districts = np.sort(DemandPeriodsScenarios_df["Customer"].unique())
+    nSc, nK, nP, nT, nD = len(scenarios), len(constituencies), len(products), len(periods), len(districts)
+
+    scenario = pd.Index(scenarios).get_indexer(DemandPeriodsScenarios_df["Scenario"])
+    product = pd.Index(products).get_indexer(DemandPeriodsScenarios_df["Product"])
+    period = pd.Index(periods).get_indexer(DemandPeriodsScenarios_df["Period"])
+    district = pd.Index(districts).get_indexer(DemandPeriodsScenarios_df["Customer"])
+    demand = DemandPeriodsScenarios_df["Demand"].to_numpy(dtype=float)
+
+    # constituency of each district, -1 for districts without one
+    district_constituency = pd.Index(constituencies).get_indexer(
+        pd.Series(PostcodeDistricts_constituency["Constituency"].to_numpy(),
+                  index=PostcodeDistricts_constituency["District ID"]).reindex(districts))
+
+    # total demand includes districts without a constituency
+    kept = scenario >= 0
+    total_demand = np.bincount(((scenario * nP + product) * nT + period)[kept], weights=demand[kept],
+                               minlength=nSc * nP * nT).reshape(nSc, nP, nT)
+
+    kept &= district_constituency[district] >= 0
+    constituency = district_constituency[district]
+    grouped_demand = np.bincount((((scenario * nK + constituency) * nP + product) * nT + period)[kept],
+                                 weights=demand[kept], minlength=nSc * nK * nP * nT).reshape(nSc, nK, nP, nT)
+
+    district_demand = np.bincount(((scenario * nD + district) * nT + period)[kept], weights=demand[kept],
+                                  minlength=nSc * nD * nT).reshape(nSc, nD, nT)
+    constituency_demand = grouped_demand.sum(axis=2)[:, np.maximum(district_constituency, 0)]
+    proportion = np.divide(district_demand, constituency_demand,
+                           out=np.zeros_like(district_demand), where=constituency_demand > 0)
+
+    return {"grouped_demand": grouped_demand, "total_demand": total_demand, "proportion": proportion,
+            "scenarios": list(scenarios), "constituencies": list(constituencies), "products": products.tolist(),
+            "periods": periods.tolist(), "districts": districts, "district_constituency": district_constituency}
+
+
+@instrumentation.timed()
+def get_clustered_distance_scenarios(DistanceDistrictDistrict, clustered_demand: dict,
+                                     row_positions=None) -> list:
+    """
+    Purpose of the function is to create the demand weighted distance from each district in row_positions
+    to each constituency, in each period, for every scenario from get_clustered_demand_scenarios at once:
+    the distance matrix columns are read once, and multiplied by a single sparse
+    (district, scenario x constituency x period) weight matrix.
+    Returns a ClusteredDistances for each scenario.
+    """
+    if row_positions is None:
+        row_positions = np.arange(DistanceDistrictDistrict.shape[0])
+    proportion = clustered_demand["proportion"]
+    nSc, nD, nT = proportion.shape
+    nK = len(clustered_demand["constituencies"])
+    districts = pd.Index(clustered_demand["districts"])
+
+    if isinstance(DistanceDistrictDistrict, pd.DataFrame):
+        district_distances = DistanceDistrictDistrict.iloc[row_positions][districts].to_numpy(dtype=float)
+    else:
+        district_distances = DistanceDistrictDistrict.read(row_positions, districts)
+
+    scenario, district, period = np.nonzero(proportion)
+    constituency = clustered_demand["district_constituency"][district]
+    weights = sp.csr_matrix((proportion[scenario, district, period],
+                             (district, (scenario * nK + constituency) * nT + period)),
+                            shape=(nD, nSc * nK * nT))
+
+    distances = np.asarray(weights.T @ district_distances.T).reshape(nSc, nK, nT, len(row_positions))
+
+    return [ClusteredDistances(distances[sc], clustered_demand["constituencies"], clustered_demand["periods"],
+                               row_positions) for sc in range(nSc)]
+
+
+@instrumentation.timed()
+def read_input_data() -> dict:
+    """
+    Read in all relevant input data, as is: nothing here depends on how customers are clustered
+    or how many scenarios are used, so the result can be shared by runs with different settings
+    (see sweep.py)
     """
     data_dir = constants.get_filepath()
     
@@ -140,52 +325,17 @@ def read_input_data_and_preprocess():
     # The first column is used as the supplier index
     # -----------------------------------------------------------------------------
     Suppliers_df = pd.read_csv(f"{data_dir}/Suppliers.csv", index_col=0)
-    Vehicle_df = pd.read_csv(f"{data_dir}/vehicleType.csv", index_col=0)
     # -----------------------------------------------------------------------------
     # Read postcode district data (used to define customers)
-    # Group postcode demand data by westminster parliamentary constituency
     PostcodeDistricts = pd.read_csv(f"{data_dir}/PostcodeDistricts.csv")
-    PostcodeDistricts_constituency, con_index_dict  = get_constituency(PostcodeDistricts)
-
 
     # Read demand data with time periods
-    # Creates a dictionary keyed by (Customer, Product, Period)
-    # Roll up total demand for each product for each period
-    # And group demand for each product for each period for each consituency
-
     DemandPeriods_df = pd.read_csv(f"{data_dir}/DemandPeriods.csv")
 
-    TotalDemandProductPeriod_dict = get_total_demand_per_product_per_period(DemandPeriods_df)
-
-    DemandPeriodsGrouped, DemandPeriodsProportion = get_clustered_demand(DemandPeriods_df, PostcodeDistricts_constituency)
-
     # -----------------------------------------------------------------------------
     # Read demand data with time periods and scenarios
-    # Creates a dictionary keyed by (Customer, Product, Period, Scenario)
     # -----------------------------------------------------------------------------
     DemandPeriodsScenarios_df = pd.read_csv(f"{data_dir}/DemandPeriodScenarios.csv")
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df[DemandPeriodsScenarios_df["Scenario"] <= constants.number_of_scenarios_to_use()]
-
-    # Group postcode demand data by  parliamentary constituency for each scenario
-    DemandPeriodsGrouped_scenarios = []
-    DemandPeriodsProportion_scenarios = []
-    for i in range(constants.number_of_scenarios_to_use()):
-        
-        DemandPeriodsScenarios_singular_df = DemandPeriodsScenarios_df[DemandPeriodsScenarios_df["Scenario"]==i+1]
-        DemandPeriodsGrouped_single_scenario, DemandPeriodsProportion_single_scenario = get_clustered_demand(
-            DemandPeriodsScenarios_singular_df, PostcodeDistricts_constituency)
-        DemandPeriodsGrouped_scenarios.append(DemandPeriodsGrouped_single_scenario)
-        DemandPeriodsProportion_scenarios.append(DemandPeriodsProportion_single_scenario)
-
-    TotalDemandProductPeriodScenarios_dict = []
-    for i in range(constants.number_of_scenarios_to_use()):
-        DemandPeriodsScenarios_singular_df = DemandPeriodsScenarios_df[DemandPeriodsScenarios_df["Scenario"]==i+1]
-        TotalDemandProductPeriodSingleScenario = get_total_demand_per_product_per_period(DemandPeriodsScenarios_singular_df)
-        TotalDemandProductPeriodScenarios_dict.append(TotalDemandProductPeriodSingleScenario)
- 
-  
-
-
 
     # -----------------------------------------------------------------------------
     # Read candidate facility data
@@ -193,9 +343,7 @@ def read_input_data_and_preprocess():
     Candidates_df = pd.read_csv(f"{data_dir}/Candidates.csv", index_col=0)
 
     # -----------------------------------------------------------------------------
-    # Read candidate capacity and setup operating costs data
-
-    Capacity_df = pd.read_csv(f"{data_dir}/Capacity.csv")
+    # Read candidate setup and operating costs data
     Setup_df = pd.read_csv(f"{data_dir}/Setup.csv")
     Operating_df = pd.read_csv(f"{data_dir}/Operating.csv")
 
@@ -210,28 +358,81 @@ def read_input_data_and_preprocess():
     )
     DistanceSupplierDistrict_df.columns = DistanceSupplierDistrict_df.columns.astype(int)
 
+    # The district-district matrix is memory-mapped, only the rows and columns needed are read later on
+    DistanceDistrictDistrict = distance_matrix.load_district_distances(data_dir)
+
+    return {"Suppliers_df": Suppliers_df, "PostcodeDistricts": PostcodeDistricts,
+            "DemandPeriods_df": DemandPeriods_df, "DemandPeriodsScenarios_df": DemandPeriodsScenarios_df,
+            "Candidates_df": Candidates_df, "Setup_df": Setup_df, "Operating_df": Operating_df,
+            "DistanceSupplierDistrict_df": DistanceSupplierDistrict_df,
+            "DistanceDistrictDistrict": DistanceDistrictDistrict}
+
+
+@instrumentation.timed()
+def read_input_data_and_preprocess(input_data: dict = None):
+    """
+    Read in all relevant input data, group demand and distances between candidates + customers
+    input_data, from read_input_data(), saves reading the input files again
+    """
+    if input_data is None:
+        input_data = read_input_data()
+
+    Suppliers_df = input_data["Suppliers_df"]
+    Candidates_df = input_data["Candidates_df"]
+    Setup_df = input_data["Setup_df"]
+    Operating_df = input_data["Operating_df"]
+    DistanceSupplierDistrict_df = input_data["DistanceSupplierDistrict_df"]
+    DistanceDistrictDistrict = input_data["DistanceDistrictDistrict"]
+
+    # Group postcode demand data by westminster parliamentary constituency
+    # (get_constituency adds the constituency column, so work on a copy of the shared input)
+    PostcodeDistricts_constituency, con_index_dict  = get_constituency(input_data["PostcodeDistricts"].copy(),
+                                                                       input_data["DemandPeriods_df"])
+
+    # Creates a dictionary keyed by (Customer, Product, Period)
+    # Roll up total demand for each product for each period
+    # And group demand for each product for each period for each consituency
+    DemandPeriods_df = input_data["DemandPeriods_df"].copy()
+
+    TotalDemandProductPeriod_dict = get_total_demand_per_product_per_period(DemandPeriods_df)
+
+    DemandPeriodsGrouped, DemandPeriodsProportion = get_clustered_demand(DemandPeriods_df, PostcodeDistricts_constituency)
+
+    # Creates a dictionary keyed by (Customer, Product, Period, Scenario)
+    DemandPeriodsScenarios_df = input_data["DemandPeriodsScenarios_df"]
+    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df[DemandPeriodsScenarios_df["Scenario"] <= constants.number_of_scenarios_to_use()]
+
     #Adjust distance based on grouping by parliamentary constituency,
     #weighted by proportion of total demand in each constituency by demand in each
     # individual postcode district, for each period
 
-    DistanceDistrictDistrict_df = pd.read_csv(
-        f"{data_dir}/Distance District-District.csv", index_col=0
-    )
-    DistanceDistrictDistrict_df.columns = DistanceDistrictDistrict_df.columns.astype(int)
+    # Only the rows of the memory-mapped district-district matrix for candidate
+    # locations (candidate j being district j) and columns for districts with demand are read
+    candidate_rows = np.asarray(Candidates_df.index) - 1
 
-    DistanceDistrictPeriod_df_dict = get_clustered_distance_weighted_by_demand(DistanceDistrictDistrict_df,
+    DistanceDistrictPeriod_df_dict = get_clustered_distance_weighted_by_demand(DistanceDistrictDistrict,
                                                                                DemandPeriodsProportion,
-                                                                               con_index_dict)
-    DistanceDistrictPeriod_df_scenarios_dict_list = []
-    
-    for i in range(constants.number_of_scenarios_to_use()):
-        DistanceDistrictPeriod_df_dict_single_scenario = get_clustered_distance_weighted_by_demand(
-            DistanceDistrictDistrict_df,
-            DemandPeriodsProportion_scenarios[i],
-            con_index_dict)
-        DistanceDistrictPeriod_df_scenarios_dict_list.append(DistanceDistrictPeriod_df_dict_single_scenario)
-    
-
+                                                                               con_index_dict,
+                                                                               candidate_rows)
+
+    # Group postcode demand data by parliamentary constituency for every scenario at once,
+    # and adjust distances accordingly
+    scenarios = list(range(1, constants.number_of_scenarios_to_use() + 1))
+    clustered_demand = get_clustered_demand_scenarios(DemandPeriodsScenarios_df, PostcodeDistricts_constituency,
+                                                      list(con_index_dict.keys()), scenarios)
+
+    # tuple-keyed views of each scenario's arrays, as the models expect
+    DemandPeriodsGrouped_scenarios = [
+        transforms.CostMapping(clustered_demand["grouped_demand"][sc], clustered_demand["constituencies"],
+                               clustered_demand["products"], clustered_demand["periods"])
+        for sc in range(len(scenarios))]
+    TotalDemandProductPeriodScenarios_dict = [
+        transforms.CostMapping(clustered_demand["total_demand"][sc], clustered_demand["products"],
+                               clustered_demand["periods"])
+        for sc in range(len(scenarios))]
+    DistanceDistrictPeriod_df_scenarios_dict_list = get_clustered_distance_scenarios(DistanceDistrictDistrict,
+                                                                                     clustered_demand,
+                                                                                     candidate_rows)
 
     return (Suppliers_df, Candidates_df, DemandPeriods_df, DemandPeriodsScenarios_df, DistanceSupplierDistrict_df,
             DistanceDistrictPeriod_df_dict, DemandPeriodsGrouped, con_index_dict, Operating_df, Setup_df,
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import constants
+
+# =============================================================================
+# Cache of the parsed and preprocessed input data
+#
+# The outputs of preprocessing.read_input_data_and_preprocess are stored under
+# constants.preprocessing_cache_dir(), keyed by a hash of
+#   - the contents of every csv file in the input data directory (and the postcode lookup),
+#     or of the memory-mapped district-district distances when those are read without their csv,
+#   - the settings that change the preprocessing (cluster type, size and algorithm, scenario count),
+#   - the source of preprocessing.py itself, and of the modules it uses to compute its outputs
+#     (PREPROCESSING_SOURCES).
+# Any change to these gives a new key, so stale results are never read back.
+#
+# Numeric arrays (distance matrices, weighted distances, DataFrame columns) are
+# written as .npy files next to a pickle of everything else.
+# preprocessing (and with it sklearn) is only imported when the cache is missed.
+# =============================================================================
+
+CACHE_VERSION = "1"
+# modules whose code changes the preprocessed outputs
+PREPROCESSING_SOURCES = ["preprocessing.py", "transforms.py", "distance_matrix.py", "postcode_lookup.py"]
+# arrays smaller than this are left in the pickle
+MIN_NPY_BYTES = 1 << 16
+
+
+def _hash_file(digest, path: str):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+
+def get_cache_key() -> str:
+    data_dir = constants.get_filepath()
+    digest = hashlib.sha256()
+    digest.update(CACHE_VERSION.encode())
+    digest.update(repr((constants.clustertype(), constants.cluster_size(),
+                        constants.number_of_scenarios_to_use(),
+                        constants.clustering_algorithm(), constants.cluster_by_demand())).encode())
+
+    # only the csv files: anything else in there (e.g. the memory-mapped distance matrix) is derived from them,
+    # unless the district-district csv has been removed and the distances are read from the .npy files alone
+    # (see distance_matrix.load_district_distances)
+    input_files = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir) if name.endswith(".csv"))
+    if not os.path.isfile(os.path.join(data_dir, "Distance District-District.csv")):
+        input_files.extend(os.path.join(data_dir, f"Distance District-District{suffix}.npy")
+                           for suffix in ["", "_index", "_columns"])
+    if constants.clustertype() == "parliament":
+        import postcode_lookup
+        input_files.append(postcode_lookup.POSTCODE_LOOKUP_FILE)
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    input_files.extend(os.path.join(source_dir, name) for name in PREPROCESSING_SOURCES)
+
+    for path in input_files:
+        if os.path.isfile(path):
+            digest.update(os.path.basename(path).encode())
+            _hash_file(digest, path)
+
+    return digest.hexdigest()[:32]
+
+
+class _ArrayPickler(pickle.Pickler):
+    """
+    Pickler writing large numeric arrays out to their own .npy files.
+    """
+
+    def __init__(self, file, directory: str):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):
+        if type(obj) is np.ndarray and obj.dtype.kind in "biuf" and obj.nbytes >= MIN_NPY_BYTES:
+            filename = f"array_{self.n_arrays}.npy"
+            np.save(os.path.join(self.directory, filename), obj)
+            self.n_arrays += 1
+            return filename
+        return None
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, directory: str):
+        super().__init__(file)
+        self.directory = directory
+
+    def persistent_load(self, filename):
+        return np.load(os.path.join(self.directory, filename))
+
+
+def save(key: str, outputs: tuple):
+    cache_dir = constants.preprocessing_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # write everything to a temporary directory first, so a cache entry is either complete or absent
+    directory = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        with open(os.path.join(directory, "outputs.pkl"), "wb") as f:
+            _ArrayPickler(f, directory).dump(outputs)
+        os.replace(directory, os.path.join(cache_dir, key))
+    except OSError:
+        # another run stored the same entry first
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(constants.preprocessing_cache_dir(), key, "outputs.pkl")
+
+
+def load(key: str):
+    path = _entry_path(key)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return _ArrayUnpickler(f, os.path.dirname(path)).load()
+
+
+def is_cached() -> bool:
+    """
+    True when the preprocessed input data for the current input files and settings is in the cache
+    """
+    return os.path.isfile(_entry_path(get_cache_key()))
+
+
+def read_input_data_and_preprocess(input_data: dict = None):
+    """
+    Same as preprocessing.read_input_data_and_preprocess(input_data), reading the results back from the cache
+    when the inputs and settings haven't changed since they were stored.
+    Set constants.use_preprocessing_cache() to False to always preprocess from scratch.
+    """
+    if not constants.use_preprocessing_cache():
+        import preprocessing
+        return preprocessing.read_input_data_and_preprocess(input_data)
+
+    key = get_cache_key()
+    outputs = load(key)
+    if outputs is not None:
+        print(f"Read preprocessed input data from cache {key}")
+        return outputs
+
+    import preprocessing
+    outputs = preprocessing.read_input_data_and_preprocess(input_data)
+    save(key, outputs)
+    return outputs
@@ -0,0 +1,129 @@
+import importlib.util
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Solution extraction and cost breakdown for the MECWLP and SCENARIOS models
+#
+# The cost of a solution is split into building, operating, supply and delivery costs
+# with array products against the cost arrays of matrix_builder.get_model_arrays.
+# The supply and delivery flows are kept sparsely, only the nonzero entries, one row each:
+#   flow ('supply' or 'delivery'), scenario, candidate, supplier (supply only),
+#   customer (delivery only), product, period, share (the variable's value),
+#   quantity (the amount moved) and cost (its contribution to the objective)
+# and written as a single Parquet file per run (a compressed csv when pyarrow isn't installed).
+# =============================================================================
+
+# flows with a smaller share are left out
+FLOW_TOLERANCE = 1e-9
+
+
+def get_solution_values(x: np.ndarray, blocks: dict, names: list) -> list:
+    """
+    Purpose of the function is to take the values of the variable arrays in names out of a solution x,
+    given the column index arrays of each (ModelMatrices.blocks).
+    Delivery variables left out of the model (column -1, see arc_sparsification) are 0.
+    """
+    values = []
+    for name in names:
+        columns = blocks[name]
+        values.append(np.where(columns >= 0, x[np.maximum(columns, 0)], 0.0))
+    return values
+
+
+def _with_scenario_axis(values: np.ndarray, ndim: int) -> np.ndarray:
+    # the MECWLP variable arrays have no scenario axis
+    return values[..., None] if values.ndim == ndim else values
+
+
+def get_cost_breakdown(arrays_list: list, build: np.ndarray, open: np.ndarray, supply: np.ndarray = None,
+                       delivered: np.ndarray = None) -> dict:
+    """
+    Purpose of the function is to split the cost of a solution into building, operating, supply and
+    delivery costs, given matrix_builder.get_model_arrays_list (each scenario weighted by its probability),
+    build (candidate), open (candidate, period), supply (candidate, supplier, period[, scenario])
+    and delivered (candidate, cluster, product, period[, scenario]).
+    Supply and delivery costs are NaN when supply and delivered aren't given.
+    """
+    arrays = arrays_list[0]
+    costs = {"building_costs": arrays["setup"].dot(build),
+             "operating_costs": arrays["operating"].dot(open.sum(axis=1)),
+             "supply_costs": np.nan,
+             "delivery_costs": np.nan}
+    if supply is not None:
+        supply = _with_scenario_axis(supply, 3)
+        costs["supply_costs"] = sum(
+            arrays["probability"] * np.einsum("cst,st,sc->", supply[..., sc], arrays["supplier_demand"],
+                                              arrays["cost_supplier_candidate"])
+            for sc, arrays in enumerate(arrays_list))
+    if delivered is not None:
+        delivered = _with_scenario_axis(delivered, 4)
+        costs["delivery_costs"] = sum(
+            arrays["probability"] * np.einsum("ckpt,kpt,ckt->", delivered[..., sc], arrays["grouped_demand"],
+                                              arrays["cost_candidate_customer"])
+            for sc, arrays in enumerate(arrays_list))
+    return costs
+
+
+def get_flows(arrays_list: list, supply: np.ndarray, delivered: np.ndarray,
+              Candidates, Suppliers, Customers, Products, Times, Scenarios=None) -> pd.DataFrame:
+    """
+    Purpose of the function is to list the nonzero supply and delivery flows of a solution, with their
+    quantities and costs, given the same arrays as get_cost_breakdown and the labels of each axis.
+    """
+    if Scenarios is None:
+        Scenarios = [1]
+    probability = np.array([arrays["probability"] for arrays in arrays_list])
+    supplier_demand = np.stack([arrays["supplier_demand"] for arrays in arrays_list])
+    cost_supplier_candidate = arrays_list[0]["cost_supplier_candidate"]
+    grouped_demand = np.stack([arrays["grouped_demand"] for arrays in arrays_list])
+    cost_candidate_customer = np.stack([arrays["cost_candidate_customer"] for arrays in arrays_list])
+    product_group = arrays_list[0]["product_group"]
+
+    c, s, t, sc = np.nonzero(_with_scenario_axis(supply, 3) > FLOW_TOLERANCE)
+    share = _with_scenario_axis(supply, 3)[c, s, t, sc]
+    quantity = share * supplier_demand[sc, s, t]
+    supply_flows = pd.DataFrame({"flow": "supply",
+                                 "scenario": np.asarray(list(Scenarios))[sc],
+                                 "candidate": np.asarray(Candidates)[c],
+                                 "supplier": pd.array(np.asarray(Suppliers)[s], dtype="Int64"),
+                                 "customer": None,
+                                 "product": np.asarray(product_group)[s],
+                                 "period": np.asarray(Times)[t],
+                                 "share": share,
+                                 "quantity": quantity,
+                                 "cost": probability[sc] * quantity * cost_supplier_candidate[s, c]})
+
+    c, k, p, t, sc = np.nonzero(_with_scenario_axis(delivered, 4) > FLOW_TOLERANCE)
+    share = _with_scenario_axis(delivered, 4)[c, k, p, t, sc]
+    quantity = share * grouped_demand[sc, k, p, t]
+    delivery_flows = pd.DataFrame({"flow": "delivery",
+                                   "scenario": np.asarray(list(Scenarios))[sc],
+                                   "candidate": np.asarray(Candidates)[c],
+                                   "supplier": pd.array([pd.NA] * c.size, dtype="Int64"),
+                                   # constituency names or kmeans cluster numbers
+                                   "customer": np.array([str(customer) for customer in Customers], dtype=object)[k],
+                                   "product": np.asarray(list(Products))[p],
+                                   "period": np.asarray(Times)[t],
+                                   "share": share,
+                                   "quantity": quantity,
+                                   "cost": probability[sc] * quantity * cost_candidate_customer[sc, c, k, t]})
+
+    flows = pd.concat([supply_flows, delivery_flows], ignore_index=True)
+    flows["flow"] = flows["flow"].astype("category")
+    return flows
+
+
+def save_flows(flows: pd.DataFrame, name: str) -> str:
+    """
+    Purpose of the function is to write the flows to name.parquet, or to name.csv.gz without pyarrow.
+    Returns the path written.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        print("pyarrow isn't installed (pip install pyarrow), writing the flows as a compressed csv")
+        path = f"{name}.csv.gz"
+        flows.to_csv(path, index=False)
+        return path
+    path = f"{name}.parquet"
+    flows.to_parquet(path, index=False, engine="pyarrow")
+    return path
@@ -0,0 +1,171 @@
+import time
+import numpy as np
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+import instrumentation
+
+# =============================================================================
+# Rolling horizon solve of the MECWLP and SCENARIOS models
+#
+# Periods are only linked through the build/open decisions (a warehouse must be built
+# to open and remains open); supply, warehoused and delivered are per period. So rather
+# than one model over every period, the model is solved over a window of
+# constants.rolling_horizon_window() periods, the open decisions of its first
+# constants.rolling_horizon_step() periods are fixed, and the window slides forward:
+#
+#   window 1: [t1 t2 t3]         fix t1
+#   window 2:    [t2 t3 t4]      fix t2, with warehouses open in t1 kept open
+#   ...
+#
+# In each window, warehouses open before it remain open and their setup cost has already
+# been paid. The recourse cost of the periods fixed is taken from the window they were fixed
+# in, which is exact as the recourse of each period only depends on that period's open decisions.
+# Only one window's model is held at once, so memory and solve time are bounded by the window.
+#
+# Optionally (constants.rolling_horizon_polish()) the plan is then handed as a MIP start to
+# a solve over every period, limited to constants.rolling_horizon_polish_time_limit() seconds.
+# =============================================================================
+
+
+def get_window_inputs(model: str, model_inputs: tuple, periods: list) -> tuple:
+    """
+    Purpose of the function is to restrict the arguments of MECWLP_model (model 'MECWLP') or SCENARIOS_model
+    (model 'SCENARIOS') to the given periods (labels from Times): demand is looked up by period,
+    candidate-customer costs by position, so those are sliced.
+    """
+    Times = list(model_inputs[1])
+    positions = [Times.index(t) for t in periods]
+    model_inputs = list(model_inputs)
+    model_inputs[1] = list(periods)
+    if model == "MECWLP":
+        model_inputs[9] = np.asarray(model_inputs[9])[:, :, positions]
+    elif model == "SCENARIOS":
+        model_inputs[10] = [np.asarray(costs)[:, :, positions] for costs in model_inputs[10]]
+    else:
+        raise ValueError(f"Unknown model: {model}")
+    return tuple(model_inputs)
+
+
+def _recourse_period_costs(matrices: matrix_builder.ModelMatrices, x: np.ndarray, nT: int) -> np.ndarray:
+    """
+    Supply and delivery cost in each period of a solution x.
+    """
+    costs = np.zeros(nT)
+    # in the aggregated formulation delivered is a view of assigned
+    names = ["supply", "warehoused", "assigned" if "assigned" in matrices.blocks else "delivered"]
+    for name in names:
+        columns = matrices.blocks[name]
+        # supply (c, s, t), warehoused (c, p, t), assigned (c, k, t) and delivered (c, k, p, t), then scenario
+        period_axis = 3 if name == "delivered" else 2
+        columns = np.moveaxis(columns, period_axis, 0).reshape(nT, -1)
+        kept = columns >= 0
+        costs += np.where(kept, matrices.objcoef[columns] * x[columns], 0).sum(axis=1)
+    return costs
+
+
+@instrumentation.timed()
+def solve_rolling_horizon(model: str, model_inputs: tuple, backend: str, window: int = None, step: int = None,
+                          polish: bool = None, threads: int = None, time_limit: float = None, output: bool = False,
+                          mip_start: np.ndarray = None):
+    """
+    Purpose of the function is to solve the MECWLP (model 'MECWLP') or SCENARIOS (model 'SCENARIOS') model,
+    given its arguments, window periods at a time (default constants.rolling_horizon_window()),
+    fixing step periods (default constants.rolling_horizon_step()) after each window.
+    polish (default constants.rolling_horizon_polish()) then solves over every period from the plan found.
+    time_limit applies to each window. mip_start (build/open values over every period) starts the first window.
+
+    Returns a SolverResult whose x holds the build and open values, the column indices of build and open
+    in x, and the total build time. The objective is the cost of the plan; there is no bound unless polished.
+    """
+    if window is None:
+        window = constants.rolling_horizon_window()
+    if step is None:
+        step = constants.rolling_horizon_step()
+    if polish is None:
+        polish = constants.rolling_horizon_polish()
+    Candidates, Times = model_inputs[0], list(model_inputs[1])
+    nC, nT = len(Candidates), len(Times)
+    window = max(min(int(window), nT), 1)
+    step = max(min(int(step), window), 1)
+    build_matrices = {"MECWLP": matrix_builder.build_MECWLP_matrices,
+                      "SCENARIOS": matrix_builder.build_SCENARIOS_matrices}[model]
+    aggregated = constants.model_formulation() == "aggregated"
+
+    open_plan = np.zeros((nC, nT))
+    recourse_costs = np.zeros(nT)
+    start_open = None if mip_start is None else np.asarray(mip_start)[nC:].reshape(nC, nT)
+    log = []
+    build_time = 0
+    solve_time = 0
+    first = 0
+    while first < nT:
+        periods = Times[first:first + window]
+        build_start = time.perf_counter()
+        matrices = build_matrices(*get_window_inputs(model, model_inputs, periods), names=False, aggregated=aggregated)
+        build_time += time.perf_counter() - build_start
+
+        # warehouses open before the window remain open, and have already been paid for
+        built = open_plan[:, first - 1] > 0.5 if first > 0 else np.zeros(nC, dtype=bool)
+        matrices.lb[matrices.blocks["open"][built]] = 1
+        matrices.lb[matrices.blocks["build"][built]] = 1
+        matrices.objcoef[matrices.blocks["build"][built]] = 0
+
+        window_start = None
+        if start_open is not None:
+            window_open = np.maximum(start_open[:, first:first + len(periods)], built[:, None])
+            window_start = np.concatenate([window_open.max(axis=1), window_open.ravel()])
+        result = solvers.solve_matrices(matrices, backend, threads=threads, time_limit=time_limit, output=output,
+                                        mip_start=window_start)
+        solve_time += result.solve_time
+        if not result.has_solution:
+            print(f"Rolling horizon: no solution for periods {periods[0]}-{periods[-1]} ({result.status})")
+            result.solve_time = solve_time
+            return result, None, build_time
+
+        # the last window fixes every period left
+        fixed = len(periods) if first + len(periods) >= nT else step
+        window_open = np.round(result.x[matrices.blocks["open"]])
+        open_plan[:, first:first + fixed] = window_open[:, :fixed]
+        recourse_costs[first:first + fixed] = _recourse_period_costs(matrices, result.x, len(periods))[:fixed]
+        log.append({"periods": f"{periods[0]}-{periods[-1]}", "fixed": fixed, "columns": matrices.ncols,
+                    "rows": matrices.nrows, "nonzeros": matrices.A.nnz, "status": result.status,
+                    "obj_val": result.objective, "solve_time": result.solve_time})
+        print(f"Rolling horizon: periods {periods[0]}-{periods[-1]}, {matrices.ncols} columns, "
+              f"{result.status}, fixed {fixed} period(s)")
+
+        # the next window starts from this window's plan, with its last period carried forward
+        start_open = np.zeros((nC, nT))
+        start_open[:, first:first + len(periods)] = window_open
+        start_open[:, first + len(periods):] = window_open[:, -1:]
+        first += fixed
+
+    build = open_plan.max(axis=1)
+    arrays = matrix_builder.get_model_arrays_list(model, model_inputs)[0]
+    plan_cost = arrays["setup"].dot(build) + arrays["operating"].dot(open_plan.sum(axis=1)) + recourse_costs.sum()
+    x = np.concatenate([build, open_plan.ravel()])
+    blocks = {"build": np.arange(nC), "open": nC + np.arange(nC * nT).reshape(nC, nT)}
+    result = solvers.SolverResult(backend=backend, status="feasible", objective=plan_cost, solve_time=solve_time, x=x)
+    print(f"Rolling horizon: plan cost {plan_cost}")
+
+    if polish:
+        build_start = time.perf_counter()
+        matrices = build_matrices(*model_inputs, names=False, aggregated=aggregated)
+        build_time += time.perf_counter() - build_start
+        polished = solvers.solve_matrices(matrices, backend, threads=threads,
+                                          time_limit=constants.rolling_horizon_polish_time_limit(),
+                                          output=output, mip_start=x)
+        log.append({"periods": f"{Times[0]}-{Times[-1]}", "fixed": 0, "columns": matrices.ncols,
+                    "rows": matrices.nrows, "nonzeros": matrices.A.nnz, "status": polished.status,
+                    "obj_val": polished.objective, "solve_time": polished.solve_time})
+        print(f"Rolling horizon: polished over every period, {polished.status}, objective {polished.objective}")
+        polished.solve_time += solve_time
+        if polished.has_solution and polished.objective <= plan_cost + 1e-6 * (1 + abs(plan_cost)):
+            result, blocks = polished, matrices.blocks
+        else:
+            result.solve_time = polished.solve_time
+
+    pd.DataFrame(log).to_csv(
+        constants.get_output_path(f"rolling_horizon_log_{model}_{constants.clustertype()}.csv"), index=False)
+    return result, blocks, build_time
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import constants
+
+# =============================================================================
+# Scenario-parallel execution
+#
+# map_scenarios runs a function once per scenario, in a process pool when more
+# than one worker is asked for (constants.number_of_workers()).
+# Starting the pool costs more than the per-scenario work of the usual instances,
+# so by default the scenarios are worked through in this process.
+# Large in-memory inputs (e.g. the demand weighted distances of every scenario)
+# are copied once into shared memory and handed to the function as read-only
+# views in each worker, rather than being pickled for every task.
+#
+# Worker processes import the calling script, so scripts using this
+# need an  if __name__ == "__main__":  guard (see main.py).
+# =============================================================================
+
+# shared inputs attached in this (worker) process, by name
+_shared = {}
+# keep the shared memory blocks open for as long as the worker lives
+_shared_memory_blocks = []
+
+
+def _share(value):
+    """
+    Copy an array or DataFrame into a new shared memory block.
+    Returns the block and what a worker needs to rebuild the value around it.
+    """
+    if isinstance(value, pd.DataFrame):
+        array = value.to_numpy()
+        frame = (value.index, value.columns)
+    else:
+        array = np.asarray(value)
+        frame = None
+
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str, frame)
+
+
+def _attach(specs: dict):
+    """
+    Process pool initializer: map every shared input into this worker.
+    """
+    for name, (block_name, shape, dtype, frame) in specs.items():
+        # the parent process owns (and unlinks) the block, workers only attach to it
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_memory_blocks.append(block)
+
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        if frame is None:
+            _shared[name] = array
+        else:
+            index, columns = frame
+            _shared[name] = pd.DataFrame(array, index=index, columns=columns, copy=False)
+
+
+def _call(function, args):
+    return function(*args, **_shared)
+
+
+def get_number_of_workers(workers=None) -> int:
+    if workers is None:
+        workers = constants.number_of_workers()
+    if workers is None:
+        workers = 1
+    return max(int(workers), 1)
+
+
+def map_scenarios(function, scenario_args: list, shared: dict = None, workers: int = None) -> list:
+    """
+    Purpose of the function is to evaluate function(*args, **shared) for each args in scenario_args,
+    returning the results in the same order.
+
+    function must be defined at module level so it can be sent to the workers.
+    shared holds large inputs used by every call, passed by keyword. In the workers these are read-only.
+    workers defaults to constants.number_of_workers(); with one worker, or a single scenario,
+    everything runs in this process.
+    """
+    shared = {} if shared is None else shared
+    workers = min(get_number_of_workers(workers), len(scenario_args))
+
+    if workers <= 1:
+        return [function(*args, **shared) for args in scenario_args]
+
+    blocks = []
+    try:
+        specs = {}
+        for name, value in shared.items():
+            block, specs[name] = _share(value)
+            blocks.append(block)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(specs,)) as pool:
+            futures = [pool.submit(_call, function, args) for args in scenario_args]
+            return [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,159 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+import constants
+import matrix_builder
+import solvers
+import warm_start
+import instrumentation
+
+#==================================================================================================================
+# Scenario reduction by fast forward selection (Heitsch and Roemisch)
+#
+# The SCENARIOS model grows linearly with the number of scenarios, but many scenarios are close to one another.
+# Scenarios are compared by the distance between their grouped demand (cluster, product, period) vectors.
+# Fast forward selection picks scenarios one at a time, each time the one that most reduces the
+#   sum over scenarios not picked of probability * distance to the nearest scenario picked
+# and each scenario not picked then gives its probability to the nearest scenario picked.
+# That sum is the (Kantorovich) distance between the scenarios read in and the reduced set.
+#
+# The reduced SCENARIOS model is passed the scenarios kept as {scenario: probability, ...}, keeping the labels
+# they were read in with (e.g. in the flows), and weighting each by its probability in the objective
+# (see matrix_builder.get_scenario_probabilities).
+# The scenarios kept, and their probabilities, are saved to scenario_reduction_*.csv.
+#
+# python scenario_reduction.py [scenarios to keep]
+# compares the plan of the reduced model, and of the model with the first scenarios read in, against the plan
+# of the model with every scenario: each plan is evaluated over every scenario with its build/open decisions fixed.
+#==================================================================================================================
+
+
+def get_scenario_distances(vectors: np.ndarray) -> np.ndarray:
+    """
+    Euclidean distance between every pair of scenarios, given one vector per scenario (a row of vectors).
+    """
+    squared = (vectors ** 2).sum(axis=1)
+    distances = squared[:, None] + squared[None, :] - 2 * vectors @ vectors.T
+    return np.sqrt(np.maximum(distances, 0))
+
+
+def fast_forward_selection(distances: np.ndarray, probabilities: np.ndarray, n_selected: int) -> tuple:
+    """
+    Purpose of the function is to select n_selected of the scenarios, given the distance between every pair
+    of them and their probabilities, by fast forward selection.
+    Returns the positions of the scenarios selected (in order), their probabilities after each scenario
+    left out has given its probability to the nearest one selected, and the distance between the two sets.
+    """
+    n = distances.shape[0]
+    n_selected = min(n_selected, n)
+    selected = np.zeros(n, dtype=bool)
+    # distance from each scenario to the nearest one selected so far
+    nearest = np.full(n, np.inf)
+    for _ in range(n_selected):
+        # (scenario, scenario to select next): distance to the nearest selected, were it selected
+        nearest_with = np.minimum(nearest[:, None], distances)
+        reduction_distance = probabilities[~selected] @ nearest_with[~selected]
+        reduction_distance[selected] = np.inf
+        chosen = np.argmin(reduction_distance)
+        selected[chosen] = True
+        nearest = nearest_with[:, chosen]
+
+    positions = np.flatnonzero(selected)
+    closest = positions[np.argmin(distances[:, positions], axis=1)]
+    reduced_probabilities = np.bincount(closest, weights=probabilities, minlength=n)[positions]
+    return positions, reduced_probabilities, probabilities[~selected].dot(nearest[~selected])
+
+
+@instrumentation.timed()
+def reduce_scenarios(SCENARIOS_inputs: tuple, n_selected: int) -> tuple:
+    """
+    Purpose of the function is to reduce the scenarios of the arguments of SCENARIOS_model to n_selected,
+    chosen by fast forward selection on their grouped demand, with re-weighted probabilities.
+    Returns the same arguments for the scenarios kept, with Scenarios mapping the label of each to its probability.
+    """
+    (Candidates, Times, Suppliers, Products, Customers, Scenarios, Operating_df, Setup_df, CostSupplierCandidate,
+     DemandPeriodsGrouped, CostCandidateCustomers, Suppliers_df, Candidates_df, TotalDemand) = SCENARIOS_inputs
+    if n_selected >= len(Scenarios):
+        return SCENARIOS_inputs
+
+    arrays_list = matrix_builder.get_model_arrays_list("SCENARIOS", SCENARIOS_inputs)
+    vectors = np.stack([arrays["grouped_demand"].ravel() for arrays in arrays_list])
+    probabilities = matrix_builder.get_scenario_probabilities(Scenarios)
+    kept, kept_probabilities, distance = fast_forward_selection(get_scenario_distances(vectors), probabilities,
+                                                                n_selected)
+
+    labels = np.asarray(list(Scenarios))[kept]
+    print(f"Scenario reduction: kept scenarios {labels.tolist()} of {len(Scenarios)}, "
+          f"probabilities {np.round(kept_probabilities, 4).tolist()}, distance {distance:.4f}")
+    pd.DataFrame({"scenario": labels, "probability": kept_probabilities}).to_csv(
+        constants.get_output_path(f"scenario_reduction_{constants.clustertype()}_scenarios{len(Scenarios)}_"
+                                  f"to{len(kept)}.csv"), index=False)
+
+    return (Candidates, Times, Suppliers, Products, Customers,
+            dict(zip(labels.tolist(), kept_probabilities.tolist())),
+            Operating_df, Setup_df, CostSupplierCandidate,
+            [DemandPeriodsGrouped[i] for i in kept],
+            [CostCandidateCustomers[i] for i in kept],
+            Suppliers_df, Candidates_df,
+            [TotalDemand[i] for i in kept])
+
+
+def evaluate_first_stage(SCENARIOS_inputs: tuple, first_stage: warm_start.FirstStageSolution) -> float:
+    """
+    Purpose of the function is to work out the expected cost of the build/open decisions in first_stage
+    over the scenarios of SCENARIOS_inputs, solving the model with them fixed as an LP.
+    Returns infinity when some scenario can't be served with the warehouses opened.
+    """
+    Candidates, Times = SCENARIOS_inputs[0], SCENARIOS_inputs[1]
+    matrices = matrix_builder.build_SCENARIOS_matrices(*SCENARIOS_inputs, names=False,
+                                                       aggregated=constants.model_formulation() == "aggregated")
+    fixed = warm_start.get_mip_start(first_stage, Candidates, Times)
+    lb, ub = matrices.lb.copy(), matrices.ub.copy()
+    lb[:fixed.size] = ub[:fixed.size] = fixed
+    solution = solvers.solve_lp(matrices, lb, ub)
+    return solution.fun if solution.status == 0 else np.inf
+
+
+def compare_scenario_reduction(n_selected: int = 10) -> pd.DataFrame:
+    """
+    Purpose of the function is to solve the SCENARIOS model with every scenario read in
+    (constants.number_of_scenarios_to_use()), with n_selected scenarios chosen by fast forward selection,
+    and with the first n_selected scenarios, evaluating the plan of each over every scenario.
+    Results are saved to compare_scenario_reduction.csv.
+    """
+    from main import get_model_inputs, get_SCENARIOS_inputs
+
+    backend = constants.solver_backend()
+    aggregated = constants.model_formulation() == "aggregated"
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    all_inputs = get_SCENARIOS_inputs(MECWLP_inputs, scenario_data)
+    Candidates, Times = all_inputs[0], all_inputs[1]
+
+    rows = []
+    for scenarios, model_inputs in [("all", all_inputs),
+                                    ("reduced", reduce_scenarios(all_inputs, n_selected)),
+                                    ("first", get_SCENARIOS_inputs(MECWLP_inputs, scenario_data, n_selected))]:
+        start = time.perf_counter()
+        matrices = matrix_builder.build_SCENARIOS_matrices(*model_inputs, names=False, aggregated=aggregated)
+        build_time = time.perf_counter() - start
+        result = solvers.solve_matrices(matrices, backend, threads=constants.solver_threads())
+        expected_cost = np.nan
+        if result.has_solution:
+            first_stage = warm_start.get_first_stage_solution(Candidates, Times, result.x[matrices.blocks["build"]],
+                                                              result.x[matrices.blocks["open"]])
+            expected_cost = evaluate_first_stage(all_inputs, first_stage)
+        rows.append({"scenarios": scenarios, "number_of_scenarios": len(model_inputs[5]), "solver": backend,
+                     "columns": matrices.ncols, "rows": matrices.nrows, "status": result.status,
+                     "obj_val": result.objective, "expected_cost": expected_cost,
+                     "build_time": build_time, "solve_time": result.solve_time})
+
+    comparison = pd.DataFrame(rows)
+    comparison["expected_cost_difference"] = comparison["expected_cost"] - comparison["expected_cost"].iloc[0]
+    print(comparison.to_string(index=False))
+    comparison.to_csv(constants.get_output_path("compare_scenario_reduction.csv"), index=False)
+    return comparison
+
+
+if __name__ == "__main__":
+    compare_scenario_reduction(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,258 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from dataclasses import dataclass
+from scipy.optimize import milp, linprog, LinearConstraint, Bounds
+import matrix_builder
+import instrumentation
+
+# =============================================================================
+# Solver backends
+#
+# The MECWLP and SCENARIOS models, assembled as arrays by matrix_builder, can be
+# solved by any of
+#   'xpress': FICO Xpress (the community licence limits the model size)
+#   'highs':  HiGHS through highspy (pip install highspy)
+#   'scipy':  scipy.optimize.milp, which also calls HiGHS, so needs nothing beyond scipy
+# The backend used by the models is set by constants.solver_backend().
+# xpress and highspy are only imported when their backend is used, so either can be left uninstalled.
+#
+# Whatever the backend, the outcome comes back as a SolverResult, so the same
+# model can be solved by each backend and compared (see benchmark_solvers.py).
+# =============================================================================
+
+BACKENDS = ["xpress", "highs", "scipy"]
+
+
+@dataclass
+class SolverResult:
+    """
+    Outcome of a solve: status is one of 'optimal', 'feasible' (a solution, not proven optimal),
+    'infeasible', 'unbounded' or 'no solution'. x holds the column values when there's a solution.
+    """
+    backend: str
+    status: str
+    objective: float = np.nan
+    bound: float = np.nan
+    solve_time: float = np.nan
+    x: np.ndarray = None
+
+    @property
+    def has_solution(self) -> bool:
+        return self.status in ["optimal", "feasible"]
+
+    @property
+    def gap(self) -> float:
+        if not self.has_solution:
+            return np.nan
+        return abs(self.objective - self.bound) / (1e-10 + abs(self.objective))
+
+
+def import_xpress():
+    try:
+        import xpress
+    except ImportError as error:
+        raise ImportError("The 'xpress' solver backend needs xpress: pip install xpress") from error
+    return xpress
+
+
+def get_xpress_result(prob, with_solution: bool = True) -> SolverResult:
+    """
+    SolverResult for an xpress problem that has been solved, leaving out the column values
+    unless with_solution.
+    """
+    xp = import_xpress()
+    status = {xp.SolStatus.OPTIMAL: "optimal",
+              xp.SolStatus.FEASIBLE: "feasible",
+              xp.SolStatus.INFEASIBLE: "infeasible",
+              xp.SolStatus.UNBOUNDED: "unbounded"}.get(prob.attributes.solstatus, "no solution")
+    result = SolverResult(backend="xpress", status=status, solve_time=prob.attributes.time)
+    if result.has_solution:
+        result.objective = prob.attributes.objval
+        result.bound = prob.attributes.bestbound
+        if with_solution:
+            result.x = np.array(prob.getSolution())
+    return result
+
+
+def row_bounds(rowtype: np.ndarray, rhs: np.ndarray):
+    """
+    Xpress row types and right hand sides as lower and upper bounds on each row.
+    """
+    row_lower = np.where(rowtype == "L", -np.inf, rhs)
+    row_upper = np.where(rowtype == "G", np.inf, rhs)
+    return row_lower, row_upper
+
+
+def _solve_xpress(matrices: matrix_builder.ModelMatrices, threads: int = None, time_limit: float = None,
+                  output: bool = False, mip_start: np.ndarray = None) -> SolverResult:
+    xp = import_xpress()
+    xp.setOutputEnabled(output)
+    prob = xp.problem(matrices.name)
+    matrix_builder.load_into_xpress(prob, matrices)
+    if threads is not None:
+        prob.controls.threads = threads
+    if time_limit is not None:
+        prob.controls.maxtime = -int(time_limit)
+    if mip_start is not None:
+        prob.addMipSol(mip_start, matrices.entind[:len(mip_start)].tolist())
+    prob.solve()
+    return get_xpress_result(prob)
+
+
+def import_highspy():
+    try:
+        import highspy
+    except ImportError as error:
+        raise ImportError("The 'highs' solver backend needs highspy: pip install highspy") from error
+    return highspy
+
+
+def get_highs_result(highs, solve_time: float) -> SolverResult:
+    """
+    SolverResult for a highspy.Highs model that has been run.
+    """
+    highspy = import_highspy()
+    model_status = highs.getModelStatus()
+    info = highs.getInfo()
+    if model_status == highspy.HighsModelStatus.kOptimal:
+        status = "optimal"
+    elif model_status == highspy.HighsModelStatus.kInfeasible:
+        status = "infeasible"
+    elif model_status in [highspy.HighsModelStatus.kUnbounded, highspy.HighsModelStatus.kUnboundedOrInfeasible]:
+        status = "unbounded"
+    elif info.primal_solution_status == 2:
+        # stopped early (e.g. time limit) with a feasible solution
+        status = "feasible"
+    else:
+        status = "no solution"
+
+    result = SolverResult(backend="highs", status=status, solve_time=solve_time)
+    if result.has_solution:
+        result.objective = info.objective_function_value
+        result.bound = info.mip_dual_bound
+        result.x = np.array(highs.getSolution().col_value)
+    return result
+
+
+def _solve_highs(matrices: matrix_builder.ModelMatrices, threads: int = None, time_limit: float = None,
+                 output: bool = False, mip_start: np.ndarray = None) -> SolverResult:
+    highspy = import_highspy()
+
+    A = sp.csc_matrix(matrices.A)
+    row_lower, row_upper = row_bounds(matrices.rowtype, matrices.rhs)
+    integrality = np.zeros(matrices.ncols, dtype=int)
+    integrality[matrices.entind] = 1
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = matrices.ncols
+    lp.num_row_ = matrices.nrows
+    lp.col_cost_ = matrices.objcoef
+    lp.col_lower_ = matrices.lb
+    lp.col_upper_ = matrices.ub
+    lp.row_lower_ = row_lower
+    lp.row_upper_ = row_upper
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+    lp.integrality_ = [highspy.HighsVarType.kInteger if integer else highspy.HighsVarType.kContinuous
+                       for integer in integrality]
+
+    highs = highspy.Highs()
+    highs.setOptionValue("output_flag", output)
+    if threads is not None:
+        highs.setOptionValue("threads", threads)
+    if time_limit is not None:
+        highs.setOptionValue("time_limit", float(time_limit))
+    highs.passModel(lp)
+    if mip_start is not None:
+        # a partial solution, HiGHS works out the continuous columns
+        highs.setSolution(len(mip_start), matrices.entind[:len(mip_start)].astype(np.int32),
+                          np.asarray(mip_start, dtype=float))
+
+    start = time.perf_counter()
+    highs.run()
+    return get_highs_result(highs, time.perf_counter() - start)
+
+
+def _solve_scipy(matrices: matrix_builder.ModelMatrices, threads: int = None, time_limit: float = None,
+                 output: bool = False, mip_start: np.ndarray = None) -> SolverResult:
+    # scipy.optimize.milp has no threads option or MIP starts, so threads and mip_start are ignored
+    row_lower, row_upper = row_bounds(matrices.rowtype, matrices.rhs)
+    integrality = np.zeros(matrices.ncols, dtype=int)
+    integrality[matrices.entind] = 1
+    options = {"disp": output}
+    if time_limit is not None:
+        options["time_limit"] = float(time_limit)
+
+    start = time.perf_counter()
+    solution = milp(matrices.objcoef, integrality=integrality, bounds=Bounds(matrices.lb, matrices.ub),
+                    constraints=LinearConstraint(sp.csr_array(matrices.A), row_lower, row_upper), options=options)
+    solve_time = time.perf_counter() - start
+
+    # status 0: optimal, 1: stopped at a limit, 2: infeasible, 3: unbounded
+    if solution.status == 0:
+        status = "optimal"
+    elif solution.status == 2:
+        status = "infeasible"
+    elif solution.status == 3:
+        status = "unbounded"
+    elif solution.x is not None:
+        status = "feasible"
+    else:
+        status = "no solution"
+
+    result = SolverResult(backend="scipy", status=status, solve_time=solve_time)
+    if result.has_solution:
+        result.objective = solution.fun
+        result.bound = getattr(solution, "mip_dual_bound", solution.fun)
+        result.x = np.asarray(solution.x)
+    return result
+
+
+@instrumentation.timed()
+def solve_matrices(matrices: matrix_builder.ModelMatrices, backend: str, threads: int = None,
+                   time_limit: float = None, output: bool = False, mip_start: np.ndarray = None) -> SolverResult:
+    """
+    Purpose of the function is to solve a model assembled by matrix_builder with the given backend
+    (one of BACKENDS), using at most threads threads (None leaves it to the solver) and stopping
+    after time_limit seconds (None for no limit).
+    mip_start, values for the first len(mip_start) integer columns (build and open, see warm_start.get_mip_start),
+    is handed to the solver as a starting solution (not by the 'scipy' backend, which can't take one).
+    """
+    solve = {"xpress": _solve_xpress, "highs": _solve_highs, "scipy": _solve_scipy}.get(backend)
+    if solve is None:
+        raise ValueError(f"Unknown solver backend: {backend}, expected one of {BACKENDS}")
+    instrumentation.record(backend=backend, columns=matrices.ncols, rows=matrices.nrows, nonzeros=matrices.A.nnz)
+    return solve(matrices, threads=threads, time_limit=time_limit, output=output, mip_start=mip_start)
+
+
+def solve_lp(matrices: matrix_builder.ModelMatrices, lb: np.ndarray = None, ub: np.ndarray = None,
+             A=None, rowtype: np.ndarray = None, rhs: np.ndarray = None):
+    """
+    Purpose of the function is to solve the LP relaxation of a model assembled by matrix_builder
+    with scipy's HiGHS, whatever the solver backend, optionally with other column bounds
+    or other rows (A, rowtype, rhs) in place of the model's.
+    Returns the scipy.optimize.linprog result, with the dual value of each row added as duals when solved.
+    """
+    A = sp.csr_matrix(matrices.A if A is None else A)
+    lb = matrices.lb if lb is None else lb
+    ub = matrices.ub if ub is None else ub
+    rowtype = matrices.rowtype if rowtype is None else rowtype
+    rhs = matrices.rhs if rhs is None else rhs
+    less = np.flatnonzero(rowtype == "L")
+    greater = np.flatnonzero(rowtype == "G")
+    equal = np.flatnonzero(rowtype == "E")
+
+    # >= rows are handed to linprog as <= rows with both sides negated
+    solution = linprog(matrices.objcoef, A_ub=sp.vstack([A[less], -A[greater]]),
+                       b_ub=np.concatenate([rhs[less], -rhs[greater]]), A_eq=A[equal], b_eq=rhs[equal],
+                       bounds=np.column_stack([lb, ub]), method="highs")
+    if solution.status == 0:
+        duals = np.zeros(rowtype.size)
+        duals[less] = solution.ineqlin.marginals[:less.size]
+        duals[greater] = -solution.ineqlin.marginals[less.size:]
+        duals[equal] = solution.eqlin.marginals
+        solution.duals = duals
+    return solution
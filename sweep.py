@@ -0,0 +1,170 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import constants
+import preprocessing
+import MECWLP_model
+import SCENARIOS_model
+import candidate_screening
+import scenario_reduction
+from main import get_model_inputs, get_SCENARIOS_inputs, get_solve_methods
+
+#==================================================================================================================
+# Solve the model for several clustering settings (and scenario counts) at once, e.g. to compare
+# kmeans{k} for a few k against clustering by parliamentary constituency.
+# The runs are set in constants.sweep_configurations(); each is a dict such as
+#   {"model": "MECWLP", "cluster_type": "kmeans", "cluster_size": 20, "number_of_scenarios": 1}
+# with model "MECWLP" or "SCENARIOS" and cluster_type "kmeans" or "parliament",
+# and optionally "solver", the solver backend to use (see solvers.py), "formulation",
+# 'full' or 'aggregated' (see constants.model_formulation()), and "arcs_per_cluster",
+# to only create delivery variables from that many candidates per cluster (see arc_sparsification.py),
+# "window", to solve that many periods at a time (see rolling_horizon.py), and "lazy_linking", True to add
+# the open linking rows only where the LP relaxation violates them (see lazy_linking.py)
+# (at most one of "arcs_per_cluster", "window" and "lazy_linking"),
+# "reduced_scenarios", to solve the SCENARIOS model with that many representative scenarios
+# (see scenario_reduction.py), and "screen_candidates", True to drop candidates that can't be in an
+# optimal solution first (see candidate_screening.py).
+#
+# The input files are read once, and the runs made in parallel in a process pool, each solve
+# getting an equal share of the cores. With constants.sweep_warm_start() they are instead made one
+# after another, each starting from the build/open decisions of the run before (see warm_start.py).
+# Each run writes its files to its own subdirectory of constants.output_directory() (see get_run_name).
+# Objective, cost breakdown, build and solve times for every run are collected into one table,
+# saved as sweep_results.csv in constants.output_directory().
+#
+# python sweep.py [number of runs in parallel]
+#==================================================================================================================
+
+# input data read by the parent process, and the directories it reads data from and writes results to,
+# handed to each worker process once when it starts
+_input_data = {}
+_directories = {}
+
+
+def _set_input_data(input_data: dict, directories: dict = None):
+    _input_data.update(input_data)
+    _directories.update(directories or {})
+
+
+def get_run_name(configuration: dict) -> str:
+    """
+    name of the output subdirectory of a configuration, from every setting in it,
+    e.g. MECWLP_kmeans_cluster_size20_number_of_scenarios1
+    """
+    settings = [f"{name}{value}" for name, value in configuration.items()
+                if name not in ("model", "cluster_type") and value is not None]
+    return "_".join([configuration["model"], configuration["cluster_type"]] + settings)
+
+
+def run_configuration(configuration: dict, solver_threads: int = None, mip_start=None) -> dict:
+    """
+    Purpose of the function is to preprocess the input data for a single configuration from the sweep,
+    then build and solve its model, starting from mip_start (a warm_start.FirstStageSolution) when given.
+    Its output files go to their own subdirectory (get_run_name) of the output directory,
+    so runs going at once with the same clustering don't overwrite each other's files.
+    Returns the configuration along with the model results.
+    """
+    # run outside sweep(): keep the directories set by the caller
+    _directories.setdefault("data_directory", constants.get_filepath())
+    _directories.setdefault("output_directory", constants.output_directory())
+    output_directory = os.path.join(_directories["output_directory"], get_run_name(configuration))
+    # worker processes are reused between runs, so clear the last run's settings first
+    constants.reset_configuration()
+    constants.configure(cluster_type=configuration["cluster_type"],
+                        cluster_size=configuration.get("cluster_size"),
+                        number_of_scenarios=configuration.get("number_of_scenarios", 1),
+                        solver_threads=solver_threads,
+                        solver_backend=configuration.get("solver"),
+                        model_formulation=configuration.get("formulation"),
+                        delivery_arcs_per_cluster=configuration.get("arcs_per_cluster"),
+                        rolling_horizon_window=configuration.get("window"),
+                        lazy_linking=configuration.get("lazy_linking"),
+                        reduced_scenarios=configuration.get("reduced_scenarios"),
+                        screen_candidates=configuration.get("screen_candidates"),
+                        data_directory=_directories["data_directory"],
+                        output_directory=output_directory,
+                        # runs are already spread over the cores, so work through scenarios in this process
+                        number_of_workers=1)
+    solve_methods = get_solve_methods()
+    if len(solve_methods) > 1:
+        raise ValueError(f"{', '.join(solve_methods)} can't be used together, in {configuration}")
+
+    MECWLP_inputs, scenario_data = get_model_inputs(_input_data or None)
+
+    if configuration["model"] == "MECWLP":
+        model, model_inputs = MECWLP_model.MECWLP_model, MECWLP_inputs
+    elif configuration["model"] == "SCENARIOS":
+        model, model_inputs = SCENARIOS_model.SCENARIOS_model, get_SCENARIOS_inputs(MECWLP_inputs, scenario_data)
+        if constants.reduced_scenarios() is not None:
+            model_inputs = scenario_reduction.reduce_scenarios(model_inputs, constants.reduced_scenarios())
+    else:
+        raise ValueError(f"Unknown model: {configuration['model']}")
+
+    number_of_candidates = len(model_inputs[0])
+    if constants.screen_candidates():
+        model_inputs = candidate_screening.screen_candidates(configuration["model"], model_inputs)
+    results = model(*model_inputs, mip_start=mip_start)
+
+    return {"model": configuration["model"],
+            "cluster_type": constants.clustertype(),
+            "cluster_size": configuration.get("cluster_size"),
+            "number_of_scenarios": configuration.get("number_of_scenarios", 1),
+            "number_of_customers": len(MECWLP_inputs[4]),
+            "number_of_candidates": number_of_candidates,
+            "screen_candidates": constants.screen_candidates(),
+            "candidates_after_screening": len(model_inputs[0]),
+            "solver_threads": solver_threads,
+            "arcs_per_cluster": constants.delivery_arcs_per_cluster(),
+            "window": constants.rolling_horizon_window(),
+            "lazy_linking": constants.lazy_linking(),
+            "reduced_scenarios": constants.reduced_scenarios(),
+            "output_directory": output_directory,
+            **results}
+
+
+def sweep(configurations: list = None, workers: int = None, warm_start: bool = None) -> pd.DataFrame:
+    """
+    Purpose of the function is to run every configuration (default constants.sweep_configurations())
+    in a pool of workers (default constants.number_of_workers(), or one per configuration),
+    splitting the cores evenly between the runs going at once.
+    warm_start (default constants.sweep_warm_start()) makes the runs in order instead, one at a time,
+    each starting from the build/open decisions of the run before.
+    Returns one row of results per configuration, also saved to sweep_results.csv in constants.output_directory().
+    """
+    if configurations is None:
+        configurations = constants.sweep_configurations()
+    if warm_start is None:
+        warm_start = constants.sweep_warm_start()
+    if workers is None:
+        workers = constants.number_of_workers()
+    if workers is None or warm_start:
+        workers = 1 if warm_start else len(configurations)
+    workers = max(min(int(workers), len(configurations)), 1)
+    solver_threads = max((os.cpu_count() or 1) // workers, 1)
+
+    print(f"Running {len(configurations)} configurations, {workers} at a time with {solver_threads} solver threads each")
+    input_data = preprocessing.read_input_data()
+    directories = {"data_directory": constants.get_filepath(), "output_directory": constants.output_directory()}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_input_data, initargs=(input_data, directories)) as pool:
+        if warm_start:
+            rows = []
+            first_stage = None
+            for configuration in configurations:
+                rows.append(pool.submit(run_configuration, configuration, solver_threads, first_stage).result())
+                first_stage = rows[-1]["first_stage"] or first_stage
+        else:
+            futures = [pool.submit(run_configuration, configuration, solver_threads) for configuration in configurations]
+            rows = [future.result() for future in futures]
+    # the build/open decisions are saved by each run, not in the table
+    results = pd.DataFrame([{name: value for name, value in row.items() if name != "first_stage"} for row in rows])
+
+    results.to_csv(constants.get_output_path("sweep_results.csv"), index=False)
+    print(results.to_string(index=False))
+
+    return results
+
+
+if __name__ == "__main__":
+    sweep(workers=int(sys.argv[1]) if len(sys.argv) > 1 else None)
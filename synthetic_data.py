@@ -0,0 +1,147 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import constants
+
+# =============================================================================
+# Synthetic input data of any size, in the same schema as CaseStudyDataPY
+#
+# Districts are scattered over a 600km x 1000km area (eastings/northings in metres, as in
+# PostcodeDistricts.csv), with suppliers placed the same way. Distances, in miles, are straight
+# line distances times ROAD_FACTOR. Candidate j is district j, as in the case study data.
+# Demand of each district grows by a random rate each period, scenario demand varies around it.
+# Capacities are set so that every instance is feasible:
+#   - each candidate can hold a share (CANDIDATE_CAPACITY_SHARE) of the largest period's demand,
+#     and between them the candidates can hold CANDIDATE_CAPACITY_MARGIN times that demand
+#   - the suppliers of each product can supply SUPPLIER_CAPACITY_MARGIN times its largest demand
+#
+# The number of districts, candidates, suppliers, products, periods and scenarios are each set independently.
+# The postcodes (Reference PC) aren't real, so cluster by kmeans rather than by parliamentary constituency.
+#
+# python synthetic_data.py [directory] [districts] [candidates] [products] [periods] [scenarios]
+# =============================================================================
+
+AREA_METRES = (600000, 1000000)
+METRES_PER_MILE = 1609.344
+ROAD_FACTOR = 1.3
+# smallest and largest share of the largest period's demand a candidate can hold
+CANDIDATE_CAPACITY_SHARE = (0.2, 0.6)
+CANDIDATE_CAPACITY_MARGIN = 1.5
+SUPPLIER_CAPACITY_MARGIN = 2
+# setup cost per tonne of capacity, and operating cost per period as a share of the setup cost
+SETUP_COST_PER_TONNE = (0.2, 0.6)
+OPERATING_COST_SHARE = 0.05
+DISTANCE_CHUNK_ROWS = 1000
+
+
+def _distances(from_xy: np.ndarray, to_xy: np.ndarray) -> np.ndarray:
+    return np.sqrt(((from_xy[:, None, :] - to_xy[None, :, :]) ** 2).sum(axis=2)) * ROAD_FACTOR / METRES_PER_MILE
+
+
+def _write_distances(path: str, from_xy: np.ndarray, to_xy: np.ndarray):
+    """
+    Write the distance matrix from from_xy (rows 1, 2, ...) to to_xy (columns 1, 2, ...),
+    a chunk of rows at a time so the full matrix is never held in memory.
+    """
+    columns = np.arange(1, to_xy.shape[0] + 1)
+    with open(path, "w", newline="") as f:
+        for start in range(0, from_xy.shape[0], DISTANCE_CHUNK_ROWS):
+            rows = from_xy[start:start + DISTANCE_CHUNK_ROWS]
+            pd.DataFrame(_distances(rows, to_xy), index=np.arange(start + 1, start + rows.shape[0] + 1),
+                         columns=columns).to_csv(f, header=start == 0, float_format="%.3f")
+
+
+def _demand_rows(demand: np.ndarray, scenario: int = None) -> pd.DataFrame:
+    """
+    Demand (district, product, period) as rows of Customer, Product, Period[, Scenario], Demand.
+    """
+    customer, product, period = np.indices(demand.shape).reshape(3, -1) + 1
+    rows = {"Customer": customer, "Product": product, "Period": period}
+    if scenario is not None:
+        rows["Scenario"] = np.full(customer.size, scenario)
+    rows["Demand"] = demand.ravel()
+    return pd.DataFrame(rows)
+
+
+def generate_instance(directory: str, n_districts: int = 200, n_candidates: int = 30, n_products: int = 3,
+                      n_periods: int = 5, n_scenarios: int = 10, n_suppliers: int = None, seed: int = 0) -> str:
+    """
+    Purpose of the function is to write a synthetic instance with the given number of postcode districts,
+    candidates (at most n_districts), products, periods, scenarios and suppliers (default two per product)
+    to directory, in the same files and columns as CaseStudyDataPY.
+    Returns the directory.
+    """
+    if n_suppliers is None:
+        n_suppliers = 2 * n_products
+    if n_candidates > n_districts:
+        raise ValueError(f"Candidates are districts, so there can be at most {n_districts} candidates")
+    if n_suppliers < n_products:
+        raise ValueError(f"Every product needs a supplier, so there must be at least {n_products} suppliers")
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    # =============================================================================
+    # Postcode districts and suppliers
+    # =============================================================================
+    district_xy = rng.uniform(0, 1, size=(n_districts, 2)) * AREA_METRES
+    supplier_xy = rng.uniform(0, 1, size=(n_suppliers, 2)) * AREA_METRES
+    pd.DataFrame({"District ID": np.arange(1, n_districts + 1),
+                  "Reference PC": [f"SY{i}" for i in range(1, n_districts + 1)],
+                  "X (Easting)": district_xy[:, 0],
+                  "Y (Northing)": district_xy[:, 1]}).to_csv(f"{directory}/PostcodeDistricts.csv", index=False)
+    _write_distances(f"{directory}/Distance District-District.csv", district_xy, district_xy)
+    _write_distances(f"{directory}/Distance Supplier-District.csv", supplier_xy, district_xy)
+
+    # =============================================================================
+    # Demand (district, product, period), and for each scenario
+    # =============================================================================
+    size = rng.lognormal(0, 1, size=n_districts)
+    product_share = rng.dirichlet(np.ones(n_products))
+    growth = rng.normal(0.02, 0.03, size=(n_districts, 1, 1))
+    periods = np.arange(n_periods)[None, None, :]
+    demand = 100 * size[:, None, None] * product_share[None, :, None] * n_products * (1 + growth) ** periods
+    _demand_rows(demand).to_csv(f"{directory}/DemandPeriods.csv", index=False)
+
+    # each scenario has its own overall growth, and noise per district, product and period
+    largest_demand = demand.sum(axis=0).max(axis=1)
+    with open(f"{directory}/DemandPeriodScenarios.csv", "w", newline="") as f:
+        for sc in range(1, n_scenarios + 1):
+            scenario_growth = rng.normal(0, 0.03)
+            noise = rng.lognormal(0, 0.15, size=demand.shape)
+            scenario_demand = demand * (1 + scenario_growth) ** periods * noise
+            largest_demand = np.maximum(largest_demand, scenario_demand.sum(axis=0).max(axis=1))
+            _demand_rows(scenario_demand, sc).to_csv(f, header=sc == 1, index=False)
+
+    # =============================================================================
+    # Suppliers, vehicles and candidates
+    # =============================================================================
+    product_group = np.arange(n_suppliers) % n_products + 1
+    suppliers_per_product = np.bincount(product_group - 1, minlength=n_products)
+    pd.DataFrame({"Supplier": np.arange(1, n_suppliers + 1),
+                  "Product group": product_group,
+                  "Capacity": SUPPLIER_CAPACITY_MARGIN * largest_demand[product_group - 1]
+                              / suppliers_per_product[product_group - 1],
+                  "Vehicle type": rng.choice(list(constants.VehicleCapacity), size=n_suppliers)}
+                 ).to_csv(f"{directory}/Suppliers.csv", index=False)
+    pd.DataFrame({"Vehicle": list(constants.VehicleCapacity),
+                  "Capacity": list(constants.VehicleCapacity.values())}).to_csv(f"{directory}/vehicleType.csv",
+                                                                                 index=False)
+
+    candidates = np.arange(1, n_candidates + 1)
+    capacity = largest_demand.sum() * rng.uniform(*CANDIDATE_CAPACITY_SHARE, size=n_candidates)
+    # with only a few candidates, scale them up to hold it all
+    capacity *= max(1, CANDIDATE_CAPACITY_MARGIN * largest_demand.sum() / capacity.sum())
+    setup = capacity * rng.uniform(*SETUP_COST_PER_TONNE, size=n_candidates)
+    pd.DataFrame({"Candidate": candidates, "Capacity": capacity}).to_csv(f"{directory}/Candidates.csv", index=False)
+    pd.DataFrame({"Candidate": candidates, "Capacity": capacity}).to_csv(f"{directory}/Capacity.csv", index=False)
+    pd.DataFrame({"Candidate": candidates, "Setup cost": setup}).to_csv(f"{directory}/Setup.csv", index=False)
+    pd.DataFrame({"Candidate": candidates, "Operating cost": OPERATING_COST_SHARE * setup}
+                 ).to_csv(f"{directory}/Operating.csv", index=False)
+
+    return directory
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[2:7]]
+    generate_instance(sys.argv[1] if len(sys.argv) > 1 else "SyntheticDataPY", *arguments)
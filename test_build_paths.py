@@ -0,0 +1,76 @@
+import importlib.util
+import pytest
+import constants
+import matrix_builder
+import solvers
+import synthetic_data
+from main import get_model_inputs, get_SCENARIOS_inputs
+
+#==================================================================================================================
+# The MECWLP and SCENARIOS models give the same optimum however they're built and solved:
+#   - assembled as sparse arrays (matrix_builder) or one term at a time (the xpress generator build)
+#   - solved by each solver backend installed (see solvers.py)
+# on a small synthetic instance (see synthetic_data.py), against the arrays solved by scipy,
+# which needs nothing beyond scipy.
+#
+# python -m pytest
+#==================================================================================================================
+
+TOLERANCE = 1e-6
+
+
+def installed(backend: str) -> bool:
+    return importlib.util.find_spec({"xpress": "xpress", "highs": "highspy", "scipy": "scipy"}[backend]) is not None
+
+
+@pytest.fixture(scope="module")
+def model_inputs(tmp_path_factory):
+    """
+    Arguments of MECWLP_model and SCENARIOS_model for a synthetic instance of 30 districts, 6 candidates,
+    2 products, 3 periods and 2 scenarios, clustered into 5 clusters.
+    """
+    directory = tmp_path_factory.mktemp("synthetic")
+    synthetic_data.generate_instance(str(directory / "data"), n_districts=30, n_candidates=6, n_products=2,
+                                     n_periods=3, n_scenarios=2, seed=1)
+    constants.configure(data_directory=str(directory / "data"), output_directory=str(directory / "output"),
+                        cluster_size=5, number_of_scenarios=2, use_preprocessing_cache=False, number_of_workers=1)
+    MECWLP_inputs, scenario_data = get_model_inputs()
+    yield {"MECWLP": MECWLP_inputs, "SCENARIOS": get_SCENARIOS_inputs(MECWLP_inputs, scenario_data)}
+    constants.reset_configuration()
+
+
+def build_matrices(model: str, inputs: tuple) -> matrix_builder.ModelMatrices:
+    build = matrix_builder.build_MECWLP_matrices if model == "MECWLP" else matrix_builder.build_SCENARIOS_matrices
+    return build(*inputs, names=False)
+
+
+@pytest.fixture(scope="module")
+def reference_objectives(model_inputs):
+    return {model: solvers.solve_matrices(build_matrices(model, inputs), "scipy").objective
+            for model, inputs in model_inputs.items()}
+
+
+@pytest.mark.parametrize("model", ["MECWLP", "SCENARIOS"])
+@pytest.mark.parametrize("backend", solvers.BACKENDS)
+def test_backends_agree(model_inputs, reference_objectives, model, backend):
+    if not installed(backend):
+        pytest.skip(f"the {backend} solver backend isn't installed")
+    result = solvers.solve_matrices(build_matrices(model, model_inputs[model]), backend)
+    assert result.status == "optimal"
+    assert result.objective == pytest.approx(reference_objectives[model], rel=TOLERANCE)
+
+
+@pytest.mark.parametrize("model", ["MECWLP", "SCENARIOS"])
+@pytest.mark.parametrize("build_method", ["matrix", "generator"])
+def test_xpress_build_methods_agree(model_inputs, reference_objectives, model, build_method):
+    if not installed("xpress"):
+        pytest.skip("the generator build needs xpress")
+    import MECWLP_model
+    import SCENARIOS_model
+    build_problem = MECWLP_model.build_MECWLP_problem if model == "MECWLP" else SCENARIOS_model.build_SCENARIOS_problem
+    prob = build_problem(*model_inputs[model], build_method=build_method)[0]
+    solvers.import_xpress().setOutputEnabled(False)
+    prob.solve()
+    result = solvers.get_xpress_result(prob, with_solution=False)
+    assert result.status == "optimal"
+    assert result.objective == pytest.approx(reference_objectives[model], rel=TOLERANCE)
@@ -1,36 +1,96 @@
-
 import pandas as pd
+import numpy as np
+from collections.abc import Mapping
+import instrumentation
+
+
+class CostMapping(Mapping):
+    """
+    Read-only view of a cost array keyed by tuples of labels, e.g.
+    CostMapping(CostSupplierCandidate, Suppliers, Candidates)[(k, j)],
+    for code wanting the tuple-keyed dictionaries the cost functions used to return.
+    """
+
+    def __init__(self, costs: np.ndarray, *labels):
+        self.costs = costs
+        self.labels = [list(axis_labels) for axis_labels in labels]
+        self._positions = [{label: i for i, label in enumerate(axis_labels)} for axis_labels in self.labels]
+
+    def __getitem__(self, key):
+        return self.costs[tuple(positions[label] for positions, label in zip(self._positions, key))]
+
+    def __iter__(self):
+        return iter(pd.MultiIndex.from_product(self.labels))
+
+    def __len__(self):
+        return self.costs.size
+
+
+@instrumentation.timed()
 def get_CostSupplierCandidate(DistanceSupplierDistrict_df: pd.DataFrame, Suppliers_df: pd.DataFrame,
-                               VehicleCostPerMileAndTonneOverall: dict, Candidates, Suppliers)->dict:
-    # Cost from suppliers to candidate facilities
+                               VehicleCostPerMileAndTonneOverall: dict, Candidates, Suppliers)->np.ndarray:
+    # Cost from suppliers to candidate facilities, indexed (supplier, candidate) by position
     # Round-trip distance (factor 2)
     # Cost depends on supplier vehicle type
     # Division by 1000 converts from kg to tonnes
-    CostSupplierCandidate = {
-        (k, j): 2
-        * DistanceSupplierDistrict_df.loc[k, j]
-        * VehicleCostPerMileAndTonneOverall[
-            Suppliers_df.loc[k, "Vehicle type"]
-        ]
-        / 1000
-        for j in Candidates
-        for k in Suppliers
-    }
+    # .loc raises a KeyError for suppliers or candidates missing from the distances
+    distances = DistanceSupplierDistrict_df.loc[list(Suppliers), list(Candidates)].to_numpy(dtype=float)
+    vehicle_types = Suppliers_df.loc[list(Suppliers), "Vehicle type"]
+    unknown = ~vehicle_types.isin(list(VehicleCostPerMileAndTonneOverall))
+    if unknown.any():
+        raise KeyError(f"Vehicle types without a cost per mile and tonne: {sorted(set(vehicle_types[unknown]))}")
+    cost_per_mile_and_tonne = vehicle_types.map(VehicleCostPerMileAndTonneOverall).to_numpy(dtype=float)
+
+    CostSupplierCandidate = 2 * distances * cost_per_mile_and_tonne[:, None] / 1000
 
     return CostSupplierCandidate
 
+@instrumentation.timed()
 def get_CostCandidateCustomers(DistanceDistrictPeriod_df_dict: dict, VehicleCostPerMileAndTonneOverall: dict,
-                               Candidates, Customers, Times)->dict:
-    # Cost from candidate facilities to customers
+                               Candidates, Customers, Times)->np.ndarray:
+    # Cost from candidate facilities to customers, indexed (candidate, customer, period) by position
     # All transports use 3.5t vans (vehicle type 3)
-    CostCandidateCustomers = {
-        (j, i, t): 2
-        * DistanceDistrictPeriod_df_dict.get((i, t))[j-1]
-        * VehicleCostPerMileAndTonneOverall[3]
-        / 1000
-        for j in Candidates
-        for i in Customers
-        for t in Times
-    }
-
-    return CostCandidateCustomers
\ No newline at end of file
+    candidate_rows = np.asarray(Candidates) - 1
+    if hasattr(DistanceDistrictPeriod_df_dict, "distances"):
+        # array backed (constituency, period, district row) distances from preprocessing
+        distances = _get_candidate_customer_distances(DistanceDistrictPeriod_df_dict.distances,
+                                                      DistanceDistrictPeriod_df_dict.constituencies,
+                                                      DistanceDistrictPeriod_df_dict.periods,
+                                                      DistanceDistrictPeriod_df_dict.rows, Candidates, Customers, Times)
+    else:
+        distances = np.array([[DistanceDistrictPeriod_df_dict.get((i, t))[candidate_rows].to_numpy()
+                               for t in Times] for i in Customers]).transpose(2, 0, 1)
+
+    CostCandidateCustomers = 2 * distances * VehicleCostPerMileAndTonneOverall[3] / 1000
+
+    return CostCandidateCustomers
+
+
+def get_CostCandidateCustomers_scenario(sc: int, constituencies: list, periods: list, rows,
+                                        VehicleCostPerMileAndTonneOverall: dict, Candidates, Customers, Times,
+                                        scenario_distances: np.ndarray)->np.ndarray:
+    # Cost from candidate facilities to customers in scenario sc (by position), as get_CostCandidateCustomers,
+    # from the demand weighted distances of every scenario, indexed (scenario, constituency, period, district row)
+    # as in preprocessing.get_clustered_distance_scenarios, which scenario_pool shares with its workers
+    distances = _get_candidate_customer_distances(scenario_distances[sc], constituencies, periods, rows,
+                                                  Candidates, Customers, Times)
+
+    return 2 * distances * VehicleCostPerMileAndTonneOverall[3] / 1000
+
+
+def _get_candidate_customer_distances(distances: np.ndarray, constituencies: list, periods: list, rows,
+                                      Candidates, Customers, Times)->np.ndarray:
+    # (constituency, period, district row) distances as (candidate, customer, period)
+    constituency_position = _get_positions(constituencies, Customers, "Customers")
+    period_position = _get_positions(periods, Times, "Periods")
+    # district j is row j-1 of the distance matrix, and candidates are numbered by district
+    row_position = _get_positions(np.asarray(rows) + 1, Candidates, "Candidates")
+    return distances[np.ix_(constituency_position, period_position, row_position)].transpose(2, 0, 1)
+
+
+def _get_positions(labels, keys, name: str)->np.ndarray:
+    # position of each of keys in labels, rather than -1 (the last position) for keys that aren't there
+    positions = pd.Index(labels).get_indexer(keys)
+    if (positions < 0).any():
+        raise KeyError(f"{name} missing from the distances: {list(pd.Index(keys)[positions < 0])}")
+    return positions
@@ -0,0 +1,321 @@
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from dataclasses import dataclass
+import constants
+import matrix_builder
+import solvers
+
+# =============================================================================
+# Warm starts and incremental re-solves
+#
+# Related runs (other cluster sizes, scenario counts or demand) mostly end up with the same
+# build/open decisions. Those of one run, as saved to build_*.csv / open_*.csv or returned by
+# MECWLP_model / SCENARIOS_model, can be handed to the next as a MIP start: supply, warehoused
+# and delivered are continuous, so the solver works out the rest. Decisions are kept by
+# candidate label, so they carry over between runs with other clusterings, scenarios or
+# screened candidates (see candidate_screening).
+#
+# IncrementalModel keeps a model loaded in the solver and changes it in place - new demand and
+# costs for a scenario, or an added scenario - then re-solves from the last solution,
+# rather than building and loading the model again.
+# =============================================================================
+
+
+@dataclass
+class FirstStageSolution:
+    """
+    build (by candidate) and open (candidate by period) values, as saved to build_*.csv and open_*.csv.
+    Candidates left out were not built.
+    """
+    build: pd.Series
+    open: pd.DataFrame
+
+
+def get_first_stage_solution(Candidates, Times, build: np.ndarray, open: np.ndarray) -> FirstStageSolution:
+    """
+    FirstStageSolution from build (candidate) and open (candidate, period) arrays by position.
+    """
+    return FirstStageSolution(build=pd.Series(np.round(build), index=list(Candidates)),
+                              open=pd.DataFrame(np.round(open), index=list(Candidates), columns=list(Times)))
+
+
+def read_first_stage_solution(build_csv: str, open_csv: str) -> FirstStageSolution:
+    """
+    Purpose of the function is to read back the build/open decisions saved by
+    MECWLP_model or SCENARIOS_model (e.g. build_kmeans10.csv and open_kmeans10.csv).
+    """
+    build_df = pd.read_csv(build_csv, index_col=0)
+    open_df = pd.read_csv(open_csv, index_col=0)
+    open_df.columns = open_df.columns.astype(int)
+    return FirstStageSolution(build=build_df.iloc[:, 0], open=open_df)
+
+
+def get_mip_start(solution: FirstStageSolution, Candidates, Times) -> np.ndarray:
+    """
+    Purpose of the function is to turn a FirstStageSolution into values for the build and open columns
+    of a model over Candidates and Times, in column order (see matrix_builder).
+    Candidates not in the solution are left closed, and a candidate open in any period is built.
+    """
+    open = solution.open.reindex(index=list(Candidates), columns=list(Times), fill_value=0).to_numpy(dtype=float)
+    build = solution.build.reindex(list(Candidates), fill_value=0).to_numpy(dtype=float)
+    build = np.maximum(np.round(build), np.round(open).max(axis=1))
+    return np.concatenate([build, np.round(open).ravel()])
+
+
+class IncrementalModel:
+    """
+    A MECWLP (model 'MECWLP') or SCENARIOS (model 'SCENARIOS') model, given its arguments, kept loaded in
+    the solver (backend 'xpress' or 'highs', default constants.solver_backend()) between solves.
+
+    update_scenario gives a scenario new demand and costs, and add_scenario adds a scenario with a given
+    probability (scaling the probabilities of the others to leave room for it), changing only the coefficients,
+    right hand sides and objective terms that differ. Each scenario is weighted by its probability,
+    as in matrix_builder.build_SCENARIOS_matrices. Columns and rows are laid out as by matrix_builder, one scenario's
+    block after another. Each solve starts from the build/open decisions of the last one.
+    The time taken by each step is kept in log.
+    """
+
+    def __init__(self, model: str, model_inputs: tuple, backend: str = None, threads: int = None,
+                 time_limit: float = None, output: bool = False):
+        if backend is None:
+            backend = constants.solver_backend()
+        if backend not in ["xpress", "highs"]:
+            raise ValueError(f"Incremental re-solves need a solver backend that keeps the model loaded, "
+                             f"'xpress' or 'highs', not {backend}")
+        start = time.perf_counter()
+        arrays_list = matrix_builder.get_model_arrays_list(model, model_inputs)
+
+        self.model = model
+        self.backend = backend
+        self.threads = threads
+        self.time_limit = time_limit
+        self.output = output
+        self.Candidates, self.Times = model_inputs[0], model_inputs[1]
+        # the arguments of matrix_builder.get_model_arrays that are the same in every scenario
+        first = 5 if model == "MECWLP" else 6
+        self._shared_inputs = (model_inputs[:5] + model_inputs[first:first + 3], model_inputs[first + 5:first + 7])
+
+        arrays = arrays_list[0]
+        nC, nT = len(self.Candidates), len(self.Times)
+        self.pattern = matrix_builder.recourse_pattern(nC, len(model_inputs[2]), len(model_inputs[3]), nT,
+                                                       len(model_inputs[4]), arrays["product_group"],
+                                                       constants.model_formulation() == "aggregated")
+        self.n1 = self.pattern["n_first_stage"]
+        self.n2 = self.pattern["n_recourse"]
+        rows, cols, vals, rowtype, rhs = matrix_builder.first_stage_rows(nC, nT)
+        self.n_first_rows = rhs.size
+        self.rowtype = rowtype
+
+        self._load_first_stage(np.concatenate([arrays["setup"], np.repeat(arrays["operating"], nT)]),
+                               sp.csc_matrix((vals, (rows, cols)), shape=(rhs.size, self.n1)), rowtype, rhs)
+        self.scenarios = []
+        for arrays in arrays_list:
+            self._add_scenario(arrays, arrays["probability"])
+        self._reweight()
+
+        self.result = None
+        self.log = [{"action": "build", "scenarios": len(self.scenarios),
+                     "update_time": time.perf_counter() - start}]
+
+    # =============================================================================
+    # Changing the model
+    # =============================================================================
+    def update_scenario(self, scenario: int, DemandPeriodsGrouped, CostCandidateCustomers, TotalDemandProductPeriod_dict):
+        """
+        Give scenario (by position, 0 for the MECWLP model) new grouped demand, candidate-customer costs
+        and total demand, as they're passed to MECWLP_model.
+        """
+        start = time.perf_counter()
+        block, rhs, objcoef = self._values(self._scenario_arrays(DemandPeriodsGrouped, CostCandidateCustomers,
+                                                                 TotalDemandProductPeriod_dict))
+        old = self.scenarios[scenario]
+        first_row = self.n_first_rows + scenario * self.pattern["nrows"]
+        first_col = self.n1 + scenario * self.n2
+
+        changed = (block - old["block"]).tocoo()
+        changed_rows, changed_cols = changed.row, changed.col
+        values = np.asarray(block[changed_rows, changed_cols]).ravel()
+        self._change_coefficients(first_row + changed_rows,
+                                  np.where(changed_cols < self.n1, changed_cols, first_col + changed_cols - self.n1),
+                                  values)
+        changed_rhs = np.flatnonzero(rhs != old["rhs"])
+        self._change_rhs(first_row + changed_rhs, rhs[changed_rhs])
+        changed_obj = np.flatnonzero(objcoef != old["objcoef"])
+        self._change_objective(first_col + changed_obj, objcoef[changed_obj] * old["probability"])
+
+        self.scenarios[scenario] = {"block": block, "rhs": rhs, "objcoef": objcoef, "probability": old["probability"]}
+        self.log.append({"action": f"update scenario {scenario}", "scenarios": len(self.scenarios),
+                         "changed": changed_rows.size + changed_rhs.size + changed_obj.size,
+                         "update_time": time.perf_counter() - start})
+
+    def add_scenario(self, DemandPeriodsGrouped, CostCandidateCustomers, TotalDemandProductPeriod_dict,
+                     probability: float = None):
+        """
+        Add a scenario with the given grouped demand, candidate-customer costs and total demand,
+        and probability (default 1/number of scenarios with it added). The probabilities of the
+        other scenarios are scaled by 1 - probability, so they keep their relative weights.
+        """
+        start = time.perf_counter()
+        if probability is None:
+            probability = 1 / (len(self.scenarios) + 1)
+        if not 0 < probability < 1:
+            raise ValueError(f"The probability of an added scenario must be between 0 and 1, not {probability}")
+        for scenario in self.scenarios:
+            scenario["probability"] *= 1 - probability
+        self._add_scenario(self._scenario_arrays(DemandPeriodsGrouped, CostCandidateCustomers,
+                                                 TotalDemandProductPeriod_dict), probability)
+        self._reweight()
+        self.log.append({"action": "add scenario", "scenarios": len(self.scenarios),
+                         "update_time": time.perf_counter() - start})
+
+    def _scenario_arrays(self, DemandPeriodsGrouped, CostCandidateCustomers, TotalDemandProductPeriod_dict) -> dict:
+        shared, data = self._shared_inputs
+        return matrix_builder.get_model_arrays(*shared, DemandPeriodsGrouped, CostCandidateCustomers,
+                                               *data, TotalDemandProductPeriod_dict)
+
+    def _values(self, arrays: dict):
+        block, rhs, objcoef = matrix_builder.recourse_values(self.pattern, arrays["supplier_demand"],
+                                                             arrays["grouped_demand"],
+                                                             arrays["cost_supplier_candidate"],
+                                                             arrays["cost_candidate_customer"],
+                                                             arrays["supplier_capacity"],
+                                                             arrays["candidate_capacity"])
+        return block.tocsr(), rhs, objcoef
+
+    def _add_scenario(self, arrays: dict, probability: float):
+        block, rhs, objcoef = self._values(arrays)
+        # the new recourse columns only appear in the new rows, next to build/open
+        self._add_columns(objcoef, np.zeros(objcoef.size), matrix_builder.recourse_upper_bounds(self.pattern))
+        rows = sp.hstack([block[:, :self.n1], sp.csr_matrix((block.shape[0], len(self.scenarios) * self.n2)),
+                          block[:, self.n1:]], format="csr")
+        self._add_rows(self.pattern["rowtype"], rhs, rows)
+        self.rowtype = np.concatenate([self.rowtype, self.pattern["rowtype"]])
+        self.scenarios.append({"block": block, "rhs": rhs, "objcoef": objcoef, "probability": probability})
+
+    def _reweight(self):
+        # every scenario weighted by its probability, as in matrix_builder.build_SCENARIOS_matrices
+        self._change_objective(self.n1 + np.arange(len(self.scenarios) * self.n2),
+                               np.concatenate([scenario["objcoef"] * scenario["probability"]
+                                               for scenario in self.scenarios]))
+
+    # =============================================================================
+    # Solving
+    # =============================================================================
+    def solve(self, mip_start=None) -> solvers.SolverResult:
+        """
+        Solve the model as it stands, starting from mip_start (a FirstStageSolution, or build/open values
+        as from get_mip_start), by default the build/open decisions of the last solve.
+        """
+        if isinstance(mip_start, FirstStageSolution):
+            mip_start = get_mip_start(mip_start, self.Candidates, self.Times)
+        if mip_start is None and self.result is not None and self.result.has_solution:
+            mip_start = np.round(self.result.x[:self.n1])
+
+        if self.backend == "xpress":
+            solvers.import_xpress().setOutputEnabled(self.output)
+            if mip_start is not None:
+                self.prob.addMipSol(mip_start, list(range(len(mip_start))))
+            self.prob.solve()
+            self.result = solvers.get_xpress_result(self.prob)
+        else:
+            if mip_start is not None:
+                self.highs.setSolution(len(mip_start), np.arange(len(mip_start), dtype=np.int32),
+                                       np.asarray(mip_start, dtype=float))
+            start = time.perf_counter()
+            self.highs.run()
+            self.result = solvers.get_highs_result(self.highs, time.perf_counter() - start)
+
+        self.log.append({"action": "solve", "scenarios": len(self.scenarios), "warm_start": mip_start is not None,
+                         "status": self.result.status, "objective": self.result.objective,
+                         "solve_time": self.result.solve_time})
+        return self.result
+
+    def first_stage_solution(self) -> FirstStageSolution:
+        """
+        build/open decisions of the last solve.
+        """
+        x = self.result.x
+        nC = len(self.Candidates)
+        return get_first_stage_solution(self.Candidates, self.Times, x[:nC], x[nC:self.n1].reshape(nC, -1))
+
+    # =============================================================================
+    # Solver specific changes
+    # =============================================================================
+    def _load_first_stage(self, objcoef: np.ndarray, A: sp.csc_matrix, rowtype: np.ndarray, rhs: np.ndarray):
+        if self.backend == "xpress":
+            xp = solvers.import_xpress()
+            xp.setOutputEnabled(self.output)
+            self.prob = xp.problem(self.model)
+            self.prob.loadMIP(self.model, rowtype.tolist(), rhs, None, objcoef, A.indptr, None, A.indices, A.data,
+                              np.zeros(self.n1), np.ones(self.n1), coltype=["B"] * self.n1, entind=np.arange(self.n1))
+            if self.threads is not None:
+                self.prob.controls.threads = self.threads
+            if self.time_limit is not None:
+                self.prob.controls.maxtime = -int(self.time_limit)
+        else:
+            highspy = solvers.import_highspy()
+            row_lower, row_upper = solvers.row_bounds(rowtype, rhs)
+            lp = highspy.HighsLp()
+            lp.num_col_ = self.n1
+            lp.num_row_ = rhs.size
+            lp.col_cost_ = objcoef
+            lp.col_lower_ = np.zeros(self.n1)
+            lp.col_upper_ = np.ones(self.n1)
+            lp.row_lower_ = row_lower
+            lp.row_upper_ = row_upper
+            lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+            lp.a_matrix_.start_ = A.indptr
+            lp.a_matrix_.index_ = A.indices
+            lp.a_matrix_.value_ = A.data
+            lp.integrality_ = [highspy.HighsVarType.kInteger] * self.n1
+            self.highs = highspy.Highs()
+            self.highs.setOptionValue("output_flag", self.output)
+            if self.threads is not None:
+                self.highs.setOptionValue("threads", self.threads)
+            if self.time_limit is not None:
+                self.highs.setOptionValue("time_limit", float(self.time_limit))
+            self.highs.passModel(lp)
+
+    def _add_columns(self, objcoef: np.ndarray, lb: np.ndarray, ub: np.ndarray):
+        n = objcoef.size
+        if self.backend == "xpress":
+            self.prob.addCols(objcoef, np.zeros(n + 1, dtype=int), [], [], lb, ub)
+        else:
+            self.highs.addCols(n, objcoef, lb, ub, 0, np.zeros(n, dtype=np.int32),
+                               np.array([], dtype=np.int32), np.array([], dtype=float))
+
+    def _add_rows(self, rowtype: np.ndarray, rhs: np.ndarray, rows: sp.csr_matrix):
+        if self.backend == "xpress":
+            self.prob.addRows(rowtype.tolist(), rhs, None, rows.indptr, rows.indices, rows.data)
+        else:
+            row_lower, row_upper = solvers.row_bounds(rowtype, rhs)
+            self.highs.addRows(rhs.size, row_lower, row_upper, rows.nnz, rows.indptr[:-1].astype(np.int32),
+                               rows.indices.astype(np.int32), rows.data)
+
+    def _change_coefficients(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        if rows.size == 0:
+            return
+        if self.backend == "xpress":
+            self.prob.chgMCoef(rows.tolist(), cols.tolist(), values)
+        else:
+            for row, col, value in zip(rows, cols, values):
+                self.highs.changeCoeff(int(row), int(col), float(value))
+
+    def _change_rhs(self, rows: np.ndarray, rhs: np.ndarray):
+        if rows.size == 0:
+            return
+        if self.backend == "xpress":
+            self.prob.chgRHS(rows.tolist(), rhs)
+        else:
+            row_lower, row_upper = solvers.row_bounds(self.rowtype[rows], rhs)
+            self.highs.changeRowsBounds(rows.size, rows.astype(np.int32), row_lower, row_upper)
+
+    def _change_objective(self, cols: np.ndarray, objcoef: np.ndarray):
+        if cols.size == 0:
+            return
+        if self.backend == "xpress":
+            self.prob.chgObj(cols.tolist(), objcoef)
+        else:
+            self.highs.changeColsCost(cols.size, cols.astype(np.int32), objcoef)